@@ -1,46 +1,258 @@
 #!/usr/bin/env python3
 import argparse
+import json
+import logging
+import queue
+import subprocess
 import sys
-from datetime import datetime, timedelta
+import threading
 import time
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
 
+import watchdog.events
+import watchdog.observers
 
-now = datetime.now()
+logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s|%(levelname)s|%(threadName)s|%(message)s')
 
+MOTION_POST = Path(__file__).resolve().parent.joinpath('pc2-motion-post.py')
 
-parser = argparse.ArgumentParser('Auto Pull frames / clips from PiCam')
-parser.add_argument('--timelapse', action='store_true', help='Pull timelapse frames')
-parser.add_argument('--pause', help='Number of seconds to pause', type=int, default=30)
-parser.add_argument('host')
 
-args = parser.parse_args()
-HOST=args.host
+def parse_args():
+    parser = argparse.ArgumentParser('Auto Pull frames / clips from PiCam')
+    parser.add_argument('--timelapse', action='store_true', help='Pull timelapse frames')
+    parser.add_argument('--pause', help='Number of seconds to pause between pulls', type=int, default=30)
+    parser.add_argument('--jobs', type=int, default=2, help='Number of clips to post process at the same time')
+    parser.add_argument('--settle', type=float, default=5.0,
+                        help='Seconds a clip and its metadata must be unchanged before they are processed')
+    parser.add_argument('--orphan-timeout', type=float, default=3600.0,
+                        help='Seconds to wait for the clip of a metadata file before forgetting it. The metadata '
+                             'is written when a clip starts, so it can arrive well before the clip. Default: 3600')
+    parser.add_argument('--status-interval', type=float, default=60.0,
+                        help='Seconds between backlog / throughput reports')
+    parser.add_argument('--status-file', type=Path, default=None,
+                        help='Also write the backlog / throughput report to this file as JSON')
+    parser.add_argument('host')
+    return parser.parse_args()
 
-print(f'### Starting Auto pull from {HOST} at {now}')
 
 def run(cmd):
-    print(f' - RUN {cmd}')
-    p = subprocess.run(cmd.split())
+    logging.info(f' - RUN {cmd}')
+    try:
+        p = subprocess.run(cmd.split())
+    except OSError as e:
+        logging.error(f'# - ERROR RUNNING {cmd}: {e}')
+        return -1
     if p.returncode != 0:
-        print(f'# - ERROR RUNNING {cmd}')
-    print(p.stdout)
-            
-
-while True:
-    pull_command = f'./pull-from.sh {HOST}'
-    run(pull_command)
-
-    if not args.timelapse:
-        now = datetime.now()
-        yesterday = now - timedelta(days=1)
-        print('### Get last of yesterday')
-        # h264_cmd = f'python3 /Users/mark/git/pilapse/h264_to_mov.py {HOST}/{now.strftime("%Y%m%d")}-motion2/ --all --delete'
-        h264_cmd = f'python3 /Users/mark/git/pilapse/pc2-motion-post.py {HOST}/{yesterday.strftime("%Y%m%d")}-motion2'
-        run(h264_cmd)
-        # h264_cmd = f'python3 /Users/mark/git/pilapse/h264_to_mov.py {HOST}/{now.strftime("%Y%m%d")}-motion2/ --all --delete'
-        h264_cmd = f'python3 /Users/mark/git/pilapse/pc2-motion-post.py {HOST}/{now.strftime("%Y%m%d")}-motion2'
-        run(h264_cmd)
-
-    print(f'Restart in {args.pause/60:.1f} minutes (at {datetime.now() + timedelta(seconds=args.pause)})')
-    time.sleep(args.pause) # check every "args.pause" seconds
+        logging.error(f'# - ERROR RUNNING {cmd}')
+    return p.returncode
+
+
+def clip_key(path:Path):
+    """
+    Clips and their metadata files share the timestamp at the start of their names.
+    Returns (work_dir, directory, timestamp) or None if the path is not in a motion "raw" directory
+    """
+    directory = path.parent
+    raw_dir = directory.parent if directory.name == 'discards' else directory
+    if raw_dir.name != 'raw' or not raw_dir.parent.name.endswith('-motion2'):
+        return None
+    return raw_dir.parent, directory, path.name.split('_')[0]
+
+
+def find_data_file(directory:Path, timestamp:str):
+    """
+    The metadata file for the clip with this timestamp, or None if there is not exactly one
+    """
+    data_files = list(directory.glob(f'{timestamp}_*_data.txt'))
+    return data_files[0] if len(data_files) == 1 else None
+
+
+class PendingClip(object):
+    def __init__(self, work_dir:Path):
+        self.work_dir:Path = work_dir
+        self.clip:Path = None
+        self.data:Path = None
+        self.sizes = None
+        self.last_change = time.time()
+        self.last_seen = self.last_change
+
+    def is_settled(self, settle:float) -> bool:
+        """
+        True once both files exist and neither has changed size for `settle` seconds
+        """
+        if self.clip is None or self.data is None:
+            return False
+        try:
+            sizes = (self.clip.stat().st_size, self.data.stat().st_size)
+        except FileNotFoundError:
+            return False
+        now = time.time()
+        if sizes != self.sizes:
+            self.sizes = sizes
+            self.last_change = now
+            return False
+        return now - self.last_change >= settle
+
+    def is_orphan(self, timeout:float) -> bool:
+        """
+        True if the clip never arrived within `timeout` seconds of its metadata (e.g. it has already been
+        processed and deleted) or one of the files has gone away
+        """
+        if self.clip is None:
+            return time.time() - self.last_seen >= timeout
+        return not self.clip.exists() or (self.data is not None and not self.data.exists())
+
+
+class IngestDaemon(object):
+    class Handler(watchdog.events.PatternMatchingEventHandler):
+        def __init__(self, file_event_queue:queue.Queue):
+            watchdog.events.PatternMatchingEventHandler.__init__(self, patterns=['*.h264', '*_data.txt'],
+                                                                 ignore_directories=True,
+                                                                 case_sensitive=True)
+            self.out_queue:queue.Queue = file_event_queue
+
+        def on_created(self, event):
+            self.out_queue.put(event.src_path)
+
+        def on_modified(self, event):
+            self.out_queue.put(event.src_path)
+
+        def on_moved(self, event):
+            # rsync writes to a temporary name and renames it when the transfer is complete
+            self.out_queue.put(event.dest_path)
+
+    def __init__(self, args):
+        self.args = args
+        self.host_dir = Path(args.host)
+        self.file_events = queue.Queue()
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=args.jobs, thread_name_prefix='MotionPost')
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.start_time = time.time()
+        self.shutdown_event = threading.Event()
+        self.observer = None
+
+    def pull_loop(self):
+        while not self.shutdown_event.is_set():
+            run(f'./pull-from.sh {self.args.host}')
+            logging.info(f'Next pull in {self.args.pause/60:.1f} minutes '
+                         f'(at {datetime.now() + timedelta(seconds=self.args.pause)})')
+            self.shutdown_event.wait(self.args.pause)
+
+    def add_file(self, path:Path):
+        key = clip_key(path)
+        if key is None:
+            return
+        work_dir, directory, timestamp = key
+        pending = self.pending.setdefault((directory, timestamp), PendingClip(work_dir))
+        pending.last_seen = time.time()
+        if path.name.endswith('_data.txt'):
+            pending.data = path
+        elif path.suffix == '.h264':
+            pending.clip = path
+            if pending.data is None:
+                # the metadata may have arrived long before the clip and been forgotten
+                pending.data = find_data_file(directory, timestamp)
+
+    def scan_existing(self):
+        # pick up anything that arrived while the daemon was not running
+        for raw_dir in ['*-motion2/raw', '*-motion2/raw/discards']:
+            for path in self.host_dir.glob(f'{raw_dir}/*.h264'):
+                self.add_file(path)
+            # metadata of clips that have already been processed is left behind, skip it
+            for path in self.host_dir.glob(f'{raw_dir}/*_data.txt'):
+                key = clip_key(path)
+                if key is not None and (key[1], key[2]) in self.pending:
+                    self.add_file(path)
+        logging.info(f'Found {len(self.pending)} clips already in {self.host_dir}')
+
+    def process_clip(self, pending:PendingClip):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        returncode = run(f'{sys.executable} {MOTION_POST} {pending.work_dir} --clip {pending.clip}')
+        with self.lock:
+            self.running -= 1
+            if returncode == 0:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def dispatch_settled(self):
+        for key, pending in list(self.pending.items()):
+            if pending.is_orphan(self.args.orphan_timeout):
+                logging.debug(f'Dropping {pending.clip or pending.data}: clip is missing')
+                del self.pending[key]
+            elif pending.is_settled(self.args.settle):
+                del self.pending[key]
+                with self.lock:
+                    self.queued += 1
+                logging.info(f'Queue {pending.clip.name}')
+                self.executor.submit(self.process_clip, pending)
+
+    def status(self) -> dict:
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            return {
+                'time': datetime.now().isoformat(),
+                'waiting': len(self.pending),
+                'queued': self.queued,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed,
+                'clips_per_hour': self.completed * 3600 / elapsed if elapsed > 0 else 0.0
+            }
+
+    def report_status(self):
+        status = self.status()
+        logging.info(f'BACKLOG: {status["waiting"]} waiting, {status["queued"]} queued, {status["running"]} running. '
+                     f'DONE: {status["completed"]} ({status["failed"]} failed), '
+                     f'{status["clips_per_hour"]:.1f} clips/hour')
+        if self.args.status_file is not None:
+            with open(self.args.status_file, 'w') as f:
+                json.dump(status, f, indent=2)
+
+    def run(self):
+        logging.info(f'### Starting Auto pull from {self.args.host} at {datetime.now()}')
+        pull_thread = threading.Thread(target=self.pull_loop, name='Puller', daemon=True)
+        pull_thread.start()
+        if self.args.timelapse:
+            pull_thread.join()
+            return
+
+        self.host_dir.mkdir(parents=True, exist_ok=True)
+        self.observer = watchdog.observers.Observer()
+        self.observer.schedule(IngestDaemon.Handler(self.file_events), path=str(self.host_dir), recursive=True)
+        self.observer.start()
+        self.scan_existing()
+        next_status = time.time() + self.args.status_interval
+        try:
+            while True:
+                try:
+                    self.add_file(Path(self.file_events.get(timeout=1.0)))
+                    while True:
+                        self.add_file(Path(self.file_events.get_nowait()))
+                except queue.Empty:
+                    pass
+                self.dispatch_settled()
+                if time.time() >= next_status:
+                    self.report_status()
+                    next_status = time.time() + self.args.status_interval
+        except KeyboardInterrupt:
+            logging.info('Shutting down')
+        finally:
+            self.shutdown_event.set()
+            self.observer.stop()
+            self.observer.join()
+            self.executor.shutdown(wait=True)
+            self.report_status()
+
+
+if __name__ == '__main__':
+    IngestDaemon(parse_args()).run()
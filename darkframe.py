@@ -8,11 +8,11 @@ import pathlib
 import sys
 
 import cv2
-from pilapse.darkframe import apply_darkframe
+from pilapse.darkframe import HotPixelMask
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser('Test the "apply_darkframe" function')
-    parser.add_argument('--image', '-i', type=pathlib.Path, required=type,
+    parser.add_argument('--image', '-i', type=pathlib.Path, required=True,
                         help='Path to an image with the hot pixel issue')
     parser.add_argument('--darkimage', '-d', type=pathlib.Path, required=True,
                         help='Path to the dark frame to use for cleaning up the image')
@@ -20,6 +20,8 @@ if __name__ == '__main__':
                         help='Path to write the cleaned up image to. Default: "output.jpg')
     parser.add_argument('--threshold', '-t', type=int, default=7,
                         help='Threshold determines how large of a defect to try to fix')
+    parser.add_argument('--method', choices=['median', 'inpaint'], default='median',
+                        help='How to replace hot pixels. Default: median of the neighbouring pixels')
     parser.add_argument('--highlight', '-H', action='store_true',
                         help='Draw rectangles around the bad pixels in the output. '
                              'Use this to help choose other values')
@@ -39,14 +41,15 @@ if __name__ == '__main__':
     dark_img:pathlib.Path = config.darkimage
     if not dark_img.exists():
         parser.print_help()
-        logging.error('IMAGE must be a path to a file that exists.')
+        logging.error('DARKIMAGE must be a path to a file that exists.')
         sys.exit(1)
     logging.info(f'IMAGE: {image_in}')
-    logging.info(f'DARKIMAGE: {image_in}')
+    logging.info(f'DARKIMAGE: {dark_img}')
     img = cv2.imread(f'{image_in}')
-    dark_img = cv2.imread(f'{dark_img}')
+    hot_pixels = HotPixelMask.load(dark_img, threshold=config.threshold)
+    logging.info(f'{hot_pixels.count} hot pixels')
 
-    outimage = apply_darkframe(img, dark_img, highlight=config.highlight, threshold=config.threshold)
+    outimage = hot_pixels.apply(img, method=config.method, highlight=config.highlight)
     logging.info(f'Writing cleaned up image to {config.output}')
     cv2.imwrite(f'{config.output}', outimage)
     if config.show:
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class DataScaler:
     def __init__(self, data_limits, view_limits, clamp=False):
         self.data_limits = data_limits
@@ -30,6 +33,16 @@ class DataScaler:
         r = (data_value - self.data_min) / (self.data_max - self.data_min)
         return r * (self.view_max - self.view_min) + self.view_min
 
+    def scale_array(self, data_values):
+        """
+        Scale a sequence of values at once. Returns a float64 numpy array
+        """
+        data_values = np.asarray(data_values, dtype=np.float64)
+        if self.clamp:
+            data_values = np.clip(data_values, self.data_min, self.data_max)
+        r = (data_values - self.data_min) / (self.data_max - self.data_min)
+        return r * (self.view_max - self.view_min) + self.view_min
+
     @property
     def is_valid(self):
         if self.data_min is None or self.data_max is None or self.view_min is None or self.view_max is None:
@@ -7,6 +7,8 @@ import glob
 import cv2
 import os
 
+from pilapse.h264_remux import remux_h264
+
 parser = argparse.ArgumentParser('Convert h264 format video to mp4')
 parser.add_argument('--fps', type=float, help='FPS of h264 video')
 parser.add_argument('--delete', action='store_true', help='If set, delete the h264 file')
@@ -16,6 +18,10 @@ parser.add_argument('--intype', '-I', type=str, default='h264',
                     help='Type of input video. Default: h264')
 parser.add_argument('--outtype', '-O', type=str, default='mp4',
                     help='extension of output file. Default: "mp4". Video format will be mp4')
+parser.add_argument('--backend', type=str, choices=['remux', 'opencv'], default='remux',
+                    help='How to convert the video. "remux" (default) copies the h264 stream into the new container '
+                         'without decoding it (fast, lossless, h264 input only). '
+                         '"opencv" decodes and re-encodes every frame.')
 parser.add_argument('video_in', type=str, help='Path to video file to convert')
 config = parser.parse_args()
 
@@ -31,7 +37,19 @@ def convert_file(video_in, outtype):
             config.fps = float(m.group(1))
             print(f'FPS detected in filename: {config.fps}')
 
+    if config.backend == 'remux' and config.intype == 'h264':
+        frame_count = remux_h264(video_in, outfile, fps=config.fps)
+        print(f' - Remuxed {frame_count} frames')
+    else:
+        frame_count = reencode_file(video_in, outfile)
 
+    print(f' - Done: {outfile}')
+    if config.delete:
+        print(f'   - deleting {video_in}')
+        os.remove(video_in)
+    return frame_count
+
+def reencode_file(video_in, outfile):
     video_cap = cv2.VideoCapture(video_in)
     frame_width = int(video_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_height = int(video_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -55,11 +73,6 @@ def convert_file(video_in, outtype):
     # we also need to close the video and destroy all Windows
     video_cap.release()
     video.release()
-
-    print(f' - Done: {outfile}')
-    if config.delete:
-        print(f'   - deleting {video_in}')
-        os.remove(video_in)
     return frame_count
 
 video_in = config.video_in
@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+import csv
+import glob
+import time
 from datetime import datetime
 
 import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base
 import sqlalchemy.types as types
-from sqlalchemy.orm import sessionmaker
 
 class TZDateTime(types.TypeDecorator):
     impl = sqlalchemy.DateTime
@@ -46,9 +48,32 @@ class CameraSettingsData(Base):
     app_name = sqlalchemy.Column('app_name', sqlalchemy.String)
     pi_model = sqlalchemy.Column('pi_model', sqlalchemy.String)
     hostname = sqlalchemy.Column('hostname', sqlalchemy.String)
+    # the same frame from the same camera is only stored once, so importing a log twice is harmless
+    __table_args__ = (sqlalchemy.Index('ix_camera_settings_hostname_timestamp', 'hostname', 'timestamp', unique=True),)
+
+FIELDS = ['timestamp', 'shutter_speed', 'iso', 'aperture', 'awb_mode', 'meter_mode', 'exposure_mode',
+          'analog_gain', 'digital_gain', 'lux', 'camera_model', 'app_name', 'pi_model', 'hostname']
+TIMESTAMP_FORMAT = '%Y/%m/%d %H:%M:%S.%f'
+
+def to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        # lux is "None" (or empty) on cameras without a light meter
+        return None
+
+def parse_row(row:list) -> dict:
+    record = dict(zip(FIELDS, (field.strip() for field in row)))
+    for name in FIELDS[len(row):]:
+        record[name] = ''
+    record['timestamp'] = datetime.strptime(record['timestamp'], TIMESTAMP_FORMAT)
+    for name in ('shutter_speed', 'aperture', 'analog_gain', 'digital_gain', 'lux'):
+        record[name] = to_float(record[name])
+    record['iso'] = int(record['iso'])
+    return record
 
 class CameraSettingsDatabase:
-    MAX_COMMIT = 10000 # maximum number of records in single commit
+    CHUNK_SIZE = 10000 # number of rows in each executemany
     def __init__(self):
         self.db_path = None
         self.db_engine = None
@@ -59,41 +84,78 @@ class CameraSettingsDatabase:
         uri = f'sqlite:///{self.db_path}'
         print(uri)
         self.db_engine = sqlalchemy.create_engine(uri, echo = echo)
+
+        @sqlalchemy.event.listens_for(self.db_engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+
         self.metadata = Base.metadata # sqlalchemy.MetaData(self.db_engine)
         Base.metadata.create_all(self.db_engine)
-        self.db_engine.connect()
+        self.add_unique_index()
         print('database open')
         return self.db_engine
 
-    def _open_session(self):
-        if not self.db_engine:
-            return None
-        Session = sessionmaker(bind = self.db_engine)
-        return Session()
-
-    def insert_records(self, records, callback=None):
-        with self._open_session() as session:
-            count = 0
-            for record in records:
-                session.add(record)
-                count += 1
-                if count % self.MAX_COMMIT == 0:
-                    print(f' - Committing {count} records...')
-                    session.commit()
+    def add_unique_index(self):
+        """
+        Databases created before the unique index existed may hold duplicates. Remove them and add the index.
+        """
+        table = CameraSettingsData.__table__
+        index = next(iter(table.indexes))
+        existing = [i['name'] for i in sqlalchemy.inspect(self.db_engine).get_indexes(TABLE_NAME)]
+        if index.name in existing:
+            return
+        with self.db_engine.begin() as connection:
+            keep = sqlalchemy.select(sqlalchemy.func.min(table.c.id)).group_by(table.c.hostname, table.c.timestamp)
+            result = connection.execute(table.delete().where(table.c.id.not_in(keep)))
+            print(f' - Removed {result.rowcount} duplicate records')
+            index.create(connection)
+
+    def insert_rows(self, rows, callback=None):
+        """
+        Insert dicts from `rows` in chunks, skipping records already in the database.
+        Returns (rows read, rows inserted)
+        """
+        statement = sqlalchemy.insert(CameraSettingsData.__table__).prefix_with('OR IGNORE')
+        count = 0
+        with self.db_engine.begin() as connection:
+            changes_before = connection.exec_driver_sql('SELECT total_changes()').scalar()
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= self.CHUNK_SIZE:
+                    connection.execute(statement, chunk)
+                    count += len(chunk)
+                    chunk = []
                     if callback:
                         callback(count)
-            if count > 0:
-                print(f' - Committing {count} records...')
-                session.commit()
+            if chunk:
+                connection.execute(statement, chunk)
+                count += len(chunk)
                 if callback:
                     callback(count)
+            inserted = connection.exec_driver_sql('SELECT total_changes()').scalar() - changes_before
+        return count, inserted
+
+def read_rows(path, errors:list):
+    with open(path, newline='') as f:
+        for line_number, row in enumerate(csv.reader(f), start=1):
+            if not row:
+                continue
+            try:
+                yield parse_row(row)
+            except (ValueError, IndexError) as e:
+                errors.append(f'{path}:{line_number}: {e}')
 
 def parse_command_line():
     parser = argparse.ArgumentParser('Import camera settings data into sqlite database')
     parser.add_argument('--db', type=str, required=True,
                         help='Path to database. Will be created or added to.')
-    parser.add_argument('--input', type=str, required=True,
-                        help='path to csv file of camera settings data')
+    parser.add_argument('--input', type=str, required=True, nargs='+',
+                        help='path(s) or glob patterns of csv files of camera settings data. '
+                             'Records already in the database are skipped')
 
     return parser.parse_args()
 
@@ -102,32 +164,31 @@ if __name__ == '__main__':
     db = CameraSettingsDatabase()
     db.open_database(config.db)
 
-    records = []
-
-    def make_datetime(datetime_string):
-        format = '%Y/%m/%d %H:%M:%S.%f'
-        d = datetime.strptime(datetime_string, format)
-        return d
-
-    with open(config.input) as f:
-        for line in f.readlines():
-            record_in = line.split(',')
-            nfields = len(record_in)
-            record_out = CameraSettingsData(
-                timestamp = make_datetime(record_in[0]),
-                shutter_speed = record_in[1],
-                iso = record_in[2],
-                aperture = record_in[3],
-                awb_mode = record_in[4],
-                meter_mode = record_in[5],
-                exposure_mode = record_in[6],
-                analog_gain = record_in[7],
-                digital_gain = record_in[8],
-                lux = record_in[9],
-                camera_model = record_in[10] if nfields > 10 else '',
-                app_name = record_in[11] if nfields > 11 else '',
-                pi_model = record_in[12] if nfields > 12 else '',
-                hostname = record_in[13] if nfields > 13 else ''
-            )
-            records.append(record_out)
-    db.insert_records(records)
\ No newline at end of file
+    paths = []
+    for pattern in config.input:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    total_read = 0
+    total_inserted = 0
+    start = time.time()
+    for path in paths:
+        print(f'Importing {path}')
+        errors = []
+        file_start = time.time()
+
+        def report(count):
+            elapsed = time.time() - file_start
+            print(f' - {count} rows, {count / elapsed if elapsed > 0 else 0:.0f} rows/s')
+
+        nread, ninserted = db.insert_rows(read_rows(path, errors), callback=report)
+        for error in errors[:10]:
+            print(f' - Skipped bad line {error}')
+        if len(errors) > 10:
+            print(f' - ... and {len(errors) - 10} more bad lines')
+        print(f' - {ninserted} new, {nread - ninserted} already in database')
+        total_read += nread
+        total_inserted += ninserted
+
+    elapsed = time.time() - start
+    print(f'Imported {total_inserted} of {total_read} rows from {len(paths)} files in {elapsed:.1f} seconds '
+          f'({total_read / elapsed if elapsed > 0 else 0:.0f} rows/s)')
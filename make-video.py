@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 import argparse
 import glob
+import math
 import os
 import subprocess
 import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 from datetime import datetime, timedelta
 
-from pilapse.darkframe import apply_darkframe, get_contours
+from pilapse.darkframe import HotPixelMask
 
 def parse_args():
     parser = argparse.ArgumentParser('Make a directory full of images into a video')
@@ -17,27 +21,111 @@ def parse_args():
                         help='Frames Per Second of video. (default: 24)',
                         default=24)
     parser.add_argument('--type', help='type of image file (extension: png, jpg, etc)')
-    parser.add_argument('--output', help='name / path of output file: default: "output.mov"', default='output.mov')
+    parser.add_argument('--output', action='append', default=None,
+                        help='name / path of output file: default: "output.mov". May be given more than once to write '
+                             'several videos from one decode pass. Options can follow the path, separated by commas: '
+                             'size=WxH (or W or xH to keep the aspect ratio), fps=N, codec=FOURCC. '
+                             'Example: --output share.mp4,size=x720,fps=30')
     parser.add_argument('imgdir', help='path to directory holding images')
     parser.add_argument('--skip', type=int, default=0,
                         help='Number of frames to skip. Default is zero. Zero frames are skipped, so all frames are '
                              'used. If set to 1, everyother frame is used; if set to 2, every 3rd frame is used; etc.')
     parser.add_argument('--open', action='store_true', help='Try to open movie when finished')
+    parser.add_argument('--readers', type=int, default=min(4, os.cpu_count() or 1),
+                        help='Number of threads decoding (and darkframe correcting) frames ahead of the encoder')
+    parser.add_argument('--preview', type=int, choices=[2, 4, 8], default=None,
+                        help='Quick low resolution preview. Decode the images at 1/PREVIEW size, which is much '
+                             'faster than decoding at full size.')
     darkgroup = parser.add_argument_group('Using Darkframe to clean up dead / hot pixels')
     darkgroup.add_argument('--darkframe', help='specify a "dark frame" to subract from each frame to '
                                             'eliminate "hot pixels"')
     darkgroup.add_argument('--threshold', '-t', type=int, default=7,
                         help='Threshold determines how large of a defect to try to fix')
+    darkgroup.add_argument('--method', choices=['median', 'inpaint'], default='median',
+                           help='How to replace hot pixels. (default: median of the neighbouring pixels)')
 
     return parser.parse_args()
 
+class VideoOutput(object):
+    """
+    One output video, described by "path[,size=WxH][,fps=N][,codec=FOURCC]"
+    """
+    def __init__(self, spec:str, default_fps:int):
+        fields = spec.split(',')
+        self.path = fields[0]
+        self.size_spec = None
+        self.size = None
+        self.fps = default_fps
+        self.codec = 'mp4v'
+        self.writer = None
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            key = key.strip()
+            if key == 'size':
+                self.size_spec = value.strip()
+            elif key == 'fps':
+                self.fps = float(value)
+            elif key == 'codec':
+                self.codec = value.strip()
+            else:
+                raise ValueError(f'Unknown output option "{key}" in "{spec}"')
+        if len(self.codec) != 4:
+            raise ValueError(f'codec must be a four character code: "{self.codec}"')
+
+    def set_source_size(self, width, height):
+        if not self.size_spec:
+            self.size = (width, height)
+            return
+        w, _, h = self.size_spec.lower().partition('x')
+        w = int(w) if w else None
+        h = int(h) if h else None
+        if w is None and h is None:
+            raise ValueError(f'Bad size "{self.size_spec}"')
+        if w is None:
+            w = round(width * h / height)
+        if h is None:
+            h = round(height * w / width)
+        # most codecs want even dimensions
+        self.size = (w + w % 2, h + h % 2)
+
+    def open(self):
+        fourcc = cv2.VideoWriter_fourcc(*self.codec)
+        self.writer = cv2.VideoWriter()
+        if not self.writer.open(self.path, fourcc, self.fps, self.size, True):
+            print(f'Unable to open {self.path} ({self.codec}, {self.size[0]}x{self.size[1]})')
+            sys.exit(1)
+        print(f'Writing {self.path}: {self.size[0]}x{self.size[1]}, {self.fps} fps, {self.codec}')
+
+    def write(self, image):
+        self.writer.write(image)
+
+    def release(self):
+        self.writer.release()
+
+
+def make_pyramid(image, sizes):
+    """
+    Resize image to each of sizes, largest first, resizing each from the smallest image already made that is
+    at least as big so the outputs share the work.
+    """
+    height, width = image.shape[:2]
+    variants = {(width, height): image}
+    for size in sorted(sizes, key=lambda sz: sz[0] * sz[1], reverse=True):
+        if size in variants:
+            continue
+        candidates = [sz for sz in variants if sz[0] >= size[0] and sz[1] >= size[1]]
+        source = min(candidates, key=lambda sz: sz[0] * sz[1]) if candidates else (width, height)
+        variants[size] = cv2.resize(variants[source], size, interpolation=cv2.INTER_AREA)
+    return variants
+
 print(sys.argv)
 
 config = parse_args()
 
 IMAGE_DIR = config.imgdir
 
-darkframe = None if config.darkframe is None else cv2.imread(config.darkframe)
+# the hot pixel mask is cached next to the darkframe
+darkframe = None if config.darkframe is None else HotPixelMask.load(config.darkframe, threshold=config.threshold)
 
 if not os.path.isdir(IMAGE_DIR):
     print(f'image dir does not exist or is not a directory.')
@@ -51,69 +139,112 @@ if len(filelist) < 1:
     print(f'No files found in {IMAGE_DIR}')
     sys.exit(1)
 
-img1 = cv2.imread(filelist[0])
+IMREAD_FLAGS = cv2.IMREAD_COLOR
+if config.preview is not None:
+    IMREAD_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[config.preview]
+
+img1 = cv2.imread(filelist[0], IMREAD_FLAGS)
 
 
 height, width, _ = img1.shape
 print(f'Image Size: {width} x {height} ({total} frames)')
-dark_contours = None
 if darkframe is not None:
-    dh, dw, _ = darkframe.shape
-    if dh != height or dw != width:
+    dh, dw = darkframe.shape
+    scale = config.preview or 1
+    if math.ceil(dh / scale) != height or math.ceil(dw / scale) != width:
         print(f'Dark frame size must match input images.')
         sys.exit(1)
-    dark_contours, _ = get_contours(darkframe, threshold=config.threshold)
+    darkframe = darkframe.scaled(width, height)
+    print(f'Replacing {darkframe.count} hot pixels')
 
 img1 = None
 
-# choose codec according to format needed
-#fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-#fourcc = cv2.VideoWriter_fourcc(*'avc1')
-#video = cv2.VideoWriter('video.avi', fourcc, 1, (width, height))
-
+outputs = [VideoOutput(spec, config.fps) for spec in (config.output or ['output.mov'])]
+for output in outputs:
+    output.set_source_size(width, height)
+    output.open()
+output_sizes = set(output.size for output in outputs)
 
-fps = config.fps
+# skipped files are never touched
+# same frames as before: skip the first `skip`, then keep every (skip+1)th
+filelist = filelist[config.skip::config.skip + 1]
+total = len(filelist)
 
-capSize = (width,height) # this is the size of my source video
-fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v') # note the lower case
-video = cv2.VideoWriter()
-success = video.open(config.output,fourcc,fps,capSize,True)
+def load_frame(file):
+    """
+    Runs on a reader thread. Returns the image at each output size and the time spent decoding, applying
+    the darkframe and resizing
+    """
+    t0 = time.perf_counter()
+    img = cv2.imread(file, IMREAD_FLAGS)
+    t1 = time.perf_counter()
+    if img is None:
+        return None, t1 - t0, 0.0, 0.0
+    if darkframe is not None:
+        img = darkframe.apply(img, method=config.method, inplace=True)
+    t2 = time.perf_counter()
+    variants = make_pyramid(img, output_sizes)
+    return variants, t1 - t0, t2 - t1, time.perf_counter() - t2
 
 start = datetime.now()
 count = 0
+decode_time = dark_time = resize_time = encode_time = wait_time = 0.0
 
-skipped = 0
 loop_start = datetime.now()
-for file in filelist:
-    if skipped < config.skip:
-        skipped += 1
+readers = max(1, config.readers)
+with ThreadPoolExecutor(max_workers=readers, thread_name_prefix='Reader') as executor:
+    # bounded, ordered prefetch buffer
+    pending = deque()
+    files = iter(filelist)
+    def fill():
+        while len(pending) < readers * 2:
+            file = next(files, None)
+            if file is None:
+                return
+            pending.append((file, executor.submit(load_frame, file)))
+    fill()
+    while pending:
+        file, future = pending.popleft()
+        t0 = time.perf_counter()
+        variants, decode_seconds, dark_seconds, resize_seconds = future.result()
+        wait_time += time.perf_counter() - t0
+        fill()
+        decode_time += decode_seconds
+        dark_time += dark_seconds
+        resize_time += resize_seconds
         count += 1
-        continue
-    skipped = 0
-    img = cv2.imread(file)
-    if img is None:
-        print(f'Could not load {file}')
-        continue
-    if darkframe is not None:
-        img = apply_darkframe(img, dark_contours)
-    video.write(img)
-
-    count += 1
-    now = datetime.now()
-    elapsed = now - start
-    if elapsed.total_seconds() > 10:
-        start = now
-        loop_elapsed = now - loop_start
-        fps = count/loop_elapsed.total_seconds()
-        x = (total / fps) - loop_elapsed.total_seconds()
-        remaining = str(timedelta(seconds=x)).split('.')[0]
-        print(f'{count:5}/{total:5} {count/total*100:2.0f}%: {file} {remaining}')
+        if variants is None:
+            print(f'Could not load {file}')
+            continue
+        t0 = time.perf_counter()
+        for output in outputs:
+            output.write(variants[output.size])
+        encode_time += time.perf_counter() - t0
+        variants = None
+
+        now = datetime.now()
+        elapsed = now - start
+        if elapsed.total_seconds() > 10:
+            start = now
+            loop_elapsed = now - loop_start
+            fps = count/loop_elapsed.total_seconds()
+            x = (total / fps) - loop_elapsed.total_seconds()
+            remaining = str(timedelta(seconds=x)).split('.')[0]
+            print(f'{count:5}/{total:5} {count/total*100:2.0f}%: {file} {remaining}')
+            # reader stages run on `readers` threads, so their throughput scales with the thread count
+            stages = f'    decode: {count * readers / max(decode_time, 1e-6):6.1f} fps'
+            if darkframe is not None:
+                stages += f', darkframe: {count * readers / max(dark_time, 1e-6):6.1f} fps'
+            if resize_time > 0:
+                stages += f', resize: {count * readers / resize_time:6.1f} fps'
+            stages += f', encode: {count / max(encode_time, 1e-6):6.1f} fps'
+            print(f'{stages}, encoder waiting {wait_time / loop_elapsed.total_seconds() * 100:.0f}% of the time')
 
 cv2.destroyAllWindows()
-video.release()
-
-print(f'video written to {config.output}')
+for output in outputs:
+    output.release()
+    print(f'video written to {output.path}')
 
 if config.open:
     print(f' - Opening movie')
-    subprocess.Popen(['open', config.output])
\ No newline at end of file
+    subprocess.Popen(['open', outputs[0].path])
\ No newline at end of file
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import logging
+import os
+import pathlib
+import sys
+
+logging.basicConfig(level=logging.INFO, stream=sys.stdout)
+
+import cv2
+from pilapse.darkframe import HotPixelMask
+from pilapse.master_dark import MasterDarkBuilder
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Build a master dark frame and hot pixel map from many dark exposures')
+    parser.add_argument('frames', nargs='+',
+                        help='Dark frames to combine, or a directory holding them')
+    parser.add_argument('--type', default='jpg', help='type of image file when FRAMES is a directory. (default: jpg)')
+    parser.add_argument('--output', '-o', type=pathlib.Path, default='master_dark.png',
+                        help='Path to write the master dark to. Use a lossless format. Default: "master_dark.png"')
+    parser.add_argument('--method', choices=MasterDarkBuilder.METHODS, default='median',
+                        help='How to combine the frames. Default: median')
+    parser.add_argument('--sigma', type=float, default=3.0,
+                        help='Values further than this many standard deviations from the median are rejected '
+                             'by sigma-clip. Default: 3.0')
+    parser.add_argument('--max-memory', type=int, default=256,
+                        help='Approximate memory budget in MB for combining frames. Default: 256')
+    parser.add_argument('--workdir', default=None,
+                        help='Directory for the temporary frame stack. Needs room for all of the frames. '
+                             'Default: system temp dir')
+    parser.add_argument('--threshold', '-t', type=int, default=7,
+                        help='Threshold for the hot pixel map, on the 8 bit (0-255) scale. 16 bit master darks '
+                             'are scaled to 8 bits before thresholding. Default: 7')
+    config = parser.parse_args()
+
+    paths = []
+    for f in config.frames:
+        if os.path.isdir(f):
+            paths.extend(glob.glob(os.path.join(f, f'*.{config.type}')))
+        else:
+            paths.append(f)
+    paths.sort()
+    if len(paths) < 1:
+        logging.error('No dark frames found')
+        sys.exit(1)
+    logging.info(f'Combining {len(paths)} dark frames')
+
+    builder = MasterDarkBuilder(method=config.method, sigma=config.sigma, max_memory_mb=config.max_memory,
+                                work_dir=config.workdir)
+    master = builder.build(paths)
+    cv2.imwrite(str(config.output), master)
+    logging.info(f'Wrote master dark from {builder.nframes} frames to {config.output}')
+
+    # saved where HotPixelMask.load() looks for it, so make-video.py and darkframe.py pick it up
+    hot_pixels = HotPixelMask.from_darkframe(master, threshold=config.threshold)
+    mask_path = HotPixelMask.mask_path(config.output, threshold=config.threshold)
+    hot_pixels.save(mask_path)
+    logging.info(f'Wrote hot pixel map with {hot_pixels.count} hot pixels to {mask_path}')
@@ -1,7 +1,13 @@
 import argparse
+import csv
 import glob
+import json
 import os
 import subprocess
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import cv2
 
@@ -36,7 +42,9 @@ commands = {
     'o': 'Open the image in preview',
     'd': 'Toggle debug mode (show rects of all "movement")',
     'm': 'Toggle show motion (show rects of "movement" that match criteria',
-    'n': 'add a NOTE to notes file'
+    'n': 'add a NOTE to notes file',
+    ']': 'Jump to the next candidate (see --candidates)',
+    '[': 'Jump to the previous candidate (see --candidates)'
 }
 
 def show_help():
@@ -99,7 +107,141 @@ def add_note(image, args):
     with open(notes_file, mode) as notes:
         notes.write(f'{image.filename} {sep}{t}{description}\n')
 
-def detect_stuff(filelist, window_name, args):
+class FrameCache(object):
+    """
+    LRU cache of decoded frames, bounded by bytes. A background thread decodes the frames
+    ahead of the current position in the direction of play.
+    """
+    def __init__(self, filelist, max_bytes:int, prefetch:int=8):
+        self.filelist = filelist
+        self.max_bytes = max_bytes
+        self.prefetch = prefetch
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.loading = set()
+        self.position = 0
+        self.direction = 1
+        self.running = True
+        self.condition = threading.Condition()
+        self.hits = self.misses = 0
+        self.prefetch_thread = threading.Thread(target=self.prefetch_loop, name='Prefetch', daemon=True)
+        self.prefetch_thread.start()
+
+    def _add(self, index, image):
+        # called with the condition held
+        if image is None or index in self.frames:
+            return
+        self.frames[index] = image
+        self.nbytes += image.nbytes
+        while self.nbytes > self.max_bytes and len(self.frames) > 1:
+            _, old = self.frames.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def get(self, index):
+        with self.condition:
+            while index in self.loading:
+                self.condition.wait()
+            if index in self.frames:
+                self.hits += 1
+                self.frames.move_to_end(index)
+                return self.frames[index]
+            self.misses += 1
+            self.loading.add(index)
+        image = cv2.imread(self.filelist[index])
+        with self.condition:
+            self.loading.discard(index)
+            self._add(index, image)
+            self.condition.notify_all()
+        return image
+
+    def set_position(self, index, direction):
+        with self.condition:
+            self.position = index
+            self.direction = direction
+            self.condition.notify_all()
+
+    def next_to_prefetch(self):
+        # called with the condition held
+        for n in range(1, self.prefetch + 1):
+            index = self.position + n * self.direction
+            if index < 0 or index >= len(self.filelist):
+                return None
+            if index not in self.frames and index not in self.loading:
+                return index
+        return None
+
+    def prefetch_loop(self):
+        while True:
+            with self.condition:
+                index = self.next_to_prefetch()
+                while self.running and index is None:
+                    self.condition.wait()
+                    index = self.next_to_prefetch()
+                if not self.running:
+                    return
+                self.loading.add(index)
+            image = cv2.imread(self.filelist[index])
+            with self.condition:
+                self.loading.discard(index)
+                # don't let a frame we already passed push out frames we still need
+                ahead = (index - self.position) * self.direction
+                if 0 < ahead <= self.prefetch:
+                    self._add(index, image)
+                self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.prefetch_thread.join()
+
+
+class MotionResultCache(object):
+    """
+    Remembers MotionDetector results per pair of frames and detection settings.
+    Display options (debug, show motion) are not part of the key: draw them with draw_motion()
+    """
+    def __init__(self, md:MotionDetector, max_entries:int=16):
+        self.md = md
+        self.max_entries = max_entries
+        self.results = OrderedDict()
+
+    def compare_images(self, previous_image:FileImage, current_image:FileImage):
+        md = self.md
+        key = (previous_image.filepath, current_image.filepath, md.mindiff, md.threshold, md.dilation)
+        if key in self.results:
+            self.results.move_to_end(key)
+            return self.results[key]
+        # overlays are drawn by draw_motion, don't spend time drawing them here
+        debug, show_motion = md.debug, md.show_motion
+        md.debug = md.show_motion = False
+        try:
+            motion_data = md.compare_images(previous_image, current_image)
+        finally:
+            md.debug, md.show_motion = debug, show_motion
+        self.results[key] = motion_data
+        if len(self.results) > self.max_entries:
+            self.results.popitem(last=False)
+        return motion_data
+
+
+def draw_motion(image, motion_data, md:MotionDetector):
+    """
+    A copy of image with the motion detector overlay for the current debug / show motion settings
+    """
+    shown_image = image.copy()
+    if md.debug:
+        left, top, right, bottom = motion_data.detection_area
+        cv2.rectangle(shown_image, (left, top), (right, bottom), colors.RED)
+        for x, y, w, h, reason in motion_data.rejected_boxes:
+            cv2.rectangle(shown_image, (x, y), (x + w, y + h), colors.CYAN if reason == 'outside' else colors.MAGENTA)
+    if md.debug or md.show_motion:
+        for x, y, w, h in motion_data.motion_boxes:
+            cv2.rectangle(shown_image, (x, y), (x + w, y + h), colors.GREEN)
+    return shown_image
+
+
+def create_motion_detector(**kwargs):
     MINDIFF = int(os.environ.get('MINDIFF', 500))
     THRESHOLD = int(os.environ.get('THRESHOLD', 5))
     DILATION = int(os.environ.get('DILATION', 3))
@@ -108,21 +250,107 @@ def detect_stuff(filelist, window_name, args):
     LEFT = float(os.environ.get('LEFT', 0.0))
     RIGHT = float(os.environ.get('RIGHT', 1.0))
 
-    md = MotionDetector(
+    return MotionDetector(
         'night-motion',
         MINDIFF,
         TOP, LEFT, BOTTOM, RIGHT,
         DILATION,
         THRESHOLD,
-        show_motion=True,
         blur_size=None,
-        save_diffs=True,
-        debug=True
+        **kwargs
     )
+
+def scan_chunk(files, previous_file, method, threshold, min_size):
+    """
+    Runs in a worker process. Returns the candidates found in files.
+    previous_file is the frame before files[0] (or None), needed to compare the first frame.
+    """
+    candidates = []
+    md = create_motion_detector(show_motion=False, save_diffs=False, debug=False) if method == 'motion' else None
+    previous_image = None
+    if md is not None and previous_file is not None:
+        previous_image = FileImage(previous_file, image=cv2.imread(previous_file))
+    for file in files:
+        image = cv2.imread(file)
+        if image is None:
+            continue
+        if md is not None:
+            current_image = FileImage(file, image=image)
+            boxes = []
+            if previous_image is not None and previous_image.image is not None:
+                boxes = md.compare_images(previous_image, current_image).motion_boxes
+            previous_image = current_image
+        else:
+            H, W, _ = image.shape
+            contours, _ = get_contours(image, threshold=threshold)
+            boxes = [cv2.boundingRect(c) for c in contours]
+            # skip contours that span the whole frame
+            boxes = [b for b in boxes if abs(W - b[2]) > 10 and abs(H - b[3]) > 10]
+        max_blob = max([max(w, h) for (x, y, w, h) in boxes], default=0)
+        if boxes and max_blob >= min_size:
+            candidates.append({
+                'filename': os.path.basename(file),
+                'max_blob': int(max_blob),
+                'boxes': [[int(v) for v in box] for box in boxes]
+            })
+    return candidates
+
+def scan(filelist, args):
+    chunk_size = max(1, args.chunk)
+    chunks = [filelist[n:n + chunk_size] for n in range(0, len(filelist), chunk_size)]
+    print(f'Scanning {len(filelist)} files in {len(chunks)} chunks using "{args.scan_method}" with {args.jobs} jobs')
+    candidates = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = []
+        for n, chunk in enumerate(chunks):
+            previous_file = filelist[n * chunk_size - 1] if n > 0 else None
+            futures.append(executor.submit(scan_chunk, chunk, previous_file, args.scan_method,
+                                           args.threshold, args.min_size))
+        for n, future in enumerate(futures):
+            candidates.extend(future.result())
+            print(f' - {min((n + 1) * chunk_size, len(filelist))}/{len(filelist)}: {len(candidates)} candidates')
+    candidates.sort(key=lambda c: c['max_blob'], reverse=True)
+    for rank, candidate in enumerate(candidates):
+        candidate['rank'] = rank + 1
+    save_candidates(candidates, args.scan)
+    print(f'Wrote {len(candidates)} candidates to {args.scan}')
+
+def save_candidates(candidates, path):
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['rank', 'filename', 'max_blob', 'boxes'])
+            for c in candidates:
+                boxes = ';'.join(' '.join(str(v) for v in box) for box in c['boxes'])
+                writer.writerow([c['rank'], c['filename'], c['max_blob'], boxes])
+    else:
+        with open(path, 'w') as f:
+            json.dump(candidates, f, indent=2)
+
+def load_candidates(path):
+    if path.endswith('.csv'):
+        with open(path, newline='') as f:
+            return [row['filename'] for row in csv.DictReader(f)]
+    with open(path) as f:
+        return [c['filename'] for c in json.load(f)]
+
+def detect_stuff(filelist, window_name, args):
+    MINDIFF = int(os.environ.get('MINDIFF', 500))
+    THRESHOLD = int(os.environ.get('THRESHOLD', 5))
+    DILATION = int(os.environ.get('DILATION', 3))
+
+    md = create_motion_detector(show_motion=True, save_diffs=True, debug=True)
+    candidate_indices = []
+    if args.candidates:
+        positions = {os.path.basename(f): n for n, f in enumerate(filelist)}
+        candidate_indices = sorted(positions[name] for name in load_candidates(args.candidates) if name in positions)
+        print(f'Loaded {len(candidate_indices)} candidates. Use "]" and "[" to jump between them')
+    frame_cache = FrameCache(filelist, args.cache_mb * 1024 * 1024, prefetch=args.prefetch)
+    results = MotionResultCache(md)
     previous_image = None
     paused = False
     direction = 1 # set to -1 to play frames backwards
-    cv2.imshow(window_name, cv2.imread(filelist[0]))
+    cv2.imshow(window_name, frame_cache.get(0))
     def handle_mindiff_slider(new_mindiff):
         # print(f'new mindiff: {new_mindiff}')
         md.mindiff = new_mindiff
@@ -144,12 +372,13 @@ def detect_stuff(filelist, window_name, args):
         file = filelist[i]
         dir = '<--' if direction < 0 else '-->'
         cv2.setWindowTitle(window_name, f'{i} / {file_count} : {dir} : {file}')
-        img = cv2.imread(file)
+        frame_cache.set_position(i, direction)
+        img = frame_cache.get(i)
         # print(f'{i} : {file}')
         current_image = FileImage(file, image=img)
         if previous_image is not None:
             try:
-                motion_data = md.compare_images(previous_image, current_image)
+                motion_data = results.compare_images(previous_image, current_image)
             except Exception as e:
                 print(f'EXCEPETION: {e}')
                 print(f'{i} : {dir} : {file}')
@@ -165,7 +394,7 @@ def detect_stuff(filelist, window_name, args):
             if show_diff:
                 shown_image = motion_data.diff2_image.image
             else:
-                shown_image = motion_data.motion_image
+                shown_image = draw_motion(current_image.image, motion_data, md)
             cv2.imshow(window_name, shown_image)
             raw_key = cv2.waitKey(wait)
             key = chr(raw_key & 0xFF)
@@ -183,6 +412,20 @@ def detect_stuff(filelist, window_name, args):
                 paused = True
                 add_note(current_image, args)
                 continue
+            elif key in '[]' and candidate_indices:
+                paused = True
+                if key == ']':
+                    later = [n for n in candidate_indices if n > i]
+                    target = later[0] if later else None
+                else:
+                    earlier = [n for n in candidate_indices if n < i]
+                    target = earlier[-1] if earlier else None
+                if target is None:
+                    print('No more candidates in that direction')
+                    continue
+                i = target
+                previous_image = FileImage(filelist[i-1], image=frame_cache.get(i - 1)) if i > 0 else None
+                continue
             elif key == '-': # show diffs
                 show_diff = not show_diff
                 continue
@@ -205,7 +448,7 @@ def detect_stuff(filelist, window_name, args):
                 if i > 0:
                     i -= 1
                     if i > 0:
-                        img = cv2.imread(filelist[i-1])
+                        img = frame_cache.get(i - 1)
                         previous_image = FileImage(filelist[i-1], image=img)
                 continue
             elif raw_key == 102 or raw_key == 3: # 'f' or --> (forward)
@@ -241,6 +484,8 @@ def detect_stuff(filelist, window_name, args):
                     paused = True
 
         previous_image = current_image
+    frame_cache.stop()
+    print(f'Frame cache: {frame_cache.hits} hits, {frame_cache.misses} misses')
 
 def detect_stuff2(filelist, window_name):
     for file in filelist:
@@ -273,12 +518,33 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser('Find interesting things in nightsky timelapse')
     parser.add_argument('--type', type=str, help='type of image files (default: "jpg")', default='jpg')
     parser.add_argument('--note-file', type=str, help='Path of notes file.')
+    parser.add_argument('--cache-mb', type=int, default=2048,
+                        help='Memory to use for caching decoded frames, in MB. (default: 2048)')
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help='Number of frames to decode ahead in the direction of play. (default: 8)')
+    parser.add_argument('--candidates', type=str, help='Candidate list written by --scan. Use "]" and "[" to jump '
+                                                         'between candidates')
+    scangroup = parser.add_argument_group('Headless scan for candidate frames')
+    scangroup.add_argument('--scan', type=str, metavar='OUTPUT',
+                           help='Scan the directory without showing anything and write a ranked candidate list '
+                                'to OUTPUT (.json or .csv)')
+    scangroup.add_argument('--scan-method', choices=['motion', 'contours'], default='motion',
+                           help='Compare each frame with the previous one (motion) or look for bright blobs in each '
+                                'frame (contours). (default: motion)')
+    scangroup.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of worker processes')
+    scangroup.add_argument('--chunk', type=int, default=50, help='Number of files per task. (default: 50)')
+    scangroup.add_argument('--threshold', type=int, default=6, help='Brightness threshold for "contours"')
+    scangroup.add_argument('--min-size', type=int, default=0,
+                           help='Only report frames with a blob at least this many pixels wide or tall')
     parser.add_argument('imgdir', type=str, help='Directory containing images')
     args = parser.parse_args()
     IMAGE_DIR = args.imgdir
 
     filelist = glob.glob(os.path.join(IMAGE_DIR, f'*.{args.type}') )
     filelist.sort()
+    if args.scan:
+        scan(filelist, args)
+        sys.exit(0)
     window_name = f'Press Any Key to Close ("?" for help)'
     detect_stuff(filelist, window_name, args)
     cv2.namedWindow(window_name, cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO | cv2.WINDOW_GUI_EXPANDED)
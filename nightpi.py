@@ -30,6 +30,7 @@ import datetime
 from pilapse.pause_until import pause_until
 from pilapse.scheduling import Schedule
 from pilapse.suntime import Suntime
+from pilapse.exposure_schedule import ExposureSchedule
 
 location=(37.335480, -121.893028)
 
@@ -68,6 +69,9 @@ class NightCam:
 
     def load_suntimes(self):
         self.suntimes = Suntime(location)
+        self.exposure_schedule = None
+        if not self.single_shot:
+            self.exposure_schedule = ExposureSchedule(self.config.camera_settings, self.suntimes)
 
     def camera_model(self) -> str:
         if self._model:
@@ -243,20 +247,9 @@ class NightCam:
 
     def calculate_camera_settings(self):
         if self.single_shot:
-            return (self.config.iso, self.config.shutter, self.config.framerate)
+            return (self.config.iso, self.config.shutter)
         else:
-            p0, p1, pct = self.suntimes.get_part_of_day_percent()
-            iso0 = self.config.camera_settings[p0]['iso']
-            shutter0 = self.config.camera_settings[p0]['shutter']
-
-            iso1 = self.config.camera_settings[p1]['iso']
-            shutter1 = self.config.camera_settings[p1]['shutter']
-
-            iso = int(iso0) if iso0 == iso1 else int(iso0 + (iso1 - iso0) * pct)
-            shutter = int(shutter0) if shutter0 == shutter1 else int(shutter0 + (shutter1 - shutter0) * pct)
-
-            logging.info(f'      ISO: {iso0} - {iso1} ({pct:.4f}) {iso}')
-            logging.info(f'  SHUTTER: {shutter0} - {shutter1} ({pct:.4f}) {shutter}')
+            iso, shutter, framerate = self.exposure_schedule.lookup()
             return (iso, shutter)
 
     def parse_command_line(self):
@@ -1,24 +1,49 @@
 import argparse
+import fcntl
+import json
 import logging
 import os
 import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from data_scaler import DataScaler
 import cv2
 import imutils
+import numpy as np
 
 logging.basicConfig(level=logging.INFO, stream=sys.stdout, format='%(asctime)s|%(levelname)s|%(threadName)s|%(message)s')
+# imported after basicConfig so that this script keeps logging to stdout
+from pilapse.h264_remux import count_frames, H264RemuxError
 
 def parse_args():
     parser = argparse.ArgumentParser('Postprocess Motion Detection Video Clips')
     parser.add_argument('work_dir', help='path to work dir. (Directory containing "raw")', type=Path)
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of clips to process concurrently')
+    parser.add_argument('--max-worker-memory', type=int, default=None,
+                        help='Limit the address space of each worker process to this many MB')
+    parser.add_argument('--state-file', type=Path, default=None,
+                        help='File recording finished clips. (default: WORK_DIR/motion-post-state.json)')
+    parser.add_argument('--clip', type=Path, action='append', default=None,
+                        help='Only process this raw clip (may be repeated). Clips must be under WORK_DIR/raw')
     return parser.parse_args()
 
 class ClipMetadata(object):
+    """
+    Per frame metadata for a clip, stored as one numpy array per column
+    """
+    NUMERIC_COLUMNS = ['fps', 'lux', 'mse', 'ave_mse']
+
     def __init__(self, path:Path):
         self.header = {}
-        self.framedata = []
+        self.timestamp = np.array([], dtype=str)
+        self.frame_fps = np.array([], dtype=np.float64)
+        self.lux = np.array([], dtype=np.float64)
+        self.mse = np.array([], dtype=np.float64)
+        self.ave_mse = np.array([], dtype=np.float64)
+        self.motion = np.array([], dtype=bool)
         self.load(path)
 
     @property
@@ -27,18 +52,40 @@ class ClipMetadata(object):
 
     @property
     def nframes(self):
-        return len(self.framedata)
+        return len(self.timestamp)
 
     @property
     def fps(self):
         return self.header['fps'] if 'fps' in self.header else None
 
+    @property
+    def mse_threshold(self):
+        return float(self.header['mse'])
+
     def get_frame(self, i):
         if i < 0 or i >= self.nframes:
-            message = f'bad frame index: {i} is not between 0 and {len(self.framedata)}'
+            message = f'bad frame index: {i} is not between 0 and {self.nframes}'
             logging.error(message)
             return None
-        return self.framedata[i]
+        return {
+            'timestamp': str(self.timestamp[i]),
+            'fps': self.frame_fps[i],
+            'lux': self.lux[i],
+            'mse': self.mse[i],
+            'ave_mse': self.ave_mse[i],
+            'motion': bool(self.motion[i])
+        }
+
+    def column(self, name:str, indices, default=0.0):
+        """
+        Values of a numeric column for an array of frame indices. Indices outside the metadata get default.
+        """
+        values = {'fps': self.frame_fps, 'lux': self.lux, 'mse': self.mse, 'ave_mse': self.ave_mse}[name]
+        indices = np.asarray(indices)
+        valid = (indices >= 0) & (indices < self.nframes)
+        result = np.full(indices.shape, default, dtype=np.float64)
+        result[valid] = values[indices[valid]]
+        return result
 
     def parse_header(self, header:str):
         self.header = {}
@@ -53,32 +100,53 @@ class ClipMetadata(object):
         logging.info(f'HEADER: {self.header}')
 
     def load_framedata(self, content):
-        self.framedata = []
-        n = 0
-        for frame in content:
-            fields = frame.split(',')
-            self.framedata.append(
-                {
-                    'timestamp': fields[0],
-                    'fps': fields[1],
-                    'lux': fields[2],
-                    'mse': fields[3],
-                    'ave_mse': fields[4],
-                    'motion': fields[5] == 'M'
-                }
-            )
-            n += 1
-        logging.info(f'Collected {n} frames worth of data')
+        rows = [line.split(',') for line in content if line]
+        bad_rows = [row for row in rows if len(row) < 6]
+        if bad_rows:
+            logging.warning(f'Skipping {len(bad_rows)} malformed metadata lines')
+            rows = [row for row in rows if len(row) >= 6]
+        columns = list(zip(*rows)) if rows else [()] * 6
+        self.timestamp = np.array(columns[0], dtype=str)
+        self.frame_fps = np.array(columns[1], dtype=np.float64)
+        self.lux = np.array(columns[2], dtype=np.float64)
+        self.mse = np.array(columns[3], dtype=np.float64)
+        self.ave_mse = np.array(columns[4], dtype=np.float64)
+        self.motion = np.array(columns[5], dtype=str) == 'M'
+        logging.info(f'Collected {self.nframes} frames worth of data')
 
     def load(self, path:Path):
         logging.info(f'Load metadata from {path.name}')
         self.header = {}
-        self.framedata = []
         content = path.read_text('utf-8').splitlines()
         header = content.pop(0)
         self.parse_header(header)
         self.load_framedata(content)
 
+
+def index_metadata_files(directories):
+    """
+    Scan each directory once and map (directory, clip timestamp) to the metadata files found
+    """
+    index = {}
+    for directory in directories:
+        if not directory.is_dir():
+            continue
+        for f in directory.glob('*_data.txt'):
+            index.setdefault((directory, f.name.split('_')[0]), []).append(f)
+    return index
+
+
+def find_metadata_file(raw_clip_path:Path, metadata_index:dict=None):
+    clip_timestamp = raw_clip_path.name.split('_')[0]
+    if metadata_index is None:
+        metadata_index = index_metadata_files([raw_clip_path.parent])
+    metadata_list = metadata_index.get((raw_clip_path.parent, clip_timestamp), [])
+    if len(metadata_list) < 1:
+        raise Exception('Metadata file not found')
+    if len(metadata_list) > 1:
+        raise Exception(f'Too many metadata files found for {raw_clip_path.name}')
+    return metadata_list[0]
+
 RED = (0, 0, 255)
 GREEN = (0, 255, 0)
 BLUE = (255, 0, 0)
@@ -88,11 +156,14 @@ MAGENTA = (255, 0, 255)
 class RawClipProcessor(object):
     DEFAULT_FPS = 30
     bottom_margin = 10
-    def __init__(self, raw_clip_path:Path, outdir:Path):
+    def __init__(self, raw_clip_path:Path, outdir:Path, metadata_path:Path=None):
         self.fps = None
         self.motion_graph = None
         self.mse_average_graph = None
         self.delta_graph = None
+        self.graph_overlay = None
+        self.graph_mask = None
+        self.graph_rows = None
         self.title_frame_number = None
         self.clip_path:Path = raw_clip_path
         self.outdir:Path = outdir
@@ -100,66 +171,43 @@ class RawClipProcessor(object):
         self.clip_base_name = raw_clip_path.with_suffix('').name
         self.clip_timestamp = self.clip_base_name.split('_')[0]
         self.work_dir:Path = raw_clip_path.parent
-        self.temp_dir:Path = self.work_dir.joinpath('tmp', self.clip_base_name)
+        self.temp_dir:Path = self.work_dir.joinpath('tmp')
         self.temp_dir.mkdir(exist_ok=True, parents=True)
-        metadata_list = []
-        for f in self.work_dir.glob(f'{self.clip_timestamp}*_data.txt'):
-            metadata_list.append(f)
-        if len(metadata_list) < 1:
-            raise Exception('Metadata file not found')
-        if len(metadata_list) > 1:
-            raise Exception(f'Too many metadata files found for {raw_clip_path.name}')
-        self.metadata_path = metadata_list[0]
+        self.metadata_path = metadata_path if metadata_path is not None else find_metadata_file(raw_clip_path)
         self.metadata = ClipMetadata(self.metadata_path)
 
-    def frame_file_path(self, index):
-        return f'{self.temp_dir}/frame_{index:06}.png'
-    def split_clip(self):
-        logging.info(f'Splitting {self.clip_path.name} into Frames')
-        # pass one, pull out frames, numbering frame00000, frame00001, etc
-        video_capture = cv2.VideoCapture(str(self.clip_path))
+    def probe_clip(self):
+        logging.info(f'Probing {self.clip_path.name}')
         # TODO check first frame fps, last frame fps and clip fps. 2 out of 3 wins
         self.fps = int(self.metadata.fps)
-        fps_data = {}
-        for frame in self.metadata.framedata:
-            fps = frame['fps']
-            if fps not in fps_data:
-                fps_data[fps] = 0
-            fps_data[fps] += 1
-
+        fps_values, first_seen, counts = np.unique(self.metadata.frame_fps, return_index=True, return_counts=True)
         logging.info(f'--- FPS DATA ---')
-        clip_fps = None
-        for k,v in fps_data.items():
-            logging.info(f' {k}: {v}')
-            if clip_fps is None:
-                clip_fps = k
-            else:
-                if v > fps_data[clip_fps]:
-                    clip_fps = k
+        clip_fps = self.fps
+        for k, v in zip(fps_values, counts):
+            logging.info(f' {k:g}: {v}')
+        if len(fps_values) > 0:
+            # most common frame rate, ties go to the one seen first
+            order = np.lexsort((first_seen, -counts))
+            clip_fps = fps_values[order[0]]
         logging.info(f' - clip_fps: {clip_fps}')
 
         self.fps = int(clip_fps)
+        video_capture = cv2.VideoCapture(str(self.clip_path))
         self.frame_width = int(video_capture.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.frame_height = int(video_capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        self.frame_count = 0
-
-        while True:
-            success, frame = video_capture.read()
-            if not success:
-                break
-            cv2.imwrite(self.frame_file_path(self.frame_count), frame)
-            frame = None
-            self.frame_count += 1
         video_capture.release()
-        logging.info(f'Wrote {self.frame_count} frames to {self.temp_dir.name}')
-        # now we know how many frames, we can map to metadata
+        # count the frames from the H.264 stream itself rather than decoding them
+        try:
+            self.frame_count = count_frames(self.clip_path)
+        except (H264RemuxError, OSError) as e:
+            logging.warning(f'Unable to count frames in {self.clip_path.name} ({e}), using metadata frame count')
+            self.frame_count = self.metadata.nframes
+        logging.info(f'{self.clip_path.name}: {self.frame_count} frames, {self.frame_width}x{self.frame_height}')
 
     def calculate_motion_graph(self):
         view_x_limits = [0, self.frame_width - 1]
         view_y_limits = [self.frame_height - 1 - self.bottom_margin, self.frame_height - self.frame_height/10 - self.bottom_margin]
 
-        max_mse = min_mse = None
-
         metadata_offset = self.metadata.nframes - self.frame_count
         if self.metadata.nframes > self.frame_count:
             metadata_offset -= 1
@@ -167,69 +215,68 @@ class RawClipProcessor(object):
             metadata_offset = 0
         logging.debug(f'Calculate motion graph: {self.metadata.nframes} metadata frames, {self.frame_count} '
                      f'frames, offset: {metadata_offset}')
-        self.motion_graph = []
-        self.mse_average_graph = []
-        self.mse_line = []
-        self.delta_graph = []
-        motion_data = []
-        mse_average_data = []
-        delta_data = []
-        for i in range(self.frame_count):
-            try:
-                metadata_frame = self.metadata.get_frame(metadata_offset + i)
-            except Exception as e:
-                logging.error(f'Failed to get metadata for frame {i}')
-                logging.error(f'{self.metadata.nframes} metadata frames, {self.frame_count} frames, offset:')
-                raise e
-            mse_threshold = float(self.metadata.header['mse'])
-            mse = float(metadata_frame['mse']) if metadata_frame is not None else 0
-            motion_data.append(mse)
-            ave = float(metadata_frame['ave_mse']) if metadata_frame is not None else 0
-            mse_average_data.append(ave)
-            delta = float(abs(mse - ave))
-            delta_data.append(delta)
-            if i == 0:
-                min_mse = max_mse = mse
-                self.title_frame_number = i
-                continue
-            if mse < min_mse:
-                min_mse = mse
-            if mse > max_mse:
-                max_mse = mse
-                self.title_frame_number = i
-            if ave < min_mse:
-                min_mse = ave
-            if ave > max_mse:
-                max_mse = ave
+        mse_threshold = self.metadata.mse_threshold
+        metadata_index = metadata_offset + np.arange(self.frame_count)
+        motion_data = self.metadata.column('mse', metadata_index)
+        mse_average_data = self.metadata.column('ave_mse', metadata_index)
+        delta_data = np.abs(motion_data - mse_average_data)
+
+        # title frame: the last frame whose mse is higher than every mse and average before it
+        self.title_frame_number = 0 if self.frame_count > 0 else None
+        if self.frame_count > 1:
+            peaks = np.maximum(motion_data, mse_average_data)
+            peaks[0] = motion_data[0]
+            previous_max = np.maximum.accumulate(peaks)[:-1]
+            new_max = np.nonzero(motion_data[1:] > previous_max)[0]
+            if len(new_max) > 0:
+                self.title_frame_number = int(new_max[-1]) + 1
 
         self.xscaler = DataScaler([0, self.frame_count - 1], view_x_limits)
         # self.yscaler = DataScaler([0, max(max_mse, mse_threshold * 2.0)], view_y_limits)
         self.yscaler = DataScaler([0, mse_threshold * 2.0], view_y_limits)
 
         Y = int(self.yscaler.scale(mse_threshold))
-        self.mse_line = [(view_x_limits[0], Y), (view_x_limits[1], Y)]
-
-        for i in range(self.frame_count):
-            x = int(self.xscaler.scale(i))
-
-            y = int(self.yscaler.scale(motion_data[i]))
-            self.motion_graph.append((x, y))
-
-            y = int(self.yscaler.scale(mse_average_data[i]))
-            self.mse_average_graph.append((x, y))
-
-            y = int(self.yscaler.scale(delta_data[i]))
-            self.delta_graph.append((x, y))
+        self.mse_line = np.array([(view_x_limits[0], Y), (view_x_limits[1], Y)], dtype=np.int32)
+
+        x = self.xscaler.scale_array(np.arange(self.frame_count)).astype(np.int32)
+        def to_points(data):
+            y = self.yscaler.scale_array(data).astype(np.int32)
+            return np.column_stack((x, y))
+
+        self.motion_graph = to_points(motion_data)
+        self.mse_average_graph = to_points(mse_average_data)
+        self.delta_graph = to_points(delta_data)
+        self.render_graph_overlay()
+
+    def render_graph_overlay(self):
+        """
+        The graph is the same on every frame, so draw it once into an overlay covering the rows it
+        touches along with a mask of the pixels that were drawn.
+        """
+        margin = 2
+        graphs = [self.mse_line, self.mse_average_graph, self.motion_graph, self.delta_graph]
+        y = np.concatenate([graph[:, 1] for graph in graphs])
+        top = int(np.clip(y.min() - margin, 0, self.frame_height))
+        bottom = int(np.clip(y.max() + margin + 1, 0, self.frame_height))
+        self.graph_rows = slice(top, bottom)
+
+        overlay = np.zeros((bottom - top, self.frame_width, 3), dtype=np.uint8)
+        mask = np.zeros((bottom - top, self.frame_width), dtype=np.uint8)
+        for graph, color in zip(graphs, [YELLOW, GREEN, BLUE, TURQUOIS]):
+            points = (graph - (0, top)).astype(np.int32).reshape((-1, 1, 2))
+            cv2.polylines(overlay, [points], False, color, thickness=2)
+            cv2.polylines(mask, [points], False, 255, thickness=2)
+        self.graph_overlay = overlay
+        self.graph_mask = (mask > 0)[:, :, np.newaxis]
 
 
     def create_raw_video(self):
-        clip_dir = self.temp_dir.parent
+        clip_dir = self.temp_dir
         discard = ''
         if 'discard' in str(self.clip_path):
             discard = '_DISCARD'
         clip_name = clip_dir.joinpath(f'{self.clip_base_name}{discard}.mp4')
         logging.info(f'video output dir: {clip_dir}, clip fps: {self.fps}')
-        frame_files = self.temp_dir.glob('frame_*.png')
 
         size = (self.frame_width, self.frame_height)
         fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v')
@@ -237,10 +284,6 @@ class RawClipProcessor(object):
         if clip_name.exists():
             clip_name.unlink()
         video_writer.open(str(clip_name), fourcc, int(self.fps), size)
-        self.frame_file_list = []
-        for frame in frame_files:
-            self.frame_file_list.append(frame)
-        self.frame_file_list.sort()
 
         metadata_offset = self.metadata.nframes - self.frame_count
         if self.metadata.nframes > self.frame_count:
@@ -318,13 +361,7 @@ class RawClipProcessor(object):
 
             return motion_frame
 
-        def create_title_frame():
-            logging.info(f'Creating title frame')
-            if self.title_frame_number is None:
-                logging.error(f'Title frame number not set. Cannot make title frame')
-                return None
-            title_frame = cv2.imread(self.frame_file_path(self.title_frame_number))
-
+        def find_background_frame():
             # find the motion-free frame closest to the title frame
             frame = self.title_frame_number - 1
             background_frame = None
@@ -343,12 +380,11 @@ class RawClipProcessor(object):
 
             if background_frame == None:
                 frame = self.title_frame_number + 1
-                n_frame_files = len(self.frame_file_list)
                 n = 0
-                while frame < n_frame_files - 1:
+                while frame < self.frame_count - 1:
                     fmeta = self.metadata.get_frame(frame + metadata_offset)
                     if fmeta is None:
-                        logging.warning(f'fmeta: {fmeta}, frame: {frame}, metadata_offset: {metadata_offset}, nfiles: {n_frame_files}')
+                        logging.warning(f'fmeta: {fmeta}, frame: {frame}, metadata_offset: {metadata_offset}, nframes: {self.frame_count}')
                     elif not fmeta['motion']:
                         if n >= EXTRA_MOTIONLESS:
                             background_frame = frame
@@ -357,12 +393,48 @@ class RawClipProcessor(object):
                     else:
                         n = 0
                     frame += 1
+            return background_frame
+
+        def load_frames(frame_numbers):
+            # Grab (without converting) up to the last frame we need and only retrieve the ones we keep
+            frames = {}
+            if not frame_numbers:
+                return frames
+            video_capture = cv2.VideoCapture(str(self.clip_path))
+            last_frame = max(frame_numbers)
+            frame_number = 0
+            while frame_number <= last_frame:
+                if not video_capture.grab():
+                    logging.warning(f'{self.clip_path.name} ended at frame {frame_number}, before frame {last_frame}')
+                    break
+                if frame_number in frame_numbers:
+                    success, frame = video_capture.retrieve()
+                    if success:
+                        frames[frame_number] = frame
+                frame_number += 1
+            video_capture.release()
+            return frames
+
+        def create_title_frame():
+            logging.info(f'Creating title frame')
+            if self.title_frame_number is None:
+                logging.error(f'Title frame number not set. Cannot make title frame')
+                return None
+            background_frame = find_background_frame()
             if background_frame == None:
                 logging.warning(f'No suitable background frame. Cannot mark motion in frame')
 
+            frame_numbers = {self.title_frame_number}
             if background_frame is not None:
-                background_frame = cv2.imread(str(self.frame_file_list[background_frame]))
-                marked_frame = mark_motion(background_frame, title_frame)
+                frame_numbers.add(background_frame)
+            frames = load_frames(frame_numbers)
+            title_frame = frames.get(self.title_frame_number)
+            if title_frame is None:
+                logging.error(f'Unable to read title frame {self.title_frame_number}')
+                return None
+
+            if background_frame is not None and background_frame in frames:
+                marked_frame = mark_motion(frames[background_frame], title_frame)
                 if marked_frame is not None:
                     pass
                     # title_frame = marked_frame
@@ -377,45 +449,40 @@ class RawClipProcessor(object):
 
             metadata_frame = self.metadata.get_frame(metadata_offset + frame_number)
             ts = metadata_frame['timestamp'] if metadata_frame is not None else '0000/00/ 00:00:00'
-            if self.motion_graph is not None and self.mse_average_graph is not None:
+            if self.graph_overlay is not None:
                 cursor_x = int(self.xscaler.scale(frame_number))
                 cursor_y0 = int(self.yscaler.view_min)
                 cursor_y1 = int(self.yscaler.view_max)
                 cv2.line(frame_image, (cursor_x, cursor_y0), (cursor_x, cursor_y1), (255, 0, 0), thickness=2)
+                np.copyto(frame_image[self.graph_rows], self.graph_overlay, where=self.graph_mask)
 
-                def draw_graph(graph, color):
-                    previous_point = None
-                    for point in graph:
-                        if previous_point is not None:
-                            cv2.line(frame_image, previous_point, point, color, thickness=2)
-                        previous_point = point
-
-                draw_graph(self.mse_line, YELLOW)
-                draw_graph(self.mse_average_graph, GREEN)
-                draw_graph(self.motion_graph, BLUE)
-                draw_graph(self.delta_graph, TURQUOIS)
-
-            mse = float(metadata_frame["mse"]) if metadata_frame is not None else 0
-            average = float(metadata_frame["ave_mse"]) if metadata_frame is not None else 0
+            mse = metadata_frame["mse"] if metadata_frame is not None else 0
+            average = metadata_frame["ave_mse"] if metadata_frame is not None else 0
             message = f'{ts} m{mse:.2f} a{average:.2f} d{abs(mse - average):.2f} fps{self.fps:.0f} {discard}'
             cv2.putText(frame_image, message, timestamp_origin, cv2.FONT_HERSHEY_SIMPLEX, 1, RED, thickness=2)
 
         frame_number = 0
         timestamp_origin = (30, self.frame_height - 60)
-        for frame in self.frame_file_list:
-            if title_frame is not None:
-                draw_footer(title_frame, self.title_frame_number)
-                video_writer.write(title_frame)
-                title_frame = None
-            logging.debug(f'Adding frame {frame.name}')
-            frame_image = cv2.imread(str(frame))
+        if title_frame is not None:
+            draw_footer(title_frame, self.title_frame_number)
+            video_writer.write(title_frame)
+            title_frame = None
+        # decode, annotate and encode each frame in a single pass
+        video_capture = cv2.VideoCapture(str(self.clip_path))
+        while True:
+            success, frame_image = video_capture.read()
+            if not success:
+                break
+            logging.debug(f'Adding frame {frame_number}')
             # add the timestamp from metadate at the bottom for debugging
-
             draw_footer(frame_image, frame_number)
             video_writer.write(frame_image)
             frame_image = None
             frame_number += 1
+        video_capture.release()
         video_writer.release()
+        if frame_number != self.frame_count:
+            logging.warning(f'Expected {self.frame_count} frames, decoded {frame_number}')
         # move the file from clip_dir to clip_dir.parent
         outfile = self.outdir.joinpath(clip_name.name)
         if outfile.exists():
@@ -424,8 +491,6 @@ class RawClipProcessor(object):
         logging.info(f' - Finished writing {clip_name}')
 
     def cleanup(self):
-        logging.info(f'Deleting {self.temp_dir}')
-        shutil.rmtree(self.temp_dir)
         # delete the raw video?
         logging.info(f'Deleting {self.clip_path}')
         self.clip_path.unlink()
@@ -433,25 +498,137 @@ class RawClipProcessor(object):
         # self.metadata_path.unlink()
 
 
-def process_raw_clips(raw_path):
-    logging.info(f'raw_path type: {type(raw_path)}')
+class ProcessedClips(object):
+    """
+    Remembers which clips have been finished, keyed by absolute path, size and mtime, so
+    that clips that are pulled again are not processed a second time.
+    """
+    def __init__(self, path:Path):
+        self.path:Path = path
+        self.clips = {}
+        self.load()
+
+    @staticmethod
+    def key(clip_path:Path) -> str:
+        # the same clip can be passed as a relative or absolute path
+        return str(Path(clip_path).resolve())
+
+    @staticmethod
+    def signature(clip_path:Path):
+        st = clip_path.stat()
+        return {'size': st.st_size, 'mtime': st.st_mtime}
+
+    def load(self):
+        self.clips = {}
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path) as f:
+                self.clips = json.load(f)
+            logging.info(f'Loaded {len(self.clips)} finished clips from {self.path}')
+        except (OSError, ValueError) as e:
+            logging.warning(f'Unable to read state file {self.path}: {e}')
+
+    def save(self):
+        tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.clips, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_done(self, clip_path:Path, signature:dict):
+        return self.clips.get(self.key(clip_path)) == signature
+
+    def mark_done(self, clip_path:Path, signature:dict):
+        # several processes may share the state file, so merge with what is on disk under a lock
+        with open(self.path.with_name(f'{self.path.name}.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load()
+            self.clips[self.key(clip_path)] = signature
+            self.save()
+
+
+def limit_worker_memory(max_memory_mb):
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logging.warning(f'Unable to limit worker memory to {max_memory_mb} MB: {e}')
+
+
+def process_clip(raw_clip:Path, outdir:Path, metadata_path:Path=None):
+    processor = RawClipProcessor(raw_clip, outdir, metadata_path)
+    processor.probe_clip()
+    processor.calculate_motion_graph()
+    processor.create_raw_video()
+    processor.cleanup()
+    return raw_clip
+
+
+def process_raw_clips(raw_path:Path, work_dir:Path, jobs:int=1, max_worker_memory:int=None, state_file:Path=None,
+                      clips:list=None):
     outdir = raw_path.parent
     raw_clip_list = []
-    raw_clip_list.extend(raw_path.glob('*.h264'))
-    raw_clip_list.extend(raw_path.joinpath('discards').glob('*.h264'))
+    if clips is not None:
+        raw_clip_list.extend(clips)
+    else:
+        raw_clip_list.extend(raw_path.glob('*.h264'))
+        raw_clip_list.extend(raw_path.joinpath('discards').glob('*.h264'))
     raw_clip_list.sort()
     logging.info(f'Found {len(raw_clip_list)} clips')
-    logging.info(f'Motion Post Processing, work dir: {args.work_dir}')
+    logging.info(f'Motion Post Processing, work dir: {work_dir}')
+
+    state = ProcessedClips(state_file if state_file is not None else work_dir.joinpath('motion-post-state.json'))
+    metadata_index = index_metadata_files([raw_path, raw_path.joinpath('discards')])
+    pending = {}
+    metadata_paths = {}
     for raw_clip in raw_clip_list:
-        raw_clip_path = os.path.join(raw_path, raw_clip)
-        processor = RawClipProcessor(raw_clip, outdir)
-        processor.split_clip()
-        processor.calculate_motion_graph()
-        processor.create_raw_video()
-        processor.cleanup()
+        if not raw_clip.exists():
+            logging.warning(f'Skipping {raw_clip}: file not found')
+            continue
+        signature = ProcessedClips.signature(raw_clip)
+        if state.is_done(raw_clip, signature):
+            logging.info(f'Skipping {raw_clip.name}: already processed')
+            continue
+        try:
+            metadata_paths[raw_clip] = find_metadata_file(raw_clip, metadata_index)
+        except Exception as e:
+            logging.error(f'Skipping {raw_clip.name}: {e}')
+            continue
+        pending[raw_clip] = signature
+    logging.info(f'{len(pending)} clips to process with {jobs} job(s)')
+
+    if jobs <= 1:
+        for raw_clip, signature in pending.items():
+            try:
+                process_clip(raw_clip, outdir, metadata_paths[raw_clip])
+            except Exception as e:
+                logging.exception(f'Failed to process {raw_clip.name}: {e}')
+                continue
+            state.mark_done(raw_clip, signature)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=limit_worker_memory,
+                             initargs=(max_worker_memory,)) as executor:
+        futures = {executor.submit(process_clip, raw_clip, outdir, metadata_paths[raw_clip]): raw_clip
+                   for raw_clip in pending}
+        for future in as_completed(futures):
+            raw_clip = futures[future]
+            try:
+                future.result()
+            except BrokenProcessPool as e:
+                logging.error(f'Worker died while processing {raw_clip.name}: {e}')
+                continue
+            except Exception as e:
+                logging.error(f'Failed to process {raw_clip.name}: {e}')
+                continue
+            logging.info(f'Finished {raw_clip.name}')
+            state.mark_done(raw_clip, pending[raw_clip])
 
 if __name__ == '__main__':
     args = parse_args()
     raw_path = Path(f'{args.work_dir}/raw/')
-    process_raw_clips(raw_path)
-
+    process_raw_clips(raw_path, args.work_dir, jobs=args.jobs, max_worker_memory=args.max_worker_memory,
+                      state_file=args.state_file, clips=args.clip)
@@ -41,6 +41,11 @@ logging.basicConfig(
     format='%(asctime)s|%(levelname)s|%(threadName)s|%(message)s'
 )
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pilapse.log_writer import BufferedLogWriter
+from pilapse.control_server import ControlServer
+from pilapse.save_pipeline import SavePipeline
+
 TIME_TO_STOP = False
 SET_EXPOSURE = False
 
@@ -137,32 +142,28 @@ parser.add_argument('--analog-gain', type=float,
 parser.add_argument('--notes', action='store_true',
                     help='Create a "notes" file with information about Raspberry Pi and Camera info as well as '
                          'timelapse settings. Will append if file exists.')
+parser.add_argument('--control-socket', type=str, default='/home/pi/timelapse.sock',
+                    help='Path of the unix socket the setup helper uses to send commands. '
+                         'Set to "" to only accept commands through signals. Default: /home/pi/timelapse.sock')
+parser.add_argument('--save-workers', type=int, default=0,
+                    help='Encode and write frames on this many background threads so the camera is not kept '
+                         'waiting while each JPEG is saved. 0 saves each frame before capturing the next one. '
+                         'Ignored in singleshot mode. Default: 0')
+parser.add_argument('--save-queue', type=int, default=4,
+                    help='With --save-workers, the most frames that can be waiting to be saved. Frames captured '
+                         'while the queue is full are dropped (and counted). Default: 4')
 args = parser.parse_args()
 
 timelapse_info = dict(PID=os.getpid())
 
 print(f'timelapse_info: {timelapse_info}')
 
-class MetaDataLog:
-    def __init__(self, filepath):
-        os.makedirs(os.path.dirname(filepath), exist_ok=True)
-        self._file = open(filepath, 'w')
-
-    def __del__(self):
-        self._file.flush()
-        self._file.close()
-
-    def addline(self, line):
-        self._file.write(line)
-        if not line.endswith('\n'):
-            self._file.write('\n')
-        self._file.flush()
-
 logging.info(f'Framedir: {args.framedir}')
 
-metadata_log_file =os.path.join(os.path.dirname(args.framedir), f'{os.path.basename(args.framedir)}-metadata.log')
+# one JSON object per frame, written in batches by a background thread
+metadata_log_file =os.path.join(os.path.dirname(args.framedir), f'{os.path.basename(args.framedir)}-metadata.jsonl')
 logging.info(f'Metadata log: {metadata_log_file}')
-metalog = MetaDataLog(metadata_log_file)
+metalog = BufferedLogWriter(metadata_log_file, format='jsonl', name='MetaDataLog')
 
 def timedelta_formatter(td:timedelta):
     #  TODO : move to library
@@ -186,35 +187,39 @@ def exit_gracefully(signum, frame):
 def do_update_exposure(picam2, timelapse_info):
     logging.info(f'Setting controls from {timelapse_info_path_helper}')
     if os.path.exists(timelapse_info_path_helper):
-        controls = {}
         with open(timelapse_info_path_helper) as f:
             data = json.load(f)
-            if 'ExposureTime' in data and int(data['ExposureTime']) > 0:
-                controls['ExposureTime'] = int(data['ExposureTime'])
-                print(f'data: {data}')
-                # calculate framerate from new exposure Time
-                fps = data['ExposureTime'] / 1000000
-                # if fps >
-                controls['FrameDurationLimits'] = (int(data['ExposureTime']), int(data['ExposureTime']))
-                controls["AeEnable"] = False
-                controls["AwbEnable"] =  False
-                logging.info(f'New settings: Exposure time: {data["ExposureTime"]}, FPS: {fps}')
-                timelapse_info['ExposureTime'] = data['ExposureTime']
-                timelapse_info['FrameRate'] = fps
-            if 'Zoom' in data:
-                x, y, w, h = original_scaler_crop
-                new_w = w/data['Zoom']
-                new_h = h/data['Zoom']
-                new_x = x + w/2 - new_w/2
-                new_y = y + h/2 - new_h/2
-                controls['ScalerCrop'] = (int(new_x), int(new_y), int(new_w), int(new_h))
-                timelapse_info['Zoom'] = data['Zoom']
-            if 'AnalogueGain' in data:
-                controls['AnalogueGain'] = float(data['AnalogueGain'])
-                timelapse_info['AnalogueGain'] = controls['AnalogueGain']
-
-            picam2.set_controls(controls)
-            logging.info(f'Setting Controls: {controls}')
+        apply_controls(picam2, timelapse_info, data)
+
+def apply_controls(picam2, timelapse_info, data):
+    controls = {}
+    if 'ExposureTime' in data and int(data['ExposureTime']) > 0:
+        controls['ExposureTime'] = int(data['ExposureTime'])
+        print(f'data: {data}')
+        # calculate framerate from new exposure Time
+        fps = data['ExposureTime'] / 1000000
+        # if fps >
+        controls['FrameDurationLimits'] = (int(data['ExposureTime']), int(data['ExposureTime']))
+        controls["AeEnable"] = False
+        controls["AwbEnable"] =  False
+        logging.info(f'New settings: Exposure time: {data["ExposureTime"]}, FPS: {fps}')
+        timelapse_info['ExposureTime'] = data['ExposureTime']
+        timelapse_info['FrameRate'] = fps
+    if 'Zoom' in data:
+        x, y, w, h = original_scaler_crop
+        new_w = w/data['Zoom']
+        new_h = h/data['Zoom']
+        new_x = x + w/2 - new_w/2
+        new_y = y + h/2 - new_h/2
+        controls['ScalerCrop'] = (int(new_x), int(new_y), int(new_w), int(new_h))
+        timelapse_info['Zoom'] = data['Zoom']
+    if 'AnalogueGain' in data:
+        controls['AnalogueGain'] = float(data['AnalogueGain'])
+        timelapse_info['AnalogueGain'] = controls['AnalogueGain']
+
+    picam2.set_controls(controls)
+    logging.info(f'Setting Controls: {controls}')
+    return controls
 
 def update_exposure(signum, frame):
     global SET_EXPOSURE
@@ -332,19 +337,64 @@ if 'AfMode' in picam2.camera_controls:
     logging.info(f'Turning off auto focus')
     picam2.set_controls({'AfMode': libcamera.controls.AfModeEnum.Manual, "LensPosition": 0.0})
 
-def capture_image():
+def capture_image(requests=()):
+    """
+    Capture a frame and save it, now or on the save pipeline. Control requests waiting for this frame are
+    answered once it is on disk.
+    """
     r = picam2.capture_request()
     metadata = r.get_metadata()
     lux = metadata['Lux'] if 'Lux' in metadata else 'NOLUX'
     exp_time = metadata['ExposureTime'] if 'ExposureTime' in metadata else 'NOEXP'
     ts = datetime.strftime(now, '%Y%m%d_%H%M%S.%f')
     image_file = os.path.join(frame_path, f"{ts}_L{lux:.4f}_E{exp_time}.jpg")
-    r.save("main", image_file)
-    r.release()
-    image_base_name = os.path.basename(image_file)
-    metalog.addline(f'{image_base_name} | {metadata}')
     time_remaining_string = '' if stop_at is None else f' Stopping in {timedelta_string(stop_at - now)}'
+    frame = {'path': image_file, 'metadata': metadata}
+    if saver is None:
+        r.save("main", image_file)
+        r.release()
+        frame_saved((frame, requests, time_remaining_string), None)
+        return
+    if not saver.reserve():
+        r.release()
+        logging.warning(f'Save queue full, dropped {os.path.basename(image_file)} ({saver.dropped} dropped)')
+        # answer them with the next frame instead
+        waiting_for_frame[:0] = requests
+        return
+    try:
+        # a copy, so the camera gets its buffer back before the frame is encoded
+        image = r.make_image("main")
+    except Exception:
+        saver.cancel()
+        raise
+    finally:
+        r.release()
+    saver.submit(image_file,
+                 lambda path: picam2.helpers.save(image, metadata, path, format='jpg'),
+                 (frame, requests, time_remaining_string))
+
+def frame_saved(context, error):
+    # called in capture order once the frame is on disk
+    frame, requests, time_remaining_string = context
+    if error is not None:
+        for request in requests:
+            request.fail(f'Failed to save frame: {error}')
+        return
+    global last_frame, frame_count
+    image_base_name = os.path.basename(frame['path'])
+    metalog.write({'file': image_base_name, **frame['metadata']})
     logging.info(f"Captured {image_base_name}. {time_remaining_string}")
+    last_frame = frame
+    frame_count += 1
+    for request in requests:
+        request.reply({'frame': frame, 'timelapse_info': timelapse_info})
+
+last_frame = None
+frame_count = 0
+saver = None
+if args.save_workers > 0 and not args.singleshot:
+    logging.info(f'Saving frames on {args.save_workers} threads, queue size {args.save_queue}')
+    saver = SavePipeline(workers=args.save_workers, max_pending=args.save_queue, on_saved=frame_saved)
 
 logging.info(f'Setting up signal handler for single shot mode')
 def take_single_shot(signum, frame):
@@ -424,6 +474,66 @@ if args.notes:
 
     write_notes(timelapse_info)
 
+CONTROL_COMMANDS = ['set_controls', 'single_shot', 'status']
+control_server = None
+if args.control_socket:
+    try:
+        control_server = ControlServer(args.control_socket, CONTROL_COMMANDS)
+        timelapse_info['ControlSocket'] = args.control_socket
+        with open(timelapse_info_path, 'w') as f:
+            f.write(json.dumps(timelapse_info))
+    except OSError as e:
+        logging.error(f'Could not open control socket {args.control_socket}: {e}. Using signals only.')
+# control requests waiting for the next frame (continuous mode)
+waiting_for_frame = []
+
+def status():
+    return {
+        'timelapse_info': timelapse_info,
+        'mode': 'singleshot' if args.singleshot else 'continuous',
+        'frames': frame_count,
+        'running_seconds': (datetime.now() - start_time).total_seconds(),
+        'last_frame': last_frame,
+        'save_pipeline': None if saver is None else saver.stats(),
+    }
+
+def handle_control_request(request):
+    logging.info(f'Control request: {request.command} {request.args}')
+    try:
+        if request.command == 'status':
+            request.reply(status())
+            return
+        if request.command == 'set_controls':
+            controls = apply_controls(picam2, timelapse_info, request.args)
+            if args.notes:
+                write_notes(timelapse_info, 'UPDATE')
+            if not request.args.get('capture', True):
+                request.reply({'controls': controls, 'timelapse_info': timelapse_info})
+                return
+        if args.singleshot:
+            capture_image([request])
+        else:
+            # answered with the next frame the timelapse takes
+            waiting_for_frame.append(request)
+    except Exception as e:
+        logging.exception(f'Control request {request.command} failed')
+        request.fail(f'{e}')
+
+def take_waiting_requests():
+    requests = waiting_for_frame[:]
+    del waiting_for_frame[:]
+    return requests
+
+def handle_control_requests(timeout=None):
+    if control_server is None:
+        if timeout:
+            time.sleep(timeout)
+        return
+    request = control_server.get(timeout)
+    while request is not None:
+        handle_control_request(request)
+        request = control_server.get()
+
 logging.info(f'READY FOR HELPER')
 if args.singleshot:
     logging.info('Singleshot Mode')
@@ -444,9 +554,11 @@ while True:
                 logging.info(p.stdout)
         break
     if args.singleshot:
-        time.sleep(1)
+        # wait for requests from the helper instead of sleeping
+        handle_control_requests(timeout=1.0)
     else:
-        capture_image()
+        capture_image(take_waiting_requests())
+        handle_control_requests()
 
     if TIME_TO_STOP:
         logging.info('Program stopping')
@@ -459,4 +571,11 @@ while True:
         SET_EXPOSURE = False
 
 logging.info(f'Shutting down camera')
-picam2.stop()
\ No newline at end of file
+picam2.stop()
+if saver is not None:
+    saver.close()
+if control_server is not None:
+    for request in waiting_for_frame:
+        request.fail('Timelapse stopped')
+    control_server.close()
+metalog.close()
\ No newline at end of file
@@ -1,5 +1,4 @@
 import argparse
-import json
 import logging
 import os
 import queue
@@ -15,8 +14,10 @@ from pilapse.pause_until import pause_until
 from pilapse.colors import BGR
 from pilapse.threads import ImageProducer, CameraImage
 from pilapse.scheduling import Schedule
-from pilapse.light_meter import LightMeter
+from pilapse.light_meter import LightMeter, LuxFilter
+from pilapse.log_writer import BufferedLogWriter
 from pilapse.suntime import Suntime
+from pilapse.exposure_schedule import ExposureSchedule
 from pilapse.video_clip import VideoClip
 
 from datetime import datetime, timedelta
@@ -128,6 +129,14 @@ class CameraProducer(ImageProducer):
                             help='Automatically update the camera shutter speed / iso based on time of day and / or '
                                  'light meter readings (if available)')
 
+        camera.add_argument('--light-meter-rate', type=float, default=1.0,
+                            help='Light meter readings per second, taken in the background. '
+                                 '0 reads the sensor for every frame. Default: 1.0')
+        camera.add_argument('--light-meter-filter', choices=LuxFilter.METHODS, default='ema',
+                            help='Smoothing applied to background light meter readings. Default: ema')
+        camera.add_argument('--light-meter-window', type=int, default=5,
+                            help='Number of readings for the "median" light meter filter. Default: 5')
+
         parser.add_argument('--suntime-settings', type=str,
                             help='path to json file with camera settings for each "suntime". '
                                  'Used as keyframes to calculate current values')
@@ -159,6 +168,9 @@ class CameraProducer(ImageProducer):
         self.process_config(config)
         self.suntimes = None
         self.load_suntimes()
+        self.camera_settings = None
+        self.exposure_schedule:ExposureSchedule = None
+        self.load_suntime_settings()
 
         self.width:int = config.width
         self.height:int = config.height
@@ -178,10 +190,11 @@ class CameraProducer(ImageProducer):
         self.capture_exception_count = 0
         self.capture_exception_count_total = 0
 
+        self.settings_log:BufferedLogWriter = None
         if self.config.camera_settings_log is not None:
-            if '%' in self.config.camera_settings_log:
-                self.config.camera_settings_log = datetime.strftime(datetime.now(), self.config.camera_settings_log)
-            logging.info(f'Logging camera settings to "{self.config.camera_settings_log}"')
+            self.settings_log = BufferedLogWriter(self.config.camera_settings_log, format='csv',
+                                                  name='SettingsLog')
+            logging.info(f'Logging camera settings to "{self.settings_log.path}"')
 
         self.system = SystemResources()
 
@@ -221,14 +234,14 @@ class CameraProducer(ImageProducer):
                                     rotation=self.config.rotate,
                                     nightsky=self.config.nightsky)
 
-        self.light_meter = LightMeter()
+        self.light_meter = LightMeter(sample_rate=self.config.light_meter_rate,
+                                      filter=self.config.light_meter_filter,
+                                      window=self.config.light_meter_window)
         logging.info(f'Light meter available: {self.light_meter.available}')
 
         self.nextframe_time = self.now
         self.schedule = Schedule(self.config)
         if self.config.auto_cam:
-            if self.config.suntime_settings:
-                pass
             # need to calculate and set initial ISO / shutter speed
             iso, shutter_speed = self.calculate_camera_settings()
             logging.info(f'Before setting ISO to {iso}: analog gain: {self.camera.picamera.analog_gain}, '
@@ -268,10 +281,11 @@ class CameraProducer(ImageProducer):
         iso = 0
         shutter_speed = 0
         if self.config.auto_cam:
-            if self.light_meter.available:
+            lux = self.light_meter.lux if self.light_meter.available else None
+            if lux is not None:
                 iso = 100
-                shutter_speed = int(self.shutter_speed_from_lux(self.light_meter.lux) * 1000000)
-                logging.info(f'setting camera from lux: shutter speed: {shutter_speed}')
+                shutter_speed = int(self.shutter_speed_from_lux(lux) * 1000000)
+                logging.debug(f'setting camera from lux: shutter speed: {shutter_speed}')
                 return iso, shutter_speed
             return self.calculate_camera_settings_from_time()
         else:
@@ -281,6 +295,9 @@ class CameraProducer(ImageProducer):
     def on_shutdown(self):
         logging.warning(f'{self.name} shutdown event received')
         self.check_video_clip()
+        self.light_meter.stop()
+        if self.settings_log is not None:
+            self.settings_log.close()
         self.camera.shutdown()
 
     def on_clip_complete(self):
@@ -380,29 +397,26 @@ class CameraProducer(ImageProducer):
                 self.split_video_clip()
 
     def calculate_camera_settings_from_time(self):
-        p0, p1, pct = self.suntimes.get_part_of_day_percent()
-        iso0 = self.config.camera_settings[p0]['iso']
-        shutter0 = self.config.camera_settings[p0]['shutter']
-
-        iso1 = self.config.camera_settings[p1]['iso']
-        shutter1 = self.config.camera_settings[p1]['shutter']
-
-        iso = int(iso0) if iso0 == iso1 else int(iso0 + (iso1 - iso0) * pct)
-        shutter = int(shutter0) if shutter0 == shutter1 else int(shutter0 + (shutter1 - shutter0) * pct)
-
-        logging.info(f'      ISO: {iso0} - {iso1} ({pct:.4f}) {iso}')
-        logging.info(f'  SHUTTER: {shutter0} - {shutter1} ({pct:.4f}) {shutter}')
-        return (iso, shutter)
+        if self.camera_settings is None:
+            # no keyframes: let the camera decide
+            return 0, 0
+        now = self.now.timestamp()
+        if self.exposure_schedule is None or not self.exposure_schedule.is_current(now):
+            self.exposure_schedule = ExposureSchedule.for_day(self.camera_settings, self.config.location,
+                                                              day=self.now.date())
+        iso, shutter, framerate = self.exposure_schedule.lookup(now)
+        return iso, shutter
 
     def load_suntime_settings(self):
-        self.config.camera_settings = None
-        if self.config.auto_cam:
-            if self.config.suntimes_settings:
-                if not os.path.exists(self.config.suntimes_settings):
-                    logging.info(f'Camera suntimes settings file not found ({self.config.suntimes_settings})')
-
-                with open(self.config.settings) as config_file:
-                    self.config.camera_settings = json.loads(config_file.read())
+        self.camera_settings = None
+        if self.config.auto_cam and self.config.suntime_settings:
+            if not self.config.location:
+                logging.error(f'--suntime-settings requires --location. Ignoring {self.config.suntime_settings}')
+                return
+            try:
+                self.camera_settings = ExposureSchedule.load_camera_settings(self.config.suntime_settings)
+            except FileNotFoundError as e:
+                logging.error(f'{e}')
 
     def load_suntimes(self):
         if self.config.location:
@@ -513,17 +527,13 @@ class CameraProducer(ImageProducer):
                                     float(self.camera.picamera.digital_gain),
                                     awb_gains,
                                     lux)
-                if self.config.camera_settings_log is not None:
-                    with open(self.config.camera_settings_log, 'a') as logfile:
-                        settings = img.camera_settings
-                        logline = f'{img.timestamp_long},{settings["shutter-speed"]},{settings["iso"]},' \
-                                  f'{settings["aperture"]},{settings["awb-mode"]},{settings["meter-mode"]},' \
-                                  f'{settings["exposure-mode"]},{settings["analog-gain"]},{settings["digital-gain"]},' \
-                                  f'{settings["lux"]},{self.camera.model},{pilapse.get_program_name()},' \
-                                  f'{self.system.model},{self.system.hostname}\n'
-                        logfile.write(logline)
-                        logfile.flush()
-                        logging.debug(f'SETTINGS: {logline}')
+                if self.settings_log is not None:
+                    settings = img.camera_settings
+                    self.settings_log.write((img.timestamp_long, settings["shutter-speed"], settings["iso"],
+                                             settings["aperture"], settings["awb-mode"], settings["meter-mode"],
+                                             settings["exposure-mode"], settings["analog-gain"],
+                                             settings["digital-gain"], settings["lux"], self.camera.model,
+                                             pilapse.get_program_name(), self.system.model, self.system.hostname))
 
                 logging.debug(f'captured {img.base_filename}')
                 self.add_to_out_queue(img)
@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+
+class ControlRequest(object):
+    """
+    One request from a control client. The program's main loop handles it and calls reply() or fail(),
+    which sends the response back to the waiting client.
+    """
+    def __init__(self, command:str, args:dict, request_id=None):
+        self.command = command
+        self.args = args
+        self.id = request_id
+        self.received = time.time()
+        self.response = None
+        self.done = threading.Event()
+
+    def reply(self, result:dict=None):
+        self.response = {'id': self.id, 'ok': True, 'result': result or {},
+                         'elapsed': round(time.time() - self.received, 4)}
+        self.done.set()
+
+    def fail(self, error:str):
+        self.response = {'id': self.id, 'ok': False, 'error': error,
+                         'elapsed': round(time.time() - self.received, 4)}
+        self.done.set()
+
+
+class ControlServer(object):
+    """
+    Unix domain socket control channel. Clients send one JSON object per line:
+        {"id": 1, "command": "status", "args": {}}
+    and get one JSON object per line back:
+        {"id": 1, "ok": true, "result": {...}, "elapsed": 0.01}
+    Requests are queued for the main loop (see get()) so camera calls stay on the thread that owns the camera.
+    """
+    def __init__(self, socket_path:str, commands:list, reply_timeout:float=300.0):
+        self.socket_path = socket_path
+        self.commands = commands
+        self.reply_timeout = reply_timeout
+        self.requests = queue.Queue()
+        if os.path.exists(socket_path):
+            # left over from a previous run
+            os.remove(socket_path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(socket_path)
+        os.chmod(socket_path, 0o660)
+        self.socket.listen(4)
+        self.running = True
+        self.thread = threading.Thread(target=self.accept_loop, name='ControlServer', daemon=True)
+        self.thread.start()
+        logging.info(f'Control socket: {socket_path}')
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle_connection, args=(connection,), name='ControlClient',
+                             daemon=True).start()
+
+    def handle_connection(self, connection:socket.socket):
+        with connection, connection.makefile('rwb') as stream:
+            for line in stream:
+                response = self.handle_line(line)
+                stream.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+                stream.flush()
+
+    def handle_line(self, line:bytes) -> dict:
+        try:
+            message = json.loads(line)
+            command = message['command']
+        except (ValueError, KeyError, TypeError) as e:
+            return {'id': None, 'ok': False, 'error': f'Bad request: {e}'}
+        request = ControlRequest(command, message.get('args') or {}, message.get('id'))
+        if command not in self.commands:
+            request.fail(f'Unknown command "{command}". Must be one of {self.commands}')
+            return request.response
+        self.requests.put(request)
+        if not request.done.wait(self.reply_timeout):
+            request.fail(f'No response after {self.reply_timeout} seconds')
+        return request.response
+
+    def get(self, timeout:float=None) -> ControlRequest:
+        """
+        The next request for the main loop, or None if there is none within timeout
+        """
+        try:
+            return self.requests.get(timeout=timeout) if timeout else self.requests.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.running = False
+        self.socket.close()
+        while True:
+            request = self.get()
+            if request is None:
+                break
+            request.fail('Shutting down')
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
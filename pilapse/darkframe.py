@@ -2,6 +2,7 @@ import cv2
 import imutils
 import numpy
 import logging
+import pathlib
 
 from pilapse import colors
 
@@ -33,3 +34,114 @@ def apply_darkframe(image, contours, highlight=False):
             cv2.rectangle(outimage, (x, y), (x + w, y + h), colors.GREEN)
 
     return outimage
+
+
+class HotPixelMask(object):
+    """
+    Binary mask of the hot pixels in a darkframe. Hot pixels are replaced with the median of the
+    neighbouring pixels that are not hot. Pixels inside clusters too big for the neighbourhood are inpainted.
+    """
+    def __init__(self, mask:numpy.ndarray, radius:int=2):
+        self.mask = (mask > 0).astype(numpy.uint8) * 255
+        self.radius = radius
+        height, width = self.mask.shape
+        self.ys, self.xs = numpy.nonzero(self.mask)
+        offsets = [(dy, dx) for dy in range(-radius, radius + 1) for dx in range(-radius, radius + 1) if dy or dx]
+        dy = numpy.array([o[0] for o in offsets], dtype=numpy.int32)
+        dx = numpy.array([o[1] for o in offsets], dtype=numpy.int32)
+        self.neighbour_ys = numpy.clip(self.ys[:, None] + dy, 0, height - 1)
+        self.neighbour_xs = numpy.clip(self.xs[:, None] + dx, 0, width - 1)
+        self.valid = self.mask[self.neighbour_ys, self.neighbour_xs] == 0
+        has_valid = self.valid.any(axis=1)
+        # hot pixels with no usable neighbours are left to cv2.inpaint
+        self.inpaint_mask = numpy.zeros_like(self.mask)
+        self.inpaint_mask[self.ys[~has_valid], self.xs[~has_valid]] = 255
+        self.ys = self.ys[has_valid]
+        self.xs = self.xs[has_valid]
+        self.neighbour_ys = self.neighbour_ys[has_valid]
+        self.neighbour_xs = self.neighbour_xs[has_valid]
+        self.valid = self.valid[has_valid]
+
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    @property
+    def count(self):
+        return int(numpy.count_nonzero(self.mask))
+
+    @classmethod
+    def from_darkframe(cls, darkimage, threshold=6):
+        """
+        threshold is on the 8 bit scale. 16 bit darkframes are scaled to 8 bits first, the same way
+        cv2.imread does when load() reads them back
+        """
+        if darkimage.dtype == numpy.uint16:
+            darkimage = cv2.convertScaleAbs(darkimage, alpha=1.0 / 256)
+        elif darkimage.dtype != numpy.uint8:
+            raise ValueError(f'Darkframes must be 8 or 16 bit, not {darkimage.dtype}')
+        darkgray = cv2.cvtColor(darkimage, cv2.COLOR_BGR2GRAY) if darkimage.ndim == 3 else darkimage
+        (T, thresh) = cv2.threshold(darkgray, threshold, 255, cv2.THRESH_BINARY)
+        return cls(thresh)
+
+    @staticmethod
+    def mask_path(darkframe_path, threshold=6) -> pathlib.Path:
+        darkframe_path = pathlib.Path(darkframe_path)
+        return darkframe_path.with_name(f'{darkframe_path.stem}_hotpixels_t{threshold}.png')
+
+    @classmethod
+    def load(cls, darkframe_path, threshold=6):
+        """
+        Load the mask saved next to the darkframe, building (and saving) it if it is missing or out of date
+        """
+        darkframe_path = pathlib.Path(darkframe_path)
+        mask_path = cls.mask_path(darkframe_path, threshold)
+        if mask_path.exists() and mask_path.stat().st_mtime >= darkframe_path.stat().st_mtime:
+            mask = cv2.imread(str(mask_path), cv2.IMREAD_GRAYSCALE)
+            if mask is not None:
+                logging.info(f'Loaded hot pixel mask {mask_path}')
+                return cls(mask)
+        darkimage = cv2.imread(str(darkframe_path))
+        if darkimage is None:
+            raise Exception(f'Unable to read darkframe {darkframe_path}')
+        hot_pixels = cls.from_darkframe(darkimage, threshold=threshold)
+        logging.info(f'Found {hot_pixels.count} hot pixels in {darkframe_path}')
+        try:
+            hot_pixels.save(mask_path)
+        except OSError as e:
+            logging.warning(f'Unable to save hot pixel mask to {mask_path}: {e}')
+        return hot_pixels
+
+    def scaled(self, width:int, height:int):
+        """
+        Mask for images reduced to width x height. A reduced pixel is hot if any pixel it covers was hot.
+        """
+        if (height, width) == self.mask.shape:
+            return self
+        mask = cv2.resize(self.mask, (width, height), interpolation=cv2.INTER_AREA)
+        return HotPixelMask(mask, radius=self.radius)
+
+    def save(self, path):
+        if not cv2.imwrite(str(path), self.mask):
+            raise OSError(f'Failed to write {path}')
+
+    def apply(self, image, method='median', highlight=False, inplace=False):
+        if image.shape[:2] != self.mask.shape:
+            raise Exception(f'Image size {image.shape[1]}x{image.shape[0]} does not match hot pixel mask '
+                            f'size {self.mask.shape[1]}x{self.mask.shape[0]}')
+        if method == 'inpaint':
+            outimage = cv2.inpaint(image, self.mask, self.radius, cv2.INPAINT_TELEA)
+        else:
+            outimage = image if inplace else image.copy()
+            if len(self.ys) > 0:
+                neighbours = image[self.neighbour_ys, self.neighbour_xs].astype(numpy.float32)
+                neighbours[~self.valid] = numpy.nan
+                outimage[self.ys, self.xs] = numpy.nanmedian(neighbours, axis=1).astype(image.dtype)
+            if self.inpaint_mask.any():
+                outimage = cv2.inpaint(outimage, self.inpaint_mask, self.radius, cv2.INPAINT_TELEA)
+        if highlight:
+            contours = imutils.grab_contours(cv2.findContours(self.mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE))
+            for c in contours:
+                (x, y, w, h) = cv2.boundingRect(c)
+                cv2.rectangle(outimage, (x - 1, y - 1), (x + w, y + h), colors.GREEN)
+        return outimage
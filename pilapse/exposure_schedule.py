@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from pilapse.suntime import Suntime
+
+
+class ExposureSchedule(object):
+    """
+    A day's camera settings, precomputed from the "suntime" keyframes in camera_settings.json.
+    Settings are interpolated between keyframes once, at `step` second intervals, so looking up the
+    settings for a frame is a bisect into a sorted list of timestamps.
+    """
+    KEYFRAMES = ('y_last_light', 'first_light', 'dawn', 'sunrise', 'solar_noon', 'golden_hour',
+                 'sunset', 'dusk', 'last_light', 't_first_light')
+
+    def __init__(self, camera_settings:dict, suntimes:Suntime, step:float=10.0):
+        missing = [name for name in self.KEYFRAMES if name not in camera_settings]
+        if missing:
+            raise Exception(f'Camera settings are missing keyframes: {", ".join(missing)}')
+        self.suntimes = suntimes
+        self.day:date = suntimes.day
+        midnight = datetime(self.day.year, self.day.month, self.day.day)
+        self.valid_from:float = self.timestamp(midnight)
+        self.valid_until:float = self.timestamp(midnight + timedelta(days=1))
+
+        keyframe_times = np.array([self.timestamp(getattr(suntimes, name)) for name in self.KEYFRAMES])
+        # suntimes can coincide near the poles. Keep keyframe times increasing so np.interp behaves
+        keyframe_times = np.maximum.accumulate(keyframe_times)
+        times = np.arange(keyframe_times[0], keyframe_times[-1], step)
+        times = np.append(times, keyframe_times[-1])
+
+        def interpolate(key, default=0):
+            values = np.array([float(camera_settings[name].get(key, default)) for name in self.KEYFRAMES])
+            return np.interp(times, keyframe_times, values)
+
+        self.times:list = times.tolist()
+        self.iso:list = interpolate('iso').astype(int).tolist()
+        self.shutter:list = interpolate('shutter').astype(int).tolist()
+        self.framerate:list = interpolate('framerate').tolist()
+        logging.info(f'Exposure schedule for {self.day}: {len(self.times)} entries, '
+                     f'{suntimes.y_last_light} to {suntimes.t_first_light}')
+
+    def timestamp(self, value:datetime) -> float:
+        # suntimes are naive datetimes in the Suntime's timezone (system local time if it has none)
+        return value.replace(tzinfo=self.suntimes.tz).timestamp()
+
+    @classmethod
+    def load_camera_settings(cls, path:str) -> dict:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'Camera suntimes settings file not found ({path})')
+        with open(path) as settings_file:
+            return json.load(settings_file)
+
+    @classmethod
+    def for_day(cls, camera_settings:dict, location, day='today', step:float=10.0):
+        return ExposureSchedule(camera_settings, Suntime(location, date=day), step=step)
+
+    def is_current(self, now:float=None) -> bool:
+        if now is None:
+            now = time.time()
+        return self.valid_from <= now < self.valid_until
+
+    def lookup(self, now:float=None):
+        """
+        Returns (iso, shutter, framerate) for the POSIX timestamp `now` (default: the current time)
+        """
+        if now is None:
+            now = time.time()
+        i = bisect_right(self.times, now) - 1
+        if i < 0:
+            i = 0
+        return self.iso[i], self.shutter[i], self.framerate[i]
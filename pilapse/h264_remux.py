@@ -0,0 +1,459 @@
+"""
+Lossless remuxing of raw H.264 (Annex-B) clips into an MP4 / MOV container.
+
+The camera writes bare H.264 elementary streams (.h264). Players want a container, but wrapping the stream does not
+require decoding it: we split the stream into NAL units, group them into access units (frames), and write them as
+length-prefixed samples with the sample tables a container needs. No pixels are touched, so this is fast and lossless.
+
+The Picamera encoders do not produce B-frames, so decode order is presentation order and no composition time
+offsets (ctts) are written.
+"""
+import logging
+import os
+import struct
+
+DEFAULT_FPS = 30
+MEDIA_TIMESCALE = 90000
+MOVIE_TIMESCALE = 1000
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SEI = 6
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+# NAL unit types that start a new access unit when they follow a frame's slices
+AU_DELIMITING_TYPES = (NAL_SEI, NAL_SPS, NAL_PPS, NAL_AUD, 14, 15, 16, 17, 18)
+
+# profiles that carry chroma format / bit depth in the SPS (and in the avcC extension)
+HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+# profiles whose avcC has the chroma format / bit depth extension (144 is the retired High 4:4:4)
+AVCC_EXTENSION_PROFILES = (100, 110, 122, 144, 244)
+
+START_CODE = b'\x00\x00\x01'
+
+
+class H264RemuxError(Exception):
+    pass
+
+
+def iter_nal_units(stream, chunk_size:int=1024 * 1024):
+    """
+    Yield the NAL units (without start codes) of an Annex-B byte stream
+    :param stream: binary file-like object
+    :param chunk_size: number of bytes to read at a time
+    """
+    buffer = bytearray()
+    nal_start = -1
+    search_from = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if chunk:
+            buffer += chunk
+        while True:
+            i = buffer.find(START_CODE, search_from)
+            if i < 0:
+                break
+            if nal_start >= 0:
+                # trailing zeros belong to the next (4 byte) start code
+                nal = bytes(buffer[nal_start:i]).rstrip(b'\x00')
+                if nal:
+                    yield nal
+            nal_start = i + len(START_CODE)
+            search_from = nal_start
+        if not chunk:
+            if nal_start >= 0:
+                nal = bytes(buffer[nal_start:]).rstrip(b'\x00')
+                if nal:
+                    yield nal
+            return
+        # drop what we have already handed out, keep enough to find a start code split across chunks
+        keep_from = nal_start if nal_start >= 0 else max(0, len(buffer) - len(START_CODE) + 1)
+        if keep_from > 0:
+            del buffer[:keep_from]
+            if nal_start >= 0:
+                nal_start = 0
+        search_from = max(nal_start, len(buffer) - len(START_CODE) + 1, 0)
+
+
+def nal_type(nal:bytes) -> int:
+    return nal[0] & 0x1f
+
+
+def iter_access_units(nal_units):
+    """
+    Group NAL units into access units (one coded frame each)
+    :param nal_units: iterable of NAL units, as returned by iter_nal_units
+    :return: generator of lists of NAL units
+    """
+    current = []
+    has_slices = False
+    for nal in nal_units:
+        t = nal_type(nal)
+        if t in (NAL_SLICE, NAL_IDR):
+            # first_mb_in_slice is ue(v): it is zero (new picture) when the first bit is set
+            first_slice = len(nal) > 1 and (nal[1] & 0x80) != 0
+            if has_slices and first_slice:
+                yield current
+                current = []
+            current.append(nal)
+            has_slices = True
+        elif t in AU_DELIMITING_TYPES:
+            if has_slices:
+                yield current
+                current = []
+                has_slices = False
+            current.append(nal)
+        else:
+            current.append(nal)
+    if has_slices:
+        yield current
+
+
+def count_frames(path) -> int:
+    """
+    Count the frames in a raw H.264 file without decoding it
+    """
+    with open(path, 'rb') as stream:
+        return sum(1 for _ in iter_access_units(iter_nal_units(stream)))
+
+
+class BitReader:
+    def __init__(self, data:bytes):
+        self.data = data
+        self.pos = 0
+
+    def u(self, nbits:int) -> int:
+        value = 0
+        for _ in range(nbits):
+            byte = self.data[self.pos >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def ue(self) -> int:
+        leading_zeros = 0
+        while self.u(1) == 0:
+            leading_zeros += 1
+        return (1 << leading_zeros) - 1 + self.u(leading_zeros)
+
+    def se(self) -> int:
+        k = self.ue()
+        return (k + 1) // 2 if k & 1 else -(k // 2)
+
+
+def nal_to_rbsp(nal:bytes) -> bytes:
+    """remove emulation prevention bytes (00 00 03 -> 00 00)"""
+    return nal.replace(b'\x00\x00\x03', b'\x00\x00')
+
+
+class SequenceParameterSet:
+    def __init__(self, nal:bytes):
+        if nal_type(nal) != NAL_SPS:
+            raise H264RemuxError(f'Not an SPS NAL unit (type {nal_type(nal)})')
+        self.nal = nal
+        self.fps = None
+        self.chroma_format_idc = 1
+        self.bit_depth_luma = 8
+        self.bit_depth_chroma = 8
+        try:
+            self._parse(BitReader(nal_to_rbsp(nal[1:])))
+        except IndexError:
+            raise H264RemuxError('Truncated SPS')
+
+    @staticmethod
+    def _skip_scaling_list(r:BitReader, size:int):
+        last_scale = 8
+        next_scale = 8
+        for _ in range(size):
+            if next_scale != 0:
+                next_scale = (last_scale + r.se() + 256) % 256
+            last_scale = next_scale if next_scale != 0 else last_scale
+
+    def _parse(self, r:BitReader):
+        self.profile_idc = r.u(8)
+        self.constraint_flags = r.u(8)
+        self.level_idc = r.u(8)
+        self.sps_id = r.ue()
+        separate_colour_plane = 0
+        if self.profile_idc in HIGH_PROFILES:
+            self.chroma_format_idc = r.ue()
+            if self.chroma_format_idc == 3:
+                separate_colour_plane = r.u(1)
+            self.bit_depth_luma = r.ue() + 8
+            self.bit_depth_chroma = r.ue() + 8
+            r.u(1) # qpprime_y_zero_transform_bypass_flag
+            if r.u(1): # seq_scaling_matrix_present_flag
+                for i in range(8 if self.chroma_format_idc != 3 else 12):
+                    if r.u(1):
+                        self._skip_scaling_list(r, 16 if i < 6 else 64)
+        r.ue() # log2_max_frame_num_minus4
+        pic_order_cnt_type = r.ue()
+        if pic_order_cnt_type == 0:
+            r.ue() # log2_max_pic_order_cnt_lsb_minus4
+        elif pic_order_cnt_type == 1:
+            r.u(1)
+            r.se()
+            r.se()
+            for _ in range(r.ue()):
+                r.se()
+        r.ue() # max_num_ref_frames
+        r.u(1) # gaps_in_frame_num_value_allowed_flag
+        width_in_mbs = r.ue() + 1
+        height_in_map_units = r.ue() + 1
+        frame_mbs_only = r.u(1)
+        if not frame_mbs_only:
+            r.u(1) # mb_adaptive_frame_field_flag
+        r.u(1) # direct_8x8_inference_flag
+        crop_left = crop_right = crop_top = crop_bottom = 0
+        if r.u(1): # frame_cropping_flag
+            crop_left = r.ue()
+            crop_right = r.ue()
+            crop_top = r.ue()
+            crop_bottom = r.ue()
+
+        if self.chroma_format_idc == 0 or separate_colour_plane:
+            crop_unit_x = 1
+            crop_unit_y = 2 - frame_mbs_only
+        else:
+            crop_unit_x = 1 if self.chroma_format_idc == 3 else 2
+            crop_unit_y = (2 if self.chroma_format_idc == 1 else 1) * (2 - frame_mbs_only)
+        self.width = width_in_mbs * 16 - crop_unit_x * (crop_left + crop_right)
+        self.height = (2 - frame_mbs_only) * height_in_map_units * 16 - crop_unit_y * (crop_top + crop_bottom)
+
+        if r.u(1): # vui_parameters_present_flag
+            self._parse_vui_timing(r)
+
+    def _parse_vui_timing(self, r:BitReader):
+        if r.u(1): # aspect_ratio_info_present_flag
+            if r.u(8) == 255: # Extended_SAR
+                r.u(16)
+                r.u(16)
+        if r.u(1): # overscan_info_present_flag
+            r.u(1)
+        if r.u(1): # video_signal_type_present_flag
+            r.u(4)
+            if r.u(1): # colour_description_present_flag
+                r.u(24)
+        if r.u(1): # chroma_loc_info_present_flag
+            r.ue()
+            r.ue()
+        if r.u(1): # timing_info_present_flag
+            num_units_in_tick = r.u(32)
+            time_scale = r.u(32)
+            if num_units_in_tick > 0 and time_scale > 0:
+                self.fps = time_scale / (2 * num_units_in_tick)
+
+
+def box(box_type:bytes, *payload:bytes) -> bytes:
+    content = b''.join(payload)
+    return struct.pack('>I', 8 + len(content)) + box_type + content
+
+
+def full_box(box_type:bytes, version:int, flags:int, *payload:bytes) -> bytes:
+    return box(box_type, struct.pack('>I', (version << 24) | flags), *payload)
+
+
+UNITY_MATRIX = struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+
+class H264Remuxer:
+    """
+    Write one or more raw H.264 files into a single MP4 / MOV file.
+
+    Samples are streamed into the mdat box as they are read, so memory use is limited to the sample tables.
+    The brand (mp4 or QuickTime) follows the extension of the output file.
+    """
+    def __init__(self, output_path:str, fps:float=None):
+        self.output_path = output_path
+        self.requested_fps = fps
+        self.sps_list = []
+        self.pps_list = []
+        self.sample_sizes = []
+        self.sync_samples = []
+        self._file = open(output_path, 'wb')
+        self._file.write(self._ftyp())
+        self._mdat_start = self._file.tell()
+        # 64 bit mdat header so we do not have to know the size in advance
+        self._file.write(struct.pack('>I4sQ', 1, b'mdat', 0))
+        self._data_start = self._file.tell()
+        self.closed = False
+
+    @property
+    def frame_count(self) -> int:
+        return len(self.sample_sizes)
+
+    @property
+    def fps(self) -> float:
+        if self.requested_fps:
+            return float(self.requested_fps)
+        if self.sps_list:
+            sps = SequenceParameterSet(self.sps_list[0])
+            if sps.fps:
+                return sps.fps
+        return DEFAULT_FPS
+
+    def _ftyp(self) -> bytes:
+        if os.path.splitext(self.output_path)[1].lower() == '.mov':
+            return box(b'ftyp', b'qt  ', struct.pack('>I', 0x20050300), b'qt  ')
+        return box(b'ftyp', b'isom', struct.pack('>I', 512), b'isom', b'iso2', b'avc1', b'mp41')
+
+    def add_file(self, path) -> int:
+        """
+        Append the frames of a raw H.264 file
+        :return: number of frames added
+        """
+        with open(path, 'rb') as stream:
+            return self.add_stream(stream)
+
+    def add_stream(self, stream) -> int:
+        n = 0
+        for access_unit in iter_access_units(iter_nal_units(stream)):
+            self._add_access_unit(access_unit)
+            n += 1
+        return n
+
+    def _add_access_unit(self, access_unit):
+        sample = bytearray()
+        keyframe = False
+        for nal in access_unit:
+            t = nal_type(nal)
+            # parameter sets go in the avcC box, delimiters are not allowed in samples
+            if t == NAL_SPS:
+                if nal not in self.sps_list:
+                    self.sps_list.append(nal)
+                continue
+            if t == NAL_PPS:
+                if nal not in self.pps_list:
+                    self.pps_list.append(nal)
+                continue
+            if t == NAL_AUD:
+                continue
+            if t == NAL_IDR:
+                keyframe = True
+            sample += struct.pack('>I', len(nal))
+            sample += nal
+        if not sample:
+            return
+        self._file.write(sample)
+        self.sample_sizes.append(len(sample))
+        if keyframe:
+            self.sync_samples.append(len(self.sample_sizes))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if not self.sample_sizes:
+                raise H264RemuxError(f'No frames found for {self.output_path}')
+            if not self.sps_list or not self.pps_list:
+                raise H264RemuxError(f'No SPS / PPS found for {self.output_path}')
+            data_end = self._file.tell()
+            self._file.seek(self._mdat_start + 8)
+            self._file.write(struct.pack('>Q', data_end - self._mdat_start))
+            self._file.seek(data_end)
+            self._file.write(self._moov())
+            logging.debug(f'Remuxed {self.frame_count} frames at {self.fps:.2f} FPS into {self.output_path}')
+        finally:
+            self._file.close()
+
+    def _moov(self) -> bytes:
+        sps = SequenceParameterSet(self.sps_list[0])
+        fps = self.fps
+        sample_delta = max(1, int(round(MEDIA_TIMESCALE / fps)))
+        media_duration = sample_delta * self.frame_count
+        movie_duration = int(round(media_duration * MOVIE_TIMESCALE / MEDIA_TIMESCALE))
+
+        mvhd = full_box(b'mvhd', 0, 0,
+                        struct.pack('>IIII', 0, 0, MOVIE_TIMESCALE, movie_duration),
+                        struct.pack('>IH10x', 0x00010000, 0x0100),
+                        UNITY_MATRIX,
+                        bytes(24),
+                        struct.pack('>I', 2))
+        tkhd = full_box(b'tkhd', 0, 0x000003,
+                        struct.pack('>IIIII', 0, 0, 1, 0, movie_duration),
+                        bytes(8),
+                        struct.pack('>hhH2x', 0, 0, 0),
+                        UNITY_MATRIX,
+                        struct.pack('>II', sps.width << 16, sps.height << 16))
+        mdhd = full_box(b'mdhd', 0, 0,
+                        struct.pack('>IIII', 0, 0, MEDIA_TIMESCALE, media_duration),
+                        struct.pack('>HH', 0x55c4, 0)) # language: "und"
+        hdlr = full_box(b'hdlr', 0, 0, struct.pack('>I4s12x', 0, b'vide'), b'VideoHandler\x00')
+        vmhd = full_box(b'vmhd', 0, 1, bytes(8))
+        dinf = box(b'dinf', full_box(b'dref', 0, 0, struct.pack('>I', 1), full_box(b'url ', 0, 1)))
+        stbl = box(b'stbl', self._stsd(sps), *self._sample_tables(sample_delta))
+        minf = box(b'minf', vmhd, dinf, stbl)
+        mdia = box(b'mdia', mdhd, hdlr, minf)
+        trak = box(b'trak', tkhd, mdia)
+        return box(b'moov', mvhd, trak)
+
+    def _avcc(self, sps:SequenceParameterSet) -> bytes:
+        content = bytearray(struct.pack('>BBBBBB', 1, sps.profile_idc, sps.constraint_flags, sps.level_idc,
+                                        0xff, 0xe0 | len(self.sps_list)))
+        for nal in self.sps_list:
+            content += struct.pack('>H', len(nal)) + nal
+        content += struct.pack('>B', len(self.pps_list))
+        for nal in self.pps_list:
+            content += struct.pack('>H', len(nal)) + nal
+        if sps.profile_idc in AVCC_EXTENSION_PROFILES:
+            content += struct.pack('>BBBB', 0xfc | sps.chroma_format_idc, 0xf8 | (sps.bit_depth_luma - 8),
+                                   0xf8 | (sps.bit_depth_chroma - 8), 0)
+        return box(b'avcC', bytes(content))
+
+    def _stsd(self, sps:SequenceParameterSet) -> bytes:
+        avc1 = box(b'avc1',
+                   bytes(6), struct.pack('>H', 1),      # reserved, data_reference_index
+                   bytes(16),                           # pre_defined, reserved
+                   struct.pack('>HH', sps.width, sps.height),
+                   struct.pack('>II', 0x00480000, 0x00480000), # 72 dpi
+                   bytes(4), struct.pack('>H', 1),      # reserved, frame_count
+                   bytes(32),                           # compressorname
+                   struct.pack('>Hh', 0x0018, -1),      # depth, pre_defined
+                   self._avcc(sps))
+        return full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1)
+
+    def _sample_tables(self, sample_delta:int):
+        n = self.frame_count
+        stts = full_box(b'stts', 0, 0, struct.pack('>III', 1, n, sample_delta))
+        stss = full_box(b'stss', 0, 0, struct.pack('>I', len(self.sync_samples)),
+                        struct.pack(f'>{len(self.sync_samples)}I', *self.sync_samples))
+        # all samples are in a single chunk that starts at the beginning of the mdat payload (right after ftyp, so
+        # the 32 bit offset table is always enough)
+        stsc = full_box(b'stsc', 0, 0, struct.pack('>IIII', 1, 1, n, 1))
+        stsz = full_box(b'stsz', 0, 0, struct.pack('>II', 0, n), struct.pack(f'>{n}I', *self.sample_sizes))
+        stco = full_box(b'stco', 0, 0, struct.pack('>II', 1, self._data_start))
+        tables = [stts]
+        # without stss every sample is a sync sample
+        if len(self.sync_samples) < n:
+            tables.append(stss)
+        tables += [stsc, stsz, stco]
+        return tables
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.closed = True
+            self._file.close()
+
+
+def remux_h264(inputs, output_path:str, fps:float=None) -> int:
+    """
+    Remux one or more raw H.264 files (concatenated in order) into an MP4 / MOV file without re-encoding
+    :param inputs: path or list of paths of .h264 files
+    :param output_path: path of the file to write. ".mov" gets a QuickTime brand, anything else is mp4
+    :param fps: frame rate. If None, use the timing info in the stream (or DEFAULT_FPS)
+    :return: number of frames written
+    """
+    if isinstance(inputs, (str, os.PathLike)):
+        inputs = [inputs]
+    with H264Remuxer(str(output_path), fps=fps) as remuxer:
+        for path in inputs:
+            remuxer.add_file(path)
+    return remuxer.frame_count
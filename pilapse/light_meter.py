@@ -1,25 +1,122 @@
 import logging
+import threading
+import time
+from collections import deque
 from math import log2
+from statistics import median
 
 import adafruit_veml7700
 import board
 
+
+class LuxReading:
+    """
+    A smoothed lux value, the raw sensor value it came from and the time.time() it was read
+    """
+    def __init__(self, lux:float, raw:float, timestamp:float):
+        self.lux = lux
+        self.raw = raw
+        self.timestamp = timestamp
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.timestamp
+
+
+class LuxFilter:
+    METHODS = ['ema', 'median', 'none']
+
+    def __init__(self, method:str='ema', alpha:float=0.3, window:int=5):
+        if method not in self.METHODS:
+            raise ValueError(f'Unknown light meter filter "{method}". Must be one of {self.METHODS}')
+        self.method = method
+        self.alpha = alpha
+        self.window = deque(maxlen=window)
+        self.value = None
+
+    def update(self, lux:float) -> float:
+        if self.method == 'ema':
+            self.value = lux if self.value is None else self.alpha * lux + (1 - self.alpha) * self.value
+        elif self.method == 'median':
+            self.window.append(lux)
+            self.value = median(self.window)
+        else:
+            self.value = lux
+        return self.value
+
+
 # https://www.instructables.com/DIY-Photographic-Lightmeter/
 class LightMeter:
-    def __init__(self):
+    """
+    Reading the VEML7700 is a blocking I2C transaction. If sample_rate (readings per second) is given,
+    the sensor is read on a background thread and `lux` / `reading` return the latest smoothed snapshot
+    without touching the sensor. Otherwise every `lux` reads the sensor directly.
+    """
+    def __init__(self, sample_rate:float=None, filter:str='ema', alpha:float=0.3, window:int=5):
         self._sensor = None
         try:
             self._sensor = adafruit_veml7700.VEML7700(board.I2C())
         except Exception as e:
             logging.warning(f'Failed to set up light sensor. Will go on without it.')
             logging.warning(e)
+        self.sample_rate = sample_rate
+        self.filter = LuxFilter(filter, alpha=alpha, window=window)
+        # replaced (never modified) by the sampling thread, so readers always see a complete reading
+        self._reading:LuxReading = None
+        self._stop_event = threading.Event()
+        self._thread:threading.Thread = None
+        if self.available and sample_rate:
+            self.start()
+
+    def read_sensor(self):
+        try:
+            return self._sensor.lux
+        except Exception as e:
+            logging.warning(f'Light sensor read failed: {e}')
+            return None
+
+    def sample_loop(self):
+        interval = 1.0 / self.sample_rate
+        logging.info(f'Light meter sampling every {interval:.2f} seconds ({self.filter.method} filter)')
+        while not self._stop_event.is_set():
+            start = time.time()
+            raw = self.read_sensor()
+            if raw is not None:
+                self._reading = LuxReading(self.filter.update(raw), raw, time.time())
+            self._stop_event.wait(max(0.0, interval - (time.time() - start)))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.sample_loop, name='LightMeter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def sampling(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def reading(self) -> LuxReading:
+        """
+        The latest reading. None until the first sample has been taken
+        """
+        if not self.sampling and self.available:
+            raw = self.read_sensor()
+            return LuxReading(raw, raw, time.time()) if raw is not None else None
+        return self._reading
 
     @property
     def lux(self):
-        lux = self._sensor.lux if self._sensor is not None else None
-        return lux
+        reading = self.reading
+        return reading.lux if reading is not None else None
 
     @property
     def available(self):
         return self._sensor is not None
-
@@ -0,0 +1,108 @@
+import csv
+import io
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import date, datetime
+
+
+class BufferedLogWriter(object):
+    """
+    Append records to a log file from a background thread.
+    Records are batched in memory and written when `max_records` are waiting or the oldest has waited
+    `max_delay` seconds, so callers never block on the SD card.
+    Records are dicts (written one JSON object per line) or sequences (written as CSV rows).
+    The log rotates daily: records from days after the first go to "<name>-YYYYmmdd<ext>".
+    """
+    FORMATS = ['jsonl', 'csv']
+    _STOP = object()
+
+    def __init__(self, path:str, format:str='jsonl', max_records:int=100, max_delay:float=5.0,
+                 rotate:bool=True, name:str='LogWriter'):
+        if format not in self.FORMATS:
+            raise ValueError(f'Unknown log format "{format}". Must be one of {self.FORMATS}')
+        if '%' in path:
+            path = datetime.strftime(datetime.now(), path)
+        self.path = path
+        self.format = format
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self.rotate = rotate
+        self.first_day:date = date.today()
+        self.records_written = 0
+        self.flushes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self.write_loop, name=name, daemon=True)
+        self._thread.start()
+
+    def path_for_day(self, day:date) -> str:
+        if not self.rotate or day == self.first_day:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        return f'{stem}-{day.strftime("%Y%m%d")}{ext}'
+
+    def write(self, record):
+        """
+        Queue a record. Never blocks
+        """
+        self._queue.put((date.today(), record))
+
+    def format_records(self, records) -> str:
+        if self.format == 'jsonl':
+            return ''.join(json.dumps(record, default=str) + '\n' for record in records)
+        out = io.StringIO()
+        csv.writer(out, lineterminator='\n').writerows(records)
+        return out.getvalue()
+
+    def flush_batch(self, batch):
+        by_path = {}
+        for day, record in batch:
+            by_path.setdefault(self.path_for_day(day), []).append(record)
+        for path, records in by_path.items():
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, 'a') as logfile:
+                    logfile.write(self.format_records(records))
+            except Exception as e:
+                logging.error(f'Failed to write {len(records)} records to {path}: {e}')
+                continue
+            self.records_written += len(records)
+        self.flushes += 1
+
+    def write_loop(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                # drain whatever was queued before close()
+                while not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                if batch:
+                    self.flush_batch(batch)
+                break
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.time() + self.max_delay
+            if batch and (len(batch) >= self.max_records or time.time() >= deadline):
+                self.flush_batch(batch)
+                batch = []
+                deadline = None
+
+    def close(self):
+        """
+        Write everything that is queued and stop the writer thread
+        """
+        self._queue.put(self._STOP)
+        self._thread.join()
+        logging.info(f'{self._thread.name}: wrote {self.records_written} records in {self.flushes} writes')
@@ -0,0 +1,100 @@
+import logging
+import os
+import tempfile
+
+import cv2
+import numpy
+
+
+class MasterDarkBuilder(object):
+    """
+    Combine many dark exposures into a master dark without holding them all in memory.
+    Frames are streamed into a memory mapped stack on disk, then combined a band of rows at a time,
+    with the band height chosen so the working set stays under max_memory_mb.
+    """
+    METHODS = ['median', 'sigma-clip']
+
+    def __init__(self, method:str='median', sigma:float=3.0, iterations:int=3,
+                 max_memory_mb:int=256, work_dir:str=None):
+        if method not in self.METHODS:
+            raise ValueError(f'Unknown method "{method}". Must be one of {self.METHODS}')
+        self.method = method
+        self.sigma = sigma
+        self.iterations = iterations
+        self.max_memory_mb = max_memory_mb
+        self.work_dir = work_dir
+        self.nframes = 0
+
+    def stack_frames(self, paths, stack_path):
+        stack = None
+        self.nframes = 0
+        for path in paths:
+            image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+            if image is None:
+                logging.warning(f'Could not load {path}, skipping')
+                continue
+            if stack is None:
+                stack = numpy.lib.format.open_memmap(stack_path, mode='w+', dtype=image.dtype,
+                                                     shape=(len(paths),) + image.shape)
+            elif image.shape != stack.shape[1:] or image.dtype != stack.dtype:
+                logging.warning(f'{path} is {image.shape} {image.dtype}, expected {stack.shape[1:]} {stack.dtype}. '
+                                f'Skipping')
+                continue
+            stack[self.nframes] = image
+            self.nframes += 1
+        if stack is None:
+            raise Exception('No dark frames could be loaded')
+        stack.flush()
+        logging.info(f'Stacked {self.nframes} dark frames of {stack.shape[1:]}')
+        return stack[:self.nframes]
+
+    def rows_per_band(self, stack) -> int:
+        nframes, height = stack.shape[:2]
+        row_bytes = nframes * stack[0, 0].size
+        # the median works on a float64 copy, sigma clipping holds a few float32 arrays and masks
+        bytes_per_value = 8 if self.method == 'median' else 16
+        rows = int(self.max_memory_mb * 1024 * 1024 // (row_bytes * bytes_per_value))
+        return max(1, min(height, rows))
+
+    def combine_band(self, band):
+        if self.method == 'median':
+            return numpy.median(band, axis=0)
+        data = band.astype(numpy.float32)
+        keep = numpy.ones(data.shape, dtype=bool)
+        for _ in range(self.iterations):
+            clipped = numpy.where(keep, data, numpy.nan)
+            center = numpy.nanmedian(clipped, axis=0)
+            spread = numpy.nanstd(clipped, axis=0)
+            new_keep = numpy.abs(data - center) <= self.sigma * spread
+            # a pixel that is identical in every frame has no spread; keep all of its values
+            new_keep |= spread == 0
+            if (new_keep == keep).all():
+                break
+            keep = new_keep
+        count = keep.sum(axis=0)
+        total = numpy.where(keep, data, 0).sum(axis=0)
+        return numpy.where(count > 0, total / numpy.maximum(count, 1), numpy.median(data, axis=0))
+
+    def build(self, paths):
+        """
+        Returns the master dark, with the same shape and dtype as the input frames
+        """
+        paths = list(paths)
+        fd, stack_path = tempfile.mkstemp(suffix='.npy', prefix='darkstack_', dir=self.work_dir)
+        os.close(fd)
+        try:
+            stack = self.stack_frames(paths, stack_path)
+            height = stack.shape[1]
+            rows = self.rows_per_band(stack)
+            logging.info(f'Combining with {self.method} in bands of {rows} rows')
+            master = numpy.empty(stack.shape[1:], dtype=stack.dtype)
+            limits = numpy.iinfo(stack.dtype) if numpy.issubdtype(stack.dtype, numpy.integer) else None
+            for row in range(0, height, rows):
+                band = self.combine_band(stack[:, row:row + rows])
+                if limits is not None:
+                    band = numpy.clip(numpy.rint(band), limits.min, limits.max)
+                master[row:row + rows] = band
+            del stack
+            return master
+        finally:
+            os.remove(stack_path)
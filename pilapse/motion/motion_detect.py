@@ -19,6 +19,9 @@ class MotionData:
         self._gray_image:FileImage = None
         self._dilated_image:FileImage = None
         self._threshold_image:FileImage = None
+        self._motion_boxes:list = []
+        self._rejected_boxes:list = []
+        self.detection_area = None
 
     @property
     def motion_detected(self):
@@ -73,6 +76,21 @@ class MotionData:
     def motion_image(self):
         return self._motion_image
 
+    @property
+    def motion_boxes(self):
+        """
+        (x, y, w, h) of each contour that met the motion criteria, in image coordinates
+        """
+        return self._motion_boxes
+
+    @property
+    def rejected_boxes(self):
+        """
+        (x, y, w, h, reason) of each contour that did not count as motion. reason is "outside" (of the
+        detection area) or "size"
+        """
+        return self._rejected_boxes
+
 class MotionDetector:
     def __init__(self,
                  outdir:str,
@@ -203,6 +221,7 @@ class MotionDetector:
 
         height, width, _ = new_image.shape
         copy = get_copy(image_in)
+        motion_data.detection_area = (sLeft, sTop, sRight, sBottom)
         if self.debug:
             cv2.rectangle(image_in, (sLeft, sTop), (sRight, sBottom), colors.RED)
         for c in cnts:
@@ -214,21 +233,25 @@ class MotionDetector:
             sh = int(scale * h)
             # print(f'({sx}, {sy}) ({sw} x {sh}) R:{sRight}, L:{sLeft}, T:{sTop}, B:{sBottom}')
             if x + w > sRight and self.right < 1.0:
+                motion_data.rejected_boxes.append((sx, sy, sw, sh, 'outside'))
                 if self.debug:
                     copy = get_copy(copy)
                     cv2.rectangle(copy, (sx, sy), (sx + sw, sy + sh), colors.CYAN)
                 continue
             if x < sLeft:
+                motion_data.rejected_boxes.append((sx, sy, sw, sh, 'outside'))
                 if self.debug:
                     copy = get_copy(copy)
                     cv2.rectangle(copy, (sx, sy), (sx + sw, sy + sh), colors.CYAN)
                 continue
             if y < sTop:
+                motion_data.rejected_boxes.append((sx, sy, sw, sh, 'outside'))
                 if self.debug:
                     copy = get_copy(copy)
                     cv2.rectangle(copy, (sx, sy), (sx + sw, sy + sh), colors.CYAN)
                 continue
             if self.right < 1.0 and y + h > sBottom:
+                motion_data.rejected_boxes.append((sx, sy, sw, sh, 'outside'))
                 if self.debug:
                     copy = get_copy(copy)
                     cv2.rectangle(copy, (sx, sy), (sx + sw, sy + sh), colors.CYAN)
@@ -238,7 +261,9 @@ class MotionDetector:
                 if self.debug or self.show_motion:
                     cv2.rectangle(copy, (sx, sy), (sx + sw, sy + sh), colors.GREEN)
                 motion_data.motion_detected = True
+                motion_data.motion_boxes.append((sx, sy, sw, sh))
             else:
+                motion_data.rejected_boxes.append((sx, sy, sw, sh, 'size'))
                 if self.debug:
                     # print(f'w: {w} h: {h} mindiff: {sMindiff} width: {width} height: {height}')
                     copy = get_copy(copy)
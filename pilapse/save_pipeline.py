@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SavePipeline(object):
+    """
+    Encode and write frames on a pool of worker threads so the capture loop can give the camera its
+    buffers back straight away.
+
+    Each frame is written to "<path>.tmp" by its save job and renamed into place in the order the frames
+    were submitted, so the frame directory only ever grows in filename order even when a later frame
+    finishes encoding first. on_saved(context, error) is called in the same order once the frame is in place
+    (error is None on success).
+
+    At most max_pending frames can be waiting or in progress. When they are all taken, reserve() returns
+    False and the frame is counted as dropped.
+    """
+    def __init__(self, workers:int=2, max_pending:int=4, on_saved=None, name:str='Saver'):
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.on_saved = on_saved
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.lock = threading.Condition()
+        self.pending = 0
+        self.next_sequence = 0
+        self.next_to_finish = 0
+        self.finished = {}
+        self.saved = 0
+        self.failed = 0
+        self.dropped = 0
+        # the most frames that were ever waiting at once
+        self.high_water = 0
+
+    def reserve(self) -> bool:
+        """
+        Claim a place for the next frame before copying it out of the camera buffer.
+        Every successful reserve() must be followed by submit() or cancel()
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self.pending += 1
+            self.high_water = max(self.high_water, self.pending)
+            return True
+
+    def cancel(self):
+        with self.lock:
+            self.pending -= 1
+            self.lock.notify_all()
+
+    def submit(self, path:str, save, context=None):
+        """
+        save(tmp_path) writes the frame
+        """
+        with self.lock:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+        self.executor.submit(self.run, sequence, path, save, context)
+
+    def run(self, sequence:int, path:str, save, context):
+        tmp_path = path + '.tmp'
+        error = None
+        try:
+            save(tmp_path)
+        except Exception as e:
+            logging.exception(f'Failed to save {path}')
+            error = e
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self.lock:
+            self.finished[sequence] = (path, tmp_path, context, error)
+            # whoever finishes the oldest frame puts it, and any later ones that are already done, in place
+            while self.next_to_finish in self.finished:
+                self.finish(*self.finished.pop(self.next_to_finish))
+                self.next_to_finish += 1
+                self.pending -= 1
+            self.lock.notify_all()
+
+    def finish(self, path:str, tmp_path:str, context, error):
+        if error is None:
+            try:
+                os.replace(tmp_path, path)
+                self.saved += 1
+            except OSError as e:
+                logging.error(f'Failed to move {tmp_path} to {path}: {e}')
+                error = e
+        if error is not None:
+            self.failed += 1
+        if self.on_saved is not None:
+            try:
+                self.on_saved(context, error)
+            except Exception:
+                logging.exception(f'on_saved failed for {path}')
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.pending,
+                'high_water': self.high_water,
+                'saved': self.saved,
+                'failed': self.failed,
+                'dropped': self.dropped,
+            }
+
+    def close(self):
+        """
+        Wait for the frames that are still being saved
+        """
+        with self.lock:
+            self.lock.wait_for(lambda: self.pending == 0)
+        self.executor.shutdown(wait=True)
+        logging.info(f'Save pipeline: {self.stats()}')
@@ -1,7 +1,7 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone, tzinfo
 from datetime import date
-import requests
+import numpy as np
 
 def parse_time(time_str, day:datetime):
     logging.info(f'parse time: {time_str}')
@@ -30,8 +30,115 @@ class BadTimeString(Exception):
     def __init__(self, timestring):
         super().__init__(f"Bad suntime value: {timestring}. See Suntime.valid_times()")
 
+# Elevation of the center of the sun (degrees) at each suntime. Sunrise and sunset allow for refraction and
+# the radius of the sun.
+SUN_ELEVATIONS = {
+    'first_light': -18.0,
+    'dawn': -6.0,
+    'sunrise': -0.833,
+    'golden_hour': 6.0,
+    'sunset': -0.833,
+    'dusk': -6.0,
+    'last_light': -18.0,
+}
+MORNING_TIMES = ('first_light', 'dawn', 'sunrise')
+
+UNIX_EPOCH_JULIAN_DAY = 2440587.5
+
+def solar_position(julian_day):
+    """
+    NOAA solar calculator. Returns the equation of time (minutes) and the declination of the sun (radians).
+    Works on scalars or numpy arrays.
+    """
+    jc = (julian_day - 2451545.0) / 36525.0
+    mean_long = np.radians((280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360)
+    mean_anom = np.radians(357.52911 + jc * (35999.05029 - 0.0001537 * jc))
+    eccent = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    center = np.sin(mean_anom) * (1.914602 - jc * (0.004817 + 0.000014 * jc)) + \
+             np.sin(2 * mean_anom) * (0.019993 - 0.000101 * jc) + \
+             np.sin(3 * mean_anom) * 0.000289
+    omega = np.radians(125.04 - 1934.136 * jc)
+    apparent_long = np.radians(np.degrees(mean_long) + center - 0.00569 - 0.00478 * np.sin(omega))
+    mean_obliq = 23 + (26 + ((21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813)))) / 60) / 60
+    obliq = np.radians(mean_obliq + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliq) * np.sin(apparent_long))
+    y = np.tan(obliq / 2) ** 2
+    eq_time = 4 * np.degrees(y * np.sin(2 * mean_long)
+                             - 2 * eccent * np.sin(mean_anom)
+                             + 4 * eccent * y * np.sin(mean_anom) * np.cos(2 * mean_long)
+                             - 0.5 * y * y * np.sin(4 * mean_long)
+                             - 1.25 * eccent * eccent * np.sin(2 * mean_anom))
+    return eq_time, declination
+
+def solar_event_times(latitude:float, longitude:float, days) -> dict:
+    """
+    Compute the suntimes for an array of days (numpy datetime64[D]).
+    Returns a dict of suntime name -> numpy array of UTC POSIX timestamps.
+    If the sun never gets down (or up) to the elevation of a suntime, it is placed at solar midnight (or noon).
+    """
+    day0 = np.asarray(days, dtype='datetime64[D]').astype(np.float64) + UNIX_EPOCH_JULIAN_DAY
+    lat = np.radians(latitude)
+
+    # solar noon, refined once with the sun's position at the first estimate
+    noon = day0 + 0.5 - longitude / 360.0
+    for _ in range(2):
+        eq_time, _ = solar_position(noon)
+        noon = day0 + (720 - 4 * longitude - eq_time) / 1440.0
+
+    def hour_angle(julian_day, elevation):
+        _, declination = solar_position(julian_day)
+        cos_ha = (np.sin(np.radians(elevation)) - np.sin(lat) * np.sin(declination)) / \
+                 (np.cos(lat) * np.cos(declination))
+        return np.degrees(np.arccos(np.clip(cos_ha, -1.0, 1.0)))
+
+    events = {'solar_noon': noon}
+    for name, elevation in SUN_ELEVATIONS.items():
+        sign = -1 if name in MORNING_TIMES else 1
+        event = noon + sign * hour_angle(noon, elevation) * 4 / 1440.0
+        # recompute with the sun's position at the time of the event
+        event = noon + sign * hour_angle(event, elevation) * 4 / 1440.0
+        events[name] = event
+    return {name: (jd - UNIX_EPOCH_JULIAN_DAY) * 86400.0 for name, jd in events.items()}
+
+
+class SuntimeTable:
+    """
+    Suntimes for every day of a year (plus the days either side), computed in one vectorized pass and cached
+    """
+    _cache = {}
+
+    def __init__(self, location, year:int):
+        self.location = location
+        self.year = year
+        self.first_day = np.datetime64(f'{year - 1}-12-31', 'D')
+        days = np.arange(self.first_day, np.datetime64(f'{year + 1}-01-02', 'D'))
+        self.events = solar_event_times(location[0], location[1], days)
+
+    @classmethod
+    def for_year(cls, location, year:int):
+        key = (tuple(location), year)
+        if key not in cls._cache:
+            cls._cache[key] = SuntimeTable(location, year)
+        return cls._cache[key]
+
+    def timestamps(self, day:date) -> dict:
+        """
+        UTC POSIX timestamps of the suntimes for day, plus y_last_light and t_first_light
+        """
+        i = int((np.datetime64(day, 'D') - self.first_day).astype(int))
+        result = {name: float(values[i]) for name, values in self.events.items()}
+        result['y_last_light'] = float(self.events['last_light'][i - 1])
+        result['t_first_light'] = float(self.events['first_light'][i + 1])
+        return result
+
+
 class Suntime:
-    def __init__(self, location, date='today'):
+    def __init__(self, location, date='today', tz=None):
+        """
+        :param location: (latitude, longitude) or "latitude,longitude"
+        :param date: 'today', 'YYYY-MM-DD' or a date
+        :param tz: timezone for the returned (naive) datetimes: a tzinfo, a zone name, or None for the system time zone
+        """
         self.location = None
         if isinstance(location, str):
             if not ',' in location:
@@ -41,6 +148,10 @@ class Suntime:
         else:
             self.location = location
         self.date = date
+        if isinstance(tz, str):
+            from zoneinfo import ZoneInfo
+            tz = ZoneInfo(tz)
+        self.tz:tzinfo = tz
         self.data = self.get_suntime_info()
 
     def _get_value(self, valuename):
@@ -137,12 +248,13 @@ class Suntime:
 
         return 'last_light'
 
-    def get_part_of_day_percent(self):
+    def get_part_of_day_percent(self, now:datetime=None):
         '''
         return the two "suntimes" we are between and the percent
         :return:
         '''
-        now = datetime.now()
+        if now is None:
+            now = datetime.now()
         pod = self.get_part_of_day(now)
 
         if pod == 'y_last_light':
@@ -180,44 +292,55 @@ class Suntime:
         p = self.map_time(now, self.last_light, self.t_first_light)
         return ('last_light', 't_first_light', p)
 
+    @property
+    def day(self) -> date:
+        if isinstance(self.date, datetime):
+            return self.date.date()
+        if isinstance(self.date, date):
+            return self.date
+        if self.date == 'today':
+            return date.today()
+        return datetime.strptime(self.date, '%Y-%m-%d').date()
+
+    def to_local(self, timestamp:float) -> datetime:
+        if self.tz is None:
+            return datetime.fromtimestamp(timestamp)
+        return datetime.fromtimestamp(timestamp, self.tz).replace(tzinfo=None)
+
     def get_suntime_info(self) -> dict:
-        latitude, longitude = self.location
-        url = f'https://api.sunrisesunset.io/json?lat={latitude}&lng={longitude}&date={self.date}'
-        logging.debug(f'suntime url: {url}')
-        response = requests.get(url)
-        if response.ok:
-            data = response.json()
-            logging.info(f'data: {data}')
-            if 'results' in data:
-                d = data['results']
-                d['today'] = datetime.strptime(self.date, '%Y-%m-%d')
-                oneday = timedelta(days=1)
-                d['tomorrow'] = date.today() + oneday
-                d['yesterday'] = date.today() - oneday
-                logging.info(f'{"yesterday":>12}: {d["yesterday"]}')
-                logging.info(f'{"today":>12}: {d["today"]}')
-                logging.info(f'{"tomorrow":>12}: {d["tomorrow"]}')
-                for field in (
-                        'first_light',
-                        'dawn',
-                        'sunrise',
-                        'solar_noon',
-                        'golden_hour',
-                        'sunset',
-                        'dusk',
-                        'last_light',
-                ):
-                    d[field] = parse_time(d[field], d['today'])
-                    logging.info(f'{field:>12}: {d[field]}')
-
-                d['y_last_light'] = d['last_light'] - oneday
-                logging.info(f'{"last yesterday":>12}: {d["y_last_light"]} (approx)')
-                d['t_first_light'] = d['first_light'] + oneday
-                logging.info(f'{"tomorrow_first":>12}: {d["t_first_light"]} (approx)')
-
-                return d
-            else:
-                return data
-        else:
-            logging.info(f'Error getting sun time info: {response}')
-            return None
\ No newline at end of file
+        day = self.day
+        timestamps = SuntimeTable.for_year(self.location, day.year).timestamps(day)
+        d = {}
+        d['today'] = datetime(day.year, day.month, day.day)
+        oneday = timedelta(days=1)
+        d['tomorrow'] = day + oneday
+        d['yesterday'] = day - oneday
+        logging.info(f'{"yesterday":>12}: {d["yesterday"]}')
+        logging.info(f'{"today":>12}: {d["today"]}')
+        logging.info(f'{"tomorrow":>12}: {d["tomorrow"]}')
+        for field in (
+                'first_light',
+                'dawn',
+                'sunrise',
+                'solar_noon',
+                'golden_hour',
+                'sunset',
+                'dusk',
+                'last_light',
+        ):
+            d[field] = self.to_local(timestamps[field])
+            logging.info(f'{field:>12}: {d[field]}')
+
+        d['y_last_light'] = self.to_local(timestamps['y_last_light'])
+        logging.info(f'{"last yesterday":>12}: {d["y_last_light"]}')
+        d['t_first_light'] = self.to_local(timestamps['t_first_light'])
+        logging.info(f'{"tomorrow_first":>12}: {d["t_first_light"]}')
+
+        day_length = int(timestamps['sunset'] - timestamps['sunrise'])
+        d['day_length'] = f'{day_length // 3600}:{day_length % 3600 // 60:02}:{day_length % 60:02}'
+        local_noon = datetime.fromtimestamp(timestamps['solar_noon'], self.tz or timezone.utc)
+        if self.tz is None:
+            local_noon = local_noon.astimezone()
+        d['timezone'] = local_noon.tzname()
+        d['utc_offset'] = int(local_noon.utcoffset().total_seconds() // 60)
+        return d
@@ -17,6 +17,7 @@ import watchdog.events
 import watchdog.observers
 import cv2
 import imutils
+import numpy as np
 
 import pilapse
 import pilapse as pl
@@ -393,6 +394,9 @@ class ImageConsumer(PilapseThread):
         self.in_queue:Queue = kwargs.get('in_queue')
         if self.in_queue is None:
            raise Exception(f'Creating Consumer thread {self.name} with no in queue')
+        # the thread that fills in_queue if it is another consumer (e.g. a CompositeWriter passing frames on).
+        # We keep going until it has finished, so frames it passes on during shutdown are not lost
+        self.upstream:threading.Thread = kwargs.get('upstream')
         self._shutdown_event:threading.Event = shutdown_event
         # self.nframes:int = 0
         self.keepers:int = 0
@@ -453,6 +457,10 @@ class ImageConsumer(PilapseThread):
 
     def check_for_shutdown(self):
         if self._shutdown_event.is_set():
+            if self.upstream is not None and self.upstream.is_alive():
+                logging.debug(f'Waiting for {self.upstream.name} to finish')
+                self.force_consume = True
+                return False
             logging.warning(f'shutdown event is set')
             if self.in_queue.empty():
                 logging.info('Queue is empty. Shutting down')
@@ -566,6 +574,121 @@ class ImageWriter(ImageConsumer):
         logging.debug(f'## writing {path}')
         cv2.imwrite(path, image.image)
 
+class CompositeWriter(ImageConsumer):
+    """
+    Builds a lighten (per-pixel maximum) composite of every frame as it arrives, for star trails, and
+    optionally a mean composite. The running composites live in arrays allocated from the first frame and
+    are written to disk every --composite-checkpoint seconds and when the thread stops, so the finished
+    composite is there as soon as the night is over.
+    If out_queue is given, frames are passed on (e.g. to an ImageWriter) after they have been added.
+    """
+    ARGS_ADDED = False
+    @classmethod
+    def add_arguments_to_parser(cls, parser:argparse.ArgumentParser, argument_group_name:str='Composite Settings')->argparse.ArgumentParser:
+        logging.info(f'Adding {cls.__name__} args to parser (ADDED:{cls.ARGS_ADDED})')
+        if cls.ARGS_ADDED:
+            return parser
+        composite = parser.add_argument_group(argument_group_name, 'Parameters related to composite images')
+        cls.add_arguments_to_group(composite)
+        cls.ARGS_ADDED = True
+        return parser
+
+    @classmethod
+    def add_arguments_to_group(cls, group:argparse.ArgumentParser):
+        group.add_argument('--composite', action='store_true',
+                           help='Build a lighten (maximum) composite of all frames, e.g. for star trails')
+        group.add_argument('--composite-mean', action='store_true',
+                           help='Also build a mean composite of all frames. Has no effect without --composite')
+        group.add_argument('--composite-dir', type=str,
+                           help='Directory where composites are written. Default: the frame directory '
+                                'when the first frame arrives')
+        group.add_argument('--composite-checkpoint', type=float, default=300.0,
+                           help='Write the composites every this many seconds. Default: 300')
+        group.add_argument('--composite-format', type=str, choices=['jpg', 'png'], default='jpg',
+                           help='File format of the composites. Default: jpg')
+
+    def __init__(self, shutdown_event:threading.Event, config:argparse.Namespace, **kwargs):
+        super(CompositeWriter, self).__init__('CompositeWriter', shutdown_event, config, **kwargs)
+        self.out_queue:Queue = kwargs.get('out_queue')
+        self.maximum = None
+        self.total = None
+        self.count:int = 0
+        self.skipped:int = 0
+        self.first_timestamp:datetime = None
+        self.last_timestamp:datetime = None
+        self.composite_dir:str = self.config.composite_dir
+        self.checkpoint_wait:timedelta = timedelta(seconds=self.config.composite_checkpoint)
+        self.checkpoint_time:datetime = None
+        self.checkpoint_count:int = 0
+
+    def composite_path(self, kind:str) -> str:
+        timestamp = self.first_timestamp.strftime(Image.timestamp_pattern)
+        return os.path.join(self.composite_dir, f'{timestamp}_composite_{kind}.{self.config.composite_format}')
+
+    def add_image(self, image:Image):
+        frame = image.image
+        if frame is None:
+            logging.warning(f'No image data in {image.filename}, not added to composite')
+            self.skipped += 1
+            return
+        if self.maximum is None:
+            self.maximum = frame.copy()
+            if self.config.composite_mean:
+                self.total = np.zeros(frame.shape, dtype=np.float32)
+            self.first_timestamp = image.timestamp
+            if self.composite_dir is None:
+                self.composite_dir = self.outdir
+            os.makedirs(self.composite_dir, exist_ok=True)
+            self.checkpoint_time = self.now + self.checkpoint_wait
+            logging.info(f'Composite of {frame.shape[1]}x{frame.shape[0]} frames: {self.composite_path("max")}')
+        elif frame.shape != self.maximum.shape:
+            logging.warning(f'{image.filename} is {frame.shape[1]}x{frame.shape[0]}, composite is '
+                            f'{self.maximum.shape[1]}x{self.maximum.shape[0]}. Not added to composite')
+            self.skipped += 1
+            return
+        else:
+            cv2.max(self.maximum, frame, dst=self.maximum)
+        if self.total is not None:
+            cv2.accumulate(frame, self.total)
+        self.count += 1
+        self.last_timestamp = image.timestamp
+
+    def write_composite(self, path:str, image):
+        ok, data = cv2.imencode(f'.{self.config.composite_format}', image)
+        if not ok:
+            logging.error(f'Could not encode {path}')
+            return
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data.tobytes())
+        os.replace(tmp_path, path)
+
+    def checkpoint(self):
+        if self.maximum is None:
+            return
+        start = datetime.now()
+        self.write_composite(self.composite_path('max'), self.maximum)
+        if self.total is not None:
+            self.write_composite(self.composite_path('mean'), cv2.convertScaleAbs(self.total, alpha=1.0 / self.count))
+        self.checkpoint_count += 1
+        self.checkpoint_time = self.now + self.checkpoint_wait
+        elapsed = (datetime.now() - start).total_seconds()
+        logging.info(f'Composite checkpoint: {self.count} frames ({self.first_timestamp.strftime("%H:%M:%S")} - '
+                     f'{self.last_timestamp.strftime("%H:%M:%S")}), skipped {self.skipped}, {elapsed:.2f} seconds')
+
+    def consume_image(self, image):
+        self.add_image(image)
+        if self.out_queue is not None:
+            self.out_queue.put(image)
+        if self.checkpoint_time is not None and self.now >= self.checkpoint_time:
+            self.checkpoint()
+
+    def do_work(self) -> None:
+        super(CompositeWriter, self).do_work()
+        logging.info(f'Writing final composite')
+        self.now = datetime.now()
+        self.checkpoint()
+
 class ImagePipeline(ImageProducer, ImageConsumer):
     def __init__(self, name:str, shutdown_event:threading.Event, config:argparse.Namespace,
                  **kwargs):
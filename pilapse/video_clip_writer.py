@@ -5,8 +5,7 @@ import threading
 import time
 from datetime import datetime
 
-import cv2
-
+from pilapse.h264_remux import H264Remuxer, H264RemuxError
 from pilapse.threads import ImageConsumer
 from pilapse.video_clip import VideoClip
 
@@ -67,55 +66,33 @@ class MotionVideoProcessor(ImageConsumer):
         # TODO move this to one or more separate worker threads
         new_path = os.path.splitext(clip.filename)[0] + '.mov'
         self.currently_processing_video = True
-        file_number = 0
-        filename = clip._filelist[file_number]
-        video_in = cv2.VideoCapture(filename)
-        frame_width = int(video_in.get(cv2.CAP_PROP_FRAME_WIDTH))
-        frame_height = int(video_in.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(video_in.get(cv2.CAP_PROP_FPS)) if clip.framerate is None else int(clip.framerate)
-        logging.info(f'Assembling {os.path.basename(filename)} (FPS: {fps})')
+        # the raw clips are remuxed into the container as-is (no decode / re-encode). If the clip framerate is not
+        # known, the remuxer uses the timing info in the stream.
+        fps = float(clip.framerate) if clip.framerate is not None else None
+        logging.info(f'Assembling {os.path.basename(clip.filename)} (FPS: {fps})')
         logging.info(f' start: {clip.start_time.strftime("%Y%m%d_%H%M%S.%f")} end: {clip.end_time.strftime("%Y%m%d_%H%M%S.%f")}')
         logging.info(f' motion: {clip.first_motion.strftime("%Y%m%d_%H%M%S.%f")} - {clip.last_motion.strftime("%Y%m%d_%H%M%S.%f")}')
         for file in clip._filelist:
             logging.info(f' - {os.path.basename(file)}')
 
-        capSize = (frame_width, frame_height) # this is the size of my source video
-        fourcc = cv2.VideoWriter_fourcc('m', 'p', '4', 'v') # note the lower case
-        video_out = cv2.VideoWriter()
-        success = video_out.open(new_path, fourcc, fps, capSize)
-        if not success:
-            logging.error(f'Failed to open file for converted video: {new_path}')
-            return
-        frame_count = 0
-
-        while True:
-            success, frame = video_in.read()
-            if not success:
-                # assume we hit the end of the video clip we are converting
-                file_number += 1
-                if file_number < len(clip._filelist):
-                    os.remove(filename)
-                    video_in.release()
-                    video_in = None
-                    filename = clip._filelist[file_number]
-                    logging.info(f'Appending clip: {filename} (at {frame_count} frames)')
-                    video_in = cv2.VideoCapture(filename)
-                    success, frame = video_in.read()
-                    if not success:
-                        logging.error('Could not read first frame from next clip')
-                        break
-                else:
-                    break
-            frame_count += 1
-            if frame_count % 10 == 0:
-                self.log_status()
-            video_out.write(frame)
+        try:
+            with H264Remuxer(new_path, fps=fps) as remuxer:
+                for filename in clip._filelist:
+                    logging.info(f'Appending clip: {os.path.basename(filename)} (at {remuxer.frame_count} frames)')
+                    remuxer.add_file(filename)
+                    self.log_status()
+        except (H264RemuxError, OSError) as e:
+            logging.error(f'Failed to convert video {new_path}: {e}')
+            if os.path.exists(new_path):
+                os.remove(new_path)
+            self.currently_processing_video = False
+            return None
 
-        os.remove(filename)
-        # delete the incoming clip
-        video_in.release()
-        video_out.release()
-        logging.info(f'Converted {frame_count} frames, {frame_count/fps:.2f} seconds')
+        # delete the incoming clips
+        for filename in clip._filelist:
+            os.remove(filename)
+        frame_count = remuxer.frame_count
+        logging.info(f'Converted {frame_count} frames, {frame_count/remuxer.fps:.2f} seconds')
         self.converted_clips += 1
         self.currently_processing_video = False
         return new_path
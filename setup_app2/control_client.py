@@ -0,0 +1,65 @@
+import itertools
+import json
+import logging
+import socket
+import time
+
+
+class ControlError(Exception):
+    pass
+
+
+class ControlUnavailable(ControlError):
+    """
+    The timelapse is not listening on its control socket. Use the file + signal fallback
+    """
+    pass
+
+
+class ControlClient(object):
+    """
+    Client for the timelapse control socket (see pilapse/control_server.py).
+    One JSON request per line, one JSON response per line.
+    """
+    def __init__(self, socket_path:str, timeout:float=120.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.ids = itertools.count(1)
+
+    def request(self, command:str, **args) -> dict:
+        """
+        Send a command and wait for its result. The round trip time is added to the result as "round_trip"
+        """
+        start = time.time()
+        message = {'id': next(self.ids), 'command': command, 'args': args}
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(self.timeout)
+                s.connect(self.socket_path)
+                with s.makefile('rwb') as stream:
+                    stream.write(json.dumps(message).encode('utf-8') + b'\n')
+                    stream.flush()
+                    line = stream.readline()
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ControlUnavailable(f'{self.socket_path}: {e}')
+        except OSError as e:
+            raise ControlError(f'{command} failed: {e}')
+        if not line:
+            raise ControlError(f'{command}: no response')
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise ControlError(f'{command} failed: {response.get("error")}')
+        result = response['result']
+        result['round_trip'] = time.time() - start
+        logging.info(f'{command}: {result["round_trip"]:.3f} seconds '
+                     f'({response.get("elapsed", 0):.3f} in the timelapse)')
+        return result
+
+    def set_controls(self, controls:dict, capture:bool=True) -> dict:
+        return self.request('set_controls', capture=capture, **controls)
+
+    def single_shot(self) -> dict:
+        return self.request('single_shot')
+
+    def status(self) -> dict:
+        return self.request('status')
@@ -0,0 +1,154 @@
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+
+
+class CachedFile(object):
+    def __init__(self, path:str, stat:os.stat_result, data:bytes=None):
+        self.path = path
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        self.data = data
+
+    def is_current(self, stat:os.stat_result) -> bool:
+        return stat.st_mtime_ns == self.mtime_ns and stat.st_size == self.size
+
+
+class FileServerMixin(object):
+    """
+    File serving for BaseHTTPRequestHandler subclasses.
+    Supports conditional GET (ETag / Last-Modified -> 304) and single byte ranges (206 / 416).
+    Files are sent with socket.sendfile (os.sendfile where available) instead of being read into memory,
+    except small static assets served with cache=True, which are kept in memory until they change on disk.
+    """
+    STATIC_CACHE = {}
+    STATIC_CACHE_LOCK = threading.Lock()
+    # only keep files up to this size in the static cache
+    STATIC_CACHE_MAX_FILE = 256 * 1024
+    RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+    @classmethod
+    def safe_path(cls, root:str, url_path:str):
+        """
+        Map a url path onto a file under root. Returns None for paths that try to leave root
+        """
+        url_path = url_path.split('?', 1)[0].split('#', 1)[0]
+        parts = [p for p in url_path.split('/') if p not in ('', '.')]
+        if '..' in parts:
+            return None
+        return os.path.join(root, *parts)
+
+    def cached_file(self, path:str, stat:os.stat_result) -> CachedFile:
+        with FileServerMixin.STATIC_CACHE_LOCK:
+            cached = FileServerMixin.STATIC_CACHE.get(path)
+            if cached is not None and cached.is_current(stat):
+                return cached
+        with open(path, 'rb') as f:
+            # stat the open file so the validators match the data even if the file just changed
+            cached = CachedFile(path, os.fstat(f.fileno()), f.read())
+        with FileServerMixin.STATIC_CACHE_LOCK:
+            FileServerMixin.STATIC_CACHE[path] = cached
+        return cached
+
+    def not_modified(self, info:CachedFile) -> bool:
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or info.etag in tags or f'W/{info.etag}' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return int(info.mtime_ns // 1_000_000_000) <= since
+        return False
+
+    def requested_range(self, info:CachedFile):
+        """
+        Returns (start, end) inclusive, None to send the whole file, or False if the range can not be satisfied
+        """
+        range_header = self.headers.get('Range')
+        if range_header is None:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range is not None and if_range.strip() not in (info.etag, info.last_modified):
+            # the client's copy is out of date, send all of it
+            return None
+        m = self.RANGE_RE.match(range_header.strip())
+        if m is None:
+            # multiple ranges or another unit. Ignoring Range is allowed
+            return None
+        first, last = m.groups()
+        if first == '' and last == '':
+            return None
+        if first == '':
+            length = int(last)
+            if length == 0:
+                return False
+            return max(0, info.size - length), info.size - 1
+        start = int(first)
+        end = info.size - 1 if last == '' else min(int(last), info.size - 1)
+        if start >= info.size or end < start:
+            return False
+        return start, end
+
+    def send_file(self, path:str, content_type:str=None, cache_control:str='no-cache', cache:bool=False):
+        """
+        Send the file at path. Set cache=True for small static assets that are requested often
+        """
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError, TypeError):
+            self.send_error(HTTPStatus.NOT_FOUND, f'{self.path} not found')
+            return
+        if content_type is None:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if cache and stat.st_size <= self.STATIC_CACHE_MAX_FILE:
+            info = self.cached_file(path, stat)
+        else:
+            info = CachedFile(path, stat)
+
+        if self.not_modified(info):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', info.etag)
+            self.send_header('Last-Modified', info.last_modified)
+            self.send_header('Cache-Control', cache_control)
+            self.end_headers()
+            return
+
+        byte_range = self.requested_range(info)
+        if byte_range is False:
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{info.size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if byte_range is None:
+            start, end = 0, info.size - 1
+            self.send_response(HTTPStatus.OK)
+        else:
+            start, end = byte_range
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{info.size}')
+        count = end - start + 1
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(count))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', info.etag)
+        self.send_header('Last-Modified', info.last_modified)
+        self.send_header('Cache-Control', cache_control)
+        self.end_headers()
+        if count <= 0:
+            return
+        if info.data is not None:
+            self.wfile.write(info.data[start:end + 1])
+            return
+        self.wfile.flush()
+        with open(path, 'rb') as f:
+            self.connection.sendfile(f, offset=start, count=count)
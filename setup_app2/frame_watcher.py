@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+
+import watchdog.events
+import watchdog.observers
+
+
+class FrameWatcher(object):
+    """
+    Keeps track of the newest frame in the timelapse frame directory.
+    The directory is scanned once when it is set, after that the watchdog observer keeps the latest frame
+    up to date. Frame names start with a timestamp so the newest frame is the largest name.
+    Threads waiting in wait_for_frame() are woken whenever a new frame arrives.
+    """
+    class Handler(watchdog.events.PatternMatchingEventHandler):
+        def __init__(self, watcher, patterns:list):
+            watchdog.events.PatternMatchingEventHandler.__init__(self, patterns=patterns,
+                                                                 ignore_directories=True,
+                                                                 case_sensitive=True)
+            self.watcher = watcher
+
+        def on_closed(self, event):
+            # the camera has finished writing the file
+            self.watcher.add_frame(event.src_path)
+
+        def on_moved(self, event):
+            self.watcher.add_frame(event.dest_path)
+
+    def __init__(self, extension:str='jpg'):
+        self.extension = extension
+        self.frame_dir:str = None
+        self.latest:str = None
+        # incremented for every new frame so waiters can tell if they have missed one
+        self.sequence:int = 0
+        self.condition = threading.Condition()
+        self.dir_lock = threading.Lock()
+        # called with the path of each new frame
+        self.listeners = []
+        self.handler = FrameWatcher.Handler(self, [f'*.{extension}'])
+        self.observer = watchdog.observers.Observer()
+        self.observer.daemon = True
+        self.watch = None
+        self.observer.start()
+
+    def set_frame_dir(self, frame_dir:str):
+        # the observer is (un)scheduled outside self.condition: unschedule waits for the observer thread,
+        # which may be waiting for self.condition in add_frame()
+        with self.dir_lock:
+            if frame_dir == self.frame_dir and self.watch is not None:
+                return
+            if self.watch is not None:
+                self.observer.unschedule(self.watch)
+                self.watch = None
+            with self.condition:
+                if frame_dir != self.frame_dir:
+                    self.frame_dir = frame_dir
+                    self.latest = None
+            if not os.path.isdir(frame_dir):
+                logging.warning(f'Frame directory {frame_dir} does not exist yet')
+                return
+            # start watching before the scan so no frame is missed
+            self.watch = self.observer.schedule(self.handler, path=frame_dir, recursive=False)
+            suffix = f'.{self.extension}'
+            with os.scandir(frame_dir) as entries:
+                names = [entry.name for entry in entries if entry.name.endswith(suffix)]
+            if names:
+                self.add_frame(os.path.join(frame_dir, max(names)))
+            logging.info(f'Watching {frame_dir}, {len(names)} frames, latest: {self.latest}')
+
+    def check_frame_dir(self):
+        # the timelapse may not have created the frame directory when the frame dir was set
+        if self.watch is None and self.frame_dir is not None and os.path.isdir(self.frame_dir):
+            self.set_frame_dir(self.frame_dir)
+
+    def add_frame(self, path:str):
+        with self.condition:
+            if os.path.dirname(path) != self.frame_dir:
+                return
+            if self.latest is not None and os.path.basename(path) <= os.path.basename(self.latest):
+                return
+            self.latest = path
+            self.sequence += 1
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener(path)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def get_latest(self):
+        """
+        Returns (sequence, path of the latest frame or None)
+        """
+        self.check_frame_dir()
+        with self.condition:
+            return self.sequence, self.latest
+
+    def wait_for_frame(self, sequence:int, timeout:float=None):
+        """
+        Wait until the latest frame changes from the one seen at `sequence`.
+        Returns (sequence, path of the latest frame or None). The sequence is unchanged on timeout
+        """
+        self.check_frame_dir()
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != sequence, timeout=timeout)
+            return self.sequence, self.latest
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
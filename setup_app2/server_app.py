@@ -1,12 +1,10 @@
 #!/usr/bin/python3
 
 import argparse
-import io
 import logging
 import os
 import sys
 import time
-from threading import Condition
 
 from picamera2 import Picamera2
 Picamera2.set_logging(Picamera2.WARNING)
@@ -17,6 +15,7 @@ from picamera2 import Picamera2, MappedArray
 from libcamera import Transform
 import cv2
 from setup_server_handler import SetupServerHandler
+from stream_hub import BroadcastHub
 from web_server import WebServer
 
 APP_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -46,6 +45,12 @@ def parse_arguments():
     parser.add_argument('--zoom', type=float,
                         help='Zoom')
     parser.add_argument('--html', type=str, default='html')
+    parser.add_argument('--bitrate', type=int, default=10000000,
+                        help='MJPEG encoder bitrate for the full size stream. Default: 10000000')
+    parser.add_argument('--lores-width', type=int, default=320,
+                        help='Width of the low resolution stream. 0 to disable it. Default: 320')
+    parser.add_argument('--lores-bitrate', type=int, default=2000000,
+                        help='MJPEG encoder bitrate for the low resolution stream. Default: 2000000')
     return parser.parse_args()
 
 def setup_logging(logfile):
@@ -66,16 +71,6 @@ def setup_logging(logfile):
         format='%(asctime)s|%(levelname)s|%(threadName)s|%(message)s'
     )
 
-class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
-        self.frame = None
-        self.condition = Condition()
-
-    def write(self, buf):
-        with self.condition:
-            self.frame = buf
-            self.condition.notify_all()
-
 if __name__ == '__main__':
     config = parse_arguments()
     ar = config.width/config.height
@@ -110,7 +105,13 @@ if __name__ == '__main__':
     transform=Transform(hflip=False, vflip=False)
     framerate = 0.333 if config.exposure_time is None else 1.0 / (config.exposure_time / 1000000)
     ### TODO look at this example: https://github.com/raspberrypi/picamera2/blob/main/examples/video_with_config.py
+    lores = None
+    if config.lores_width > 0:
+        # same aspect ratio, even dimensions for the YUV420 lores stream
+        lores_height = int(config.lores_width * config.height / config.width) // 2 * 2
+        lores = {"size": (config.lores_width // 2 * 2, lores_height)}
     video_config = picam2.create_video_configuration(main={"size": (config.width, config.height)},
+                                                     lores=lores,
                                                      transform=transform)
     controls = video_config['controls']
     if config.zoom > 1.0:
@@ -136,14 +137,21 @@ if __name__ == '__main__':
 
     # picam2.video_configuration.controls.FrameRate = 10.0
 
-    output = StreamingOutput()
+    hub = BroadcastHub()
     SetupServerHandler.PICAMERA = picam2
-    SetupServerHandler.OUTPUT = output
+    SetupServerHandler.HUB = hub
     SetupServerHandler.SENSOR_MODES = picam2.sensor_modes
     SetupServerHandler.ASPECT_RATIO = ar
     logging.info(f'Set aspect ratio: {ar}')
 
-    picam2.start_recording(MJPEGEncoder(bitrate=100000000), FileOutput(output))
+    main_encoder = MJPEGEncoder(bitrate=config.bitrate)
+    main_encoder.output = FileOutput(hub.add_stream('main'))
+    picam2.start_encoder(main_encoder, name='main')
+    if lores is not None:
+        lores_encoder = MJPEGEncoder(bitrate=config.lores_bitrate)
+        lores_encoder.output = FileOutput(hub.add_stream('lores'))
+        picam2.start_encoder(lores_encoder, name='lores')
+    picam2.start()
     time.sleep(1)
     if config.exposure_time is not None:
         logging.info(f'Turning off Auto Exposure. framerate: {framerate}, exposure time: {config.exposure_time}')
@@ -165,5 +173,6 @@ if __name__ == '__main__':
     except KeyboardInterrupt as k:
         logging.info(f'\nShutting down due to keyboard interrupt')
     finally:
+        hub.close()
         picam2.stop_recording()
 
@@ -1,3 +1,4 @@
+import json
 import logging
 import os.path
 from http import server
@@ -5,17 +6,24 @@ from jinja2 import Environment, FileSystemLoader
 import platform
 from picamera2 import Picamera2
 from threading import Condition
+from urllib.parse import urlsplit, parse_qs
+
+from file_server import FileServerMixin
+from stream_hub import StreamClosed
 
 FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-class SetupServerHandler(server.BaseHTTPRequestHandler):
+class SetupServerHandler(FileServerMixin, server.BaseHTTPRequestHandler):
     TEMPLATE_DIR = os.path.join(FILE_DIR, 'pages')
     ENVIRONMENT = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
 
     PICAMERA = None
     SENSOR_MODES = {}
-    OUTPUT = None
+    HUB = None
+    # seconds between checks for the stream closing while waiting for a frame. Frames can be much further
+    # apart than this with long exposures, so a client is only dropped when its slot closes or a write fails
+    STREAM_POLL = 1.0
     ASPECT_RATIO = '4:3'
     SCALAR_CROP_BASE=None
     def __init__(self, request, client_address, server):
@@ -38,8 +46,21 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
         self.wfile.write(content)
 
     def load_stream(self):
-        if SetupServerHandler.OUTPUT is None:
+        """
+        /stream.mjpg[?stream=lores][&fps=N]
+        """
+        hub = SetupServerHandler.HUB
+        if hub is None:
             self.send_response(204) # no content
+            self.end_headers()
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        stream = query.get('stream', ['main'])[0]
+        try:
+            max_fps = float(query['fps'][0]) if 'fps' in query else None
+            slot = hub.subscribe(stream, f'{self.client_address[0]}:{self.client_address[1]}', max_fps=max_fps)
+        except ValueError as e:
+            self.send_error(400, f'{e}')
             return
         self.send_response(200)
         self.send_header('Age', 0)
@@ -47,21 +68,36 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
         self.send_header('Pragma', 'no-cache')
         self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=FRAME')
         self.end_headers()
+        logging.info(f'Streaming {stream} to {slot.client} (max fps: {max_fps})')
         try:
             while True:
-                with SetupServerHandler.OUTPUT.condition:
-                    SetupServerHandler.OUTPUT.condition.wait()
-                    frame = SetupServerHandler.OUTPUT.frame
+                frame = slot.get(timeout=SetupServerHandler.STREAM_POLL)
+                if frame is None:
+                    continue
                 self.wfile.write(b'--FRAME\r\n')
                 self.send_header('Content-Type', 'image/jpeg')
                 self.send_header('Content-Length', len(frame))
                 self.end_headers()
                 self.wfile.write(frame)
                 self.wfile.write(b'\r\n')
+                slot.sent(len(frame))
+        except StreamClosed as e:
+            logging.info(f'{e}')
         except Exception as e:
             logging.warning(
                 'Removed streaming client %s: %s',
                 self.client_address, str(e))
+        finally:
+            stats = hub.unsubscribe(slot)
+            logging.info(f'Stream stats: {stats}')
+
+    def send_stream_stats(self):
+        content = b'{}' if SetupServerHandler.HUB is None else json.dumps(SetupServerHandler.HUB.stats()).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', len(content))
+        self.end_headers()
+        self.wfile.write(content)
 
     def get_pi_model(self):
         with open('/proc/device-tree/model') as f:
@@ -133,18 +169,14 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
                              img_w=img_w,
                              img_h=img_h,
                              )
-        elif self.path == '/stream.mjpg':
+        elif self.path == '/stream.mjpg' or self.path.startswith('/stream.mjpg?'):
             self.load_stream()
+        elif self.path == '/stream_stats':
+            self.send_stream_stats()
         elif self.path.startswith('/set_zoom?'):
             self.set_zoom()
         elif self.path == '/setup_app.js':
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/javascript')
-            with open(os.path.join(self.content_directory, 'setup_app.js')) as f:
-                content = f.read()
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            self.send_file(os.path.join(self.content_directory, 'setup_app.js'), 'text/javascript', cache=True)
         elif self.path.startswith('/set_control?'):
             a = self.path.split('?')[1]
             args = a.split('&')
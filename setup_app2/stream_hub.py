@@ -0,0 +1,141 @@
+import io
+import threading
+import time
+
+
+class StreamClosed(Exception):
+    pass
+
+
+class ClientSlot(object):
+    """
+    One streaming client. Holds only the latest frame: if the client has not taken the previous
+    frame when a new one arrives, the old one is dropped, so a slow client never holds up the others.
+    """
+    def __init__(self, stream:str, client:str, max_fps:float=None):
+        self.stream = stream
+        self.client = client
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.condition = threading.Condition()
+        self.frame = None
+        self.last_accepted = 0.0
+        self.closed = False
+        self.start_time = time.time()
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+
+    def put(self, frame:bytes, now:float):
+        with self.condition:
+            if now - self.last_accepted < self.min_interval:
+                # client asked for a lower frame rate
+                self.frames_skipped += 1
+                return
+            if self.frame is not None:
+                self.frames_dropped += 1
+            self.frame = frame
+            self.last_accepted = now
+            self.condition.notify()
+
+    def get(self, timeout:float=None):
+        """
+        Wait for the next frame. Returns None on timeout and raises StreamClosed when the client has been
+        unsubscribed or the hub is shutting down
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None or self.closed, timeout=timeout)
+            if self.closed:
+                raise StreamClosed(f'{self.stream} stream to {self.client} closed')
+            frame = self.frame
+            self.frame = None
+            return frame
+
+    def sent(self, nbytes:int):
+        self.frames_sent += 1
+        self.bytes_sent += nbytes
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def stats(self) -> dict:
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        return {
+            'client': self.client,
+            'stream': self.stream,
+            'seconds': round(elapsed, 1),
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'frames_skipped': self.frames_skipped,
+            'fps': round(self.frames_sent / elapsed, 2),
+            'kbps': round(self.bytes_sent * 8 / elapsed / 1000, 1),
+        }
+
+
+class StreamOutput(io.BufferedIOBase):
+    """
+    Encoder output (for picamera2's FileOutput) that hands each frame to every subscribed ClientSlot
+    """
+    def __init__(self, hub, name:str):
+        self.hub = hub
+        self.name = name
+        self.frames = 0
+
+    def write(self, buf):
+        self.frames += 1
+        now = time.time()
+        for slot in self.hub.clients(self.name):
+            slot.put(buf, now)
+        return len(buf)
+
+
+class BroadcastHub(object):
+    """
+    Fan encoded frames out to any number of streaming clients.
+    Each encoder stream ("main", "lores", ...) has an output to record into. Clients subscribe to one
+    of them, optionally with a frame rate limit.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outputs = {}
+        self._clients = []
+
+    def add_stream(self, name:str) -> StreamOutput:
+        output = StreamOutput(self, name)
+        self.outputs[name] = output
+        return output
+
+    @property
+    def streams(self):
+        return list(self.outputs.keys())
+
+    def clients(self, stream:str=None):
+        with self.lock:
+            return [c for c in self._clients if stream is None or c.stream == stream]
+
+    def subscribe(self, stream:str, client:str, max_fps:float=None) -> ClientSlot:
+        if stream not in self.outputs:
+            raise ValueError(f'Unknown stream "{stream}". Must be one of {self.streams}')
+        slot = ClientSlot(stream, client, max_fps=max_fps)
+        with self.lock:
+            self._clients.append(slot)
+        return slot
+
+    def unsubscribe(self, slot:ClientSlot) -> dict:
+        with self.lock:
+            if slot in self._clients:
+                self._clients.remove(slot)
+        slot.close()
+        return slot.stats()
+
+    def stats(self) -> dict:
+        return {
+            'streams': {name: output.frames for name, output in self.outputs.items()},
+            'clients': [slot.stats() for slot in self.clients()],
+        }
+
+    def close(self):
+        for slot in self.clients():
+            slot.close()
@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# JPEG start of frame markers hold the image size
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def jpeg_size(path:str):
+    """
+    Returns (width, height) from the JPEG header without decoding the image, or None
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            while marker[1] == 0xFF:
+                # fill bytes
+                marker = marker[1:] + f.read(1)
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                return None
+            length = struct.unpack('>H', length_bytes)[0]
+            if marker[1] in SOF_MARKERS:
+                data = f.read(5)
+                if len(data) < 5:
+                    return None
+                height, width = struct.unpack('>HH', data[1:5])
+                return width, height
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+class ThumbnailCache(object):
+    """
+    Downscaled JPEGs of frames, cached on disk.
+    Thumbnails are keyed by frame path, mtime and width and the least recently used are removed when the
+    cache is bigger than max_bytes. Frames are decoded at 1/2, 1/4 or 1/8 size by libjpeg when that is
+    still at least as wide as the thumbnail.
+    """
+    def __init__(self, cache_dir:str, max_bytes:int=64 * 1024 * 1024, default_width:int=900, quality:int=80):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.default_width = default_width
+        self.quality = quality
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Thumbnailer')
+        self.load_entries()
+
+    def load_entries(self):
+        # least recently used first. get() touches the mtime of thumbnails it hands out
+        entries = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith('.jpg'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self.entries[name] = size
+            self.total_bytes += size
+        logging.info(f'Thumbnail cache {self.cache_dir}: {len(self.entries)} thumbnails, '
+                     f'{self.total_bytes / (1024 * 1024):.1f} MB')
+        self.evict()
+
+    def key(self, path:str, width:int) -> str:
+        stat = os.stat(path)
+        return hashlib.sha1(f'{os.path.abspath(path)}|{stat.st_mtime_ns}|{width}'.encode('utf-8')).hexdigest() + '.jpg'
+
+    def evict(self):
+        with self.lock:
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                name, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def read_frame(self, path:str, width:int):
+        size = jpeg_size(path)
+        if size is not None:
+            for factor, flag in REDUCED_FLAGS:
+                if size[0] // factor >= width:
+                    return cv2.imread(path, flag)
+        return cv2.imread(path, cv2.IMREAD_COLOR)
+
+    def create(self, path:str, width:int, name:str) -> str:
+        image = self.read_frame(path, width)
+        if image is None:
+            raise ValueError(f'Could not read {path}')
+        h, w = image.shape[:2]
+        if w > width:
+            image = cv2.resize(image, (width, max(1, round(h * width / w))), interpolation=cv2.INTER_AREA)
+        ok, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError(f'Could not encode thumbnail of {path}')
+        thumb_path = os.path.join(self.cache_dir, name)
+        tmp_path = thumb_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data.tobytes())
+        os.replace(tmp_path, thumb_path)
+        with self.lock:
+            self.entries[name] = len(data)
+            self.total_bytes += len(data)
+        self.evict()
+        return thumb_path
+
+    def get(self, path:str, width:int=None) -> str:
+        """
+        Returns the path of the thumbnail of the frame at path, creating it if needed
+        """
+        width = self.default_width if width is None else width
+        name = self.key(path, width)
+        thumb_path = os.path.join(self.cache_dir, name)
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+                hit = True
+            else:
+                hit = False
+                event = self.pending.get(name)
+                if event is None:
+                    event = self.pending[name] = threading.Event()
+                    creator = True
+                else:
+                    creator = False
+        if hit:
+            try:
+                os.utime(thumb_path)
+                return thumb_path
+            except FileNotFoundError:
+                # removed behind our back, make it again
+                with self.lock:
+                    self.total_bytes -= self.entries.pop(name, 0)
+                return self.get(path, width)
+        if not creator:
+            # someone else is making it
+            event.wait()
+            return self.get(path, width)
+        try:
+            return self.create(path, width, name)
+        finally:
+            with self.lock:
+                del self.pending[name]
+            event.set()
+
+    def pregenerate(self, path:str, width:int=None):
+        """
+        Make the thumbnail in the background, e.g. as soon as a new frame is written
+        """
+        def run():
+            try:
+                self.get(path, width)
+            except Exception as e:
+                logging.warning(f'Failed to make thumbnail of {path}: {e}')
+        self.executor.submit(run)
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
@@ -16,6 +16,9 @@ from threading import Condition
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+from control_client import ControlClient
+from frame_watcher import FrameWatcher
+from thumbnail_cache import ThumbnailCache
 from timelapse_server_handler import SetupServerHandler
 
 class WebServer(socketserver.ThreadingMixIn, server.HTTPServer):
@@ -46,6 +49,14 @@ def parse_arguments():
     parser.add_argument('--html', type=str, default='html')
     parser.add_argument('--exposure-time', type=int,
                         help='how long to expose each frame')
+    parser.add_argument('--thumb-cache', type=str, default='/tmp/timelapse_thumbs',
+                        help='Directory for cached thumbnails. Default: /tmp/timelapse_thumbs')
+    parser.add_argument('--thumb-cache-mb', type=int, default=64,
+                        help='Maximum size of the thumbnail cache in MB. Default: 64')
+    parser.add_argument('--thumb-width', type=int, default=900,
+                        help='Width of thumbnails made ahead of time for new frames. Default: 900')
+    parser.add_argument('--control-timeout', type=float, default=120.0,
+                        help='Seconds to wait for the timelapse to answer a control request. Default: 120')
     return parser.parse_args()
 
 def setup_logging(logfile):
@@ -72,6 +83,7 @@ def exit_gracefully(signum, frame):
 
 timelapse_info_path = '/home/pi/timelapse_info.json'
 timelapse_info_path_out = '/home/pi/timelapse_info_helper.json'
+DEFAULT_CONTROL_SOCKET = '/home/pi/timelapse.sock'
 
 def get_timelapse_pid():
     data = None
@@ -94,6 +106,8 @@ class PidMonitorHandler(FileSystemEventHandler):
         print(f'Timelapse PID: {timelapse_info["PID"]}')
         SetupServerHandler.PID = timelapse_info['PID']
         SetupServerHandler.FRAME_DIR  = timelapse_info['Framedir']
+        SetupServerHandler.FRAME_WATCHER.set_frame_dir(timelapse_info['Framedir'])
+        SetupServerHandler.CONTROL_CLIENT.socket_path = timelapse_info.get('ControlSocket', DEFAULT_CONTROL_SOCKET)
         # zoom and other settings are available, need to add an "update from timelapse" button and logic on the web page
 
 if __name__ == '__main__':
@@ -110,6 +124,14 @@ if __name__ == '__main__':
     SetupServerHandler.ANALOG_GAIN = timelapse_pid['AnalogueGain']
     SetupServerHandler.ZOOM = timelapse_pid['Zoom']
     SetupServerHandler.EXPOSURE_TIME = timelapse_pid['ExposureTime']
+    SetupServerHandler.CONTROL_CLIENT = ControlClient(timelapse_pid.get('ControlSocket', DEFAULT_CONTROL_SOCKET),
+                                                      timeout=config.control_timeout)
+    SetupServerHandler.FRAME_WATCHER = FrameWatcher()
+    SetupServerHandler.THUMBNAIL_CACHE = ThumbnailCache(config.thumb_cache,
+                                                        max_bytes=config.thumb_cache_mb * 1024 * 1024,
+                                                        default_width=config.thumb_width)
+    SetupServerHandler.FRAME_WATCHER.add_listener(SetupServerHandler.THUMBNAIL_CACHE.pregenerate)
+    SetupServerHandler.FRAME_WATCHER.set_frame_dir(SetupServerHandler.FRAME_DIR)
     event_handler = PidMonitorHandler()
     observer = Observer()
     observer.schedule(event_handler, path=timelapse_info_path, recursive=False)
@@ -124,3 +146,5 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    SetupServerHandler.FRAME_WATCHER.stop()
+    SetupServerHandler.THUMBNAIL_CACHE.stop()
@@ -4,12 +4,16 @@ import logging
 import os
 import signal
 from http import server
+from urllib.parse import urlsplit, parse_qs, unquote
 from jinja2 import Environment, FileSystemLoader
 
+from control_client import ControlError, ControlUnavailable
+from file_server import FileServerMixin
+
 FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-class SetupServerHandler(server.BaseHTTPRequestHandler):
+class SetupServerHandler(FileServerMixin, server.BaseHTTPRequestHandler):
     TEMPLATE_DIR = os.path.join(FILE_DIR, 'tlpages')
     ENVIRONMENT = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
     FRAME_DIR=None
@@ -18,6 +22,13 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
     CAMERA_INFO = None
     ANALOG_GAIN = ''
     ZOOM = 1.0
+    FRAME_WATCHER = None
+    THUMBNAIL_CACHE = None
+    CONTROL_CLIENT = None
+    MIN_THUMB_WIDTH = 16
+    MAX_THUMB_WIDTH = 4096
+    # seconds between keepalive comments on idle /events streams
+    EVENT_KEEPALIVE = 15.0
 
     def get_pi_model(self):
         with open('/proc/device-tree/model') as f:
@@ -48,22 +59,28 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(content)
 
-    def load_latest_image(self):
+    def frame_url(self, path):
         frame_dir = SetupServerHandler.FRAME_DIR.replace('/home/pi', '')
+        return frame_dir + '/' + os.path.basename(path)
+
+    def find_latest_image(self):
+        if SetupServerHandler.FRAME_WATCHER is not None:
+            sequence, latest = SetupServerHandler.FRAME_WATCHER.get_latest()
+            return latest
         path = os.path.join(self.content_directory, SetupServerHandler.FRAME_DIR, '*.jpg')
-        print(f'CONTENT: {self.content_directory}')
-        print(f'PATH: {path}')
         filelist = glob.glob(path)
-        filelist.sort()
-        if len(filelist) <= 0:
+        return max(filelist) if filelist else None
+
+    def load_latest_image(self):
+        latest = self.find_latest_image()
+        if latest is None:
             self.send_response(200)
             self.send_header('Content-Type', 'text')
             self.end_headers()
             self.wfile.write('No Images'.encode('utf-8'))
             return
 
-        latest = filelist[-1]
-        latest = frame_dir + '/' + os.path.basename(latest)
+        latest = self.frame_url(latest)
         print(f'LATEST: {latest}')
         self.send_response(200)
         self.send_header('Content-Type', 'text')
@@ -71,25 +88,110 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
         self.wfile.write(latest.encode('utf-8'))
 
     def send_image(self, path):
-        print(f'sending {path}')
-        content_path = os.path.join(self.content_directory, path[1:])
-        print(f'CONTENT: {content_path}')
-        if not os.path.exists(content_path):
-            print(f'IMAGE NOT FOUND: {path}')
+        content_path = self.safe_path(self.content_directory, path)
+        # frames never change once they are written
+        self.send_file(content_path, 'image/jpeg', cache_control='public, max-age=86400')
+
+    def send_thumbnail(self):
+        """
+        /thumb/<frame>?w=<width>: a downscaled copy of a frame in the frame directory
+        """
+        url = urlsplit(self.path)
+        frame = unquote(url.path[len('/thumb/'):])
+        cache = SetupServerHandler.THUMBNAIL_CACHE
+        if cache is None or not frame or '/' in frame or frame.startswith('.'):
+            self.send_error(404, f'{self.path} not found')
+            return
+        try:
+            width = int(parse_qs(url.query).get('w', [cache.default_width])[0])
+        except ValueError:
+            self.send_error(400, f'Bad width: {self.path}')
+            return
+        width = max(SetupServerHandler.MIN_THUMB_WIDTH, min(SetupServerHandler.MAX_THUMB_WIDTH, width))
+        frame_path = os.path.join(SetupServerHandler.FRAME_DIR, frame)
+        if not os.path.exists(frame_path):
+            self.send_error(404, f'{self.path} not found')
+            return
+        try:
+            thumb_path = cache.get(frame_path, width)
+        except FileNotFoundError as e:
+            if not os.path.exists(frame_path):
+                # removed since we checked
+                self.send_error(404, f'{self.path} not found')
+                return
+            logging.error(f'{e}')
+            self.send_error(500, f'Could not make thumbnail of {frame}')
+            return
+        except (ValueError, OSError) as e:
+            logging.warning(f'{e}')
+            self.send_error(500, f'Could not make thumbnail of {frame}')
+            return
+        self.send_file(thumb_path, 'image/jpeg', cache_control='public, max-age=86400')
+
+    def send_text(self, content:str, content_type:str='text', status:int=200):
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', len(content))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_control(self, command:str, **args):
+        """
+        Send a command over the timelapse's control socket.
+        Returns the result, or None if the timelapse is not listening so the caller can fall back to signals.
+        Other failures raise ControlError.
+        """
+        client = SetupServerHandler.CONTROL_CLIENT
+        if client is None:
+            return None
+        try:
+            return client.request(command, **args)
+        except ControlUnavailable as e:
+            logging.warning(f'Control socket unavailable, using signals: {e}')
+        return None
+
+    def send_status(self):
+        client = SetupServerHandler.CONTROL_CLIENT
+        if client is None:
+            self.send_error(404, 'No control socket')
+            return
+        try:
+            result = client.status()
+        except ControlError as e:
+            self.send_text(json.dumps({'error': f'{e}'}), 'application/json', status=503)
+            return
+        self.send_text(json.dumps(result, default=str), 'application/json')
+
+    def send_events(self):
+        """
+        Server-Sent Events stream. Sends a "frame" event with the url of each new frame.
+        """
+        watcher = SetupServerHandler.FRAME_WATCHER
+        if watcher is None:
             self.send_response(404)
-            self.send_header('Content-Type', 'text')
             self.end_headers()
-            self.wfile.write(f'{path} not found')
-        else:
-            with open(content_path, 'rb') as img:
-                data = img.read()
-                l = len(data)
-                print(f'LENGTH: {l}')
-                self.send_response(200)
-                self.send_header('Content-Type', 'image/jpeg')
-                self.send_header('Content-Length', l)
-                self.end_headers()
-                self.wfile.write(data)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        sequence, latest = watcher.get_latest()
+        try:
+            if latest is not None:
+                self.wfile.write(f'event: frame\ndata: {self.frame_url(latest)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+            while True:
+                new_sequence, latest = watcher.wait_for_frame(sequence, timeout=SetupServerHandler.EVENT_KEEPALIVE)
+                if new_sequence == sequence:
+                    # also how we find out the browser has gone away
+                    self.wfile.write(b': keepalive\n\n')
+                elif latest is not None:
+                    self.wfile.write(f'event: frame\ndata: {self.frame_url(latest)}\n\n'.encode('utf-8'))
+                sequence = new_sequence
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logging.info(f'Event stream to {self.client_address[0]} closed')
 
     def do_GET(self):
         print(f'Request for {self.path}')
@@ -134,6 +236,16 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
                 'AnalogueGain': float(gain)
             }
             SetupServerHandler.EXPOSURE_TIME = controls['ExposureTime']
+            try:
+                result = self.send_control('set_controls', **controls)
+            except ControlError as e:
+                logging.error(f'{e}')
+                self.send_text(f'{e}', status=500)
+                return
+            if result is not None:
+                # the frame taken with the new settings
+                self.send_text(self.frame_url(result['frame']['path']))
+                return
             with open('/home/pi/timelapse_info_helper.json', 'w') as f:
                 logging.info(f'controls: {controls}')
                 data = json.dumps(controls)
@@ -148,31 +260,29 @@ class SetupServerHandler(server.BaseHTTPRequestHandler):
             self.send_image(self.path)
         elif self.path == '/get_latest':
             self.load_latest_image()
+        elif self.path == '/events':
+            self.send_events()
+        elif self.path.startswith('/thumb/'):
+            self.send_thumbnail()
         elif self.path.startswith('/singleshot'):
+            try:
+                result = self.send_control('single_shot')
+            except ControlError as e:
+                logging.error(f'{e}')
+                self.send_text(f'{e}', status=500)
+                return
+            if result is not None:
+                self.send_text(self.frame_url(result['frame']['path']))
+                return
             pid = SetupServerHandler.PID
             logging.info(f'Sending SIGUSR2 to {pid}')
             os.kill(int(pid), signal.SIGUSR2)
-            self.send_response(200)
-            self.send_header('Content-Type', 'text')
-            content = 'OK'
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            self.send_text('OK')
+        elif self.path == '/status':
+            self.send_status()
 
         elif self.path == '/timelapse.css':
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/css')
-            with open(os.path.join(self.content_directory, os.path.basename(self.path))) as f:
-                content = f.read()
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            self.send_file(os.path.join(self.content_directory, 'timelapse.css'), 'text/css', cache=True)
         elif self.path == '/timelapse_app.js':
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/javascript')
-            with open(os.path.join(self.content_directory, 'timelapse_app.js')) as f:
-                content = f.read()
-            self.send_header('Content-Length', len(content))
-            self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            self.send_file(os.path.join(self.content_directory, 'timelapse_app.js'), 'text/javascript', cache=True)
 
@@ -14,17 +14,40 @@ function set_exposure_time() {
         if (this.readyState == 4 && this.status == 200) {
            // Typical action to be performed when the document is ready:
            console.log(xhttp.responseText);
-           document.getElementById("latest_img").src = xhttp.responseText
-           document.getElementById("img_label").innerHTML = xhttp.responseText
+           show_image(xhttp.responseText)
         }
     };
     xhttp.open("GET", "set_exposure?exp=" + exposure_time + "&zoom=" + zoom + "&gain=" + analog_gain, true);
     xhttp.send();
 }
 
+function show_image(url) {
+    // preview with a thumbnail the width of the image element, link to the full frame
+    var img = document.getElementById("latest_img"),
+        frame = url.substring(url.lastIndexOf("/") + 1)
+    if (url.indexOf("/") < 0) {
+        // "No Images"
+        document.getElementById("img_label").innerHTML = url
+        return
+    }
+    img.src = "thumb/" + encodeURIComponent(frame) + "?w=" + img.width
+    document.getElementById("img_label").innerHTML = '<a href="' + url + '" target="_blank">' + url + '</a>'
+}
+
 function start_image_loop() {
-    console.log("starting autoload image loop")
-    setInterval(do_autoload, 3000)
+    if (!window.EventSource) {
+        console.log("starting autoload image loop")
+        setInterval(do_autoload, 3000)
+        return
+    }
+    // the server pushes the url of each new frame
+    console.log("listening for new frames")
+    var events = new EventSource("events")
+    events.addEventListener("frame", function(event) {
+        if (document.getElementById("autoload").checked) {
+            show_image(event.data)
+        }
+    })
 }
 
 function do_autoload() {
@@ -47,6 +70,10 @@ function singleshot() {
         if (this.readyState == 4 && this.status == 200) {
            // Typical action to be performed when the document is ready:
            console.log(xhttp.responseText);
+           if (xhttp.responseText.startsWith("/")) {
+               // sent over the control socket: the response is the new frame
+               show_image(xhttp.responseText)
+           }
         }
     };
     xhttp.open("GET", "singleshot", true);
@@ -61,8 +88,7 @@ function update_image() {
         if (this.readyState == 4 && this.status == 200) {
            // Typical action to be performed when the document is ready:
            console.log(xhttp.responseText);
-           document.getElementById("latest_img").src = xhttp.responseText
-           document.getElementById("img_label").innerHTML = xhttp.responseText
+           show_image(xhttp.responseText)
         }
     };
     xhttp.open("GET", "get_latest", true);
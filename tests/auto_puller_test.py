@@ -0,0 +1,71 @@
+import argparse
+import importlib.util
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+# auto-puller.py is a script, load it by path
+spec = importlib.util.spec_from_file_location('auto_puller', Path(__file__).resolve().parent.parent.joinpath('auto-puller.py'))
+auto_puller = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(auto_puller)
+
+SETTLE = 0.05
+
+
+class TestIngestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.raw_dir = Path(self.tmpdir.name).joinpath('picam001-motion2', 'raw')
+        self.raw_dir.mkdir(parents=True)
+        self.daemon = auto_puller.IngestDaemon(argparse.Namespace(host=self.tmpdir.name, jobs=1, settle=SETTLE,
+                                                                  orphan_timeout=SETTLE * 4))
+        self.submitted = []
+        self.daemon.executor.submit = lambda fn, pending: self.submitted.append(pending)
+
+    def tearDown(self):
+        self.daemon.executor.shutdown()
+        self.tmpdir.cleanup()
+
+    def write(self, name):
+        path = self.raw_dir.joinpath(name)
+        path.write_text(name)
+        self.daemon.add_file(path)
+        return path
+
+    def dispatch(self, seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            self.daemon.dispatch_settled()
+            time.sleep(SETTLE / 5)
+
+    def test_data_first_clip_after_settle(self):
+        data = self.write('20230812_220000.123456_motion_data.txt')
+        self.dispatch(SETTLE * 2)
+        self.assertEqual(len(self.daemon.pending), 1)
+        clip = self.write('20230812_220000.123456_motion_30fps.h264')
+        self.dispatch(SETTLE * 3)
+        self.assertEqual([(p.clip, p.data) for p in self.submitted], [(clip, data)])
+        self.assertEqual(self.daemon.pending, {})
+
+    def test_clip_after_data_was_forgotten(self):
+        data = self.write('20230812_220000.123456_motion_data.txt')
+        self.dispatch(SETTLE * 5)
+        self.assertEqual(self.daemon.pending, {})
+        clip = self.write('20230812_220000.123456_motion_30fps.h264')
+        self.dispatch(SETTLE * 3)
+        self.assertEqual([(p.clip, p.data) for p in self.submitted], [(clip, data)])
+
+    def test_clip_first_data_later(self):
+        clip = self.write('20230812_220000.123456_motion_30fps.h264')
+        self.dispatch(SETTLE * 2)
+        self.assertEqual(self.submitted, [])
+        data = self.write('20230812_220000.123456_motion_data.txt')
+        self.dispatch(SETTLE * 3)
+        self.assertEqual([(p.clip, p.data) for p in self.submitted], [(clip, data)])
+
+    def test_processed_clip_metadata_is_dropped(self):
+        self.write('20230812_220000.123456_motion_data.txt')
+        self.dispatch(SETTLE * 5)
+        self.assertEqual(self.daemon.pending, {})
+        self.assertEqual(self.submitted, [])
@@ -0,0 +1,73 @@
+import argparse
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from queue import Queue
+
+import cv2
+import numpy as np
+
+from pilapse.threads import CameraImage, CompositeWriter, ImageConsumer
+
+
+class TestCompositeWriter(unittest.TestCase):
+    def make_config(self, outdir):
+        return argparse.Namespace(outdir=outdir, run_from=None, composite=True, composite_mean=True,
+                                  composite_dir=None, composite_checkpoint=300.0, composite_format='png')
+
+    def make_writer(self, outdir, out_queue=None, shutdown_event=None):
+        return CompositeWriter(shutdown_event or threading.Event(), self.make_config(outdir),
+                               in_queue=Queue(), out_queue=out_queue)
+
+    def test_max_and_mean(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            out_queue = Queue()
+            writer = self.make_writer(tmpdir, out_queue)
+            start = datetime(2023, 8, 12, 22, 0, 0)
+            for i, value in enumerate([10, 200, 30]):
+                frame = np.full((4, 6, 3), value, dtype=np.uint8)
+                # a star moving across the frame
+                frame[1, i] = 255
+                writer.consume_image(CameraImage(frame, timestamp=start + timedelta(seconds=i)))
+            # a frame of the wrong size is skipped
+            writer.consume_image(CameraImage(np.zeros((2, 2, 3), dtype=np.uint8), timestamp=start))
+            writer.checkpoint()
+
+            self.assertEqual(writer.count, 3)
+            self.assertEqual(writer.skipped, 1)
+            self.assertEqual(out_queue.qsize(), 4)
+            maximum = cv2.imread(writer.composite_path('max'))
+            mean = cv2.imread(writer.composite_path('mean'))
+            self.assertEqual(maximum[0, 5, 0], 200)
+            self.assertEqual(list(maximum[1, :3, 0]), [255, 255, 255])
+            self.assertEqual(mean[0, 5, 0], 80)
+            self.assertTrue(os.path.basename(writer.composite_path('max')).startswith('20230812_220000'))
+            self.assertEqual(sorted(os.listdir(tmpdir)), sorted([os.path.basename(writer.composite_path('max')),
+                                                                 os.path.basename(writer.composite_path('mean'))]))
+
+    def test_frames_queued_at_shutdown_are_passed_on(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shutdown_event = threading.Event()
+            out_queue = Queue()
+            writer = self.make_writer(tmpdir, out_queue, shutdown_event)
+            # the downstream consumer must not stop while the compositor still has frames
+            downstream = ImageConsumer('Downstream', shutdown_event, self.make_config(tmpdir),
+                                       in_queue=out_queue, upstream=writer)
+            start = datetime(2023, 8, 12, 22, 0, 0)
+            for i in range(3):
+                writer.in_queue.put(CameraImage(np.full((4, 6, 3), i, dtype=np.uint8),
+                                                timestamp=start + timedelta(seconds=i)))
+            shutdown_event.set()
+            writer.start()
+            self.assertFalse(downstream.check_for_shutdown())
+            writer.join()
+            self.assertEqual(writer.count, 3)
+            self.assertEqual(out_queue.qsize(), 3)
+            self.assertTrue(os.path.exists(writer.composite_path('max')))
+            # the compositor has finished, the frames it passed on still have to be consumed
+            self.assertFalse(downstream.check_for_shutdown())
+            while not out_queue.empty():
+                out_queue.get()
+            self.assertTrue(downstream.check_for_shutdown())
@@ -0,0 +1,54 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from pilapse.control_server import ControlServer
+
+
+class TestControlServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmpdir.name, 'control.sock')
+        self.server = ControlServer(self.socket_path, ['status'], reply_timeout=5)
+
+    def tearDown(self):
+        self.server.close()
+        self.tmpdir.cleanup()
+
+    def send(self, *messages):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(5)
+            s.connect(self.socket_path)
+            with s.makefile('rwb') as stream:
+                responses = []
+                for message in messages:
+                    stream.write(message + b'\n')
+                    stream.flush()
+                    responses.append(json.loads(stream.readline()))
+                return responses
+
+    def test_request_reply(self):
+        def main_loop():
+            request = self.server.get(timeout=5)
+            request.reply({'frames': 3})
+        thread = threading.Thread(target=main_loop)
+        thread.start()
+        response, = self.send(json.dumps({'id': 7, 'command': 'status'}).encode('utf-8'))
+        thread.join()
+        self.assertTrue(response['ok'])
+        self.assertEqual(response['id'], 7)
+        self.assertEqual(response['result'], {'frames': 3})
+
+    def test_bad_requests(self):
+        bad_json, unknown = self.send(b'not json', json.dumps({'id': 1, 'command': 'reboot'}).encode('utf-8'))
+        self.assertFalse(bad_json['ok'])
+        self.assertFalse(unknown['ok'])
+        self.assertIn('reboot', unknown['error'])
+        self.assertIsNone(self.server.get())
+
+    def test_close_removes_socket(self):
+        self.server.close()
+        self.assertFalse(os.path.exists(self.socket_path))
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import time
+import unittest
+
+import cv2
+import numpy
+
+from pilapse.darkframe import HotPixelMask
+
+
+class TestHotPixelMask(unittest.TestCase):
+    def setUp(self):
+        self.darkframe = numpy.zeros((40, 60, 3), dtype=numpy.uint8)
+        self.darkframe[10, 10] = 200
+        self.darkframe[20:22, 30:32] = 100
+        # a cluster too big for the median neighbourhood
+        self.darkframe[30:37, 45:52] = 255
+
+    def test_from_darkframe(self):
+        mask = HotPixelMask.from_darkframe(self.darkframe, threshold=6)
+        self.assertEqual(mask.shape, (40, 60))
+        self.assertEqual(mask.count, 1 + 4 + 49)
+
+    def test_from_16bit_darkframe(self):
+        darkframe = self.darkframe.astype(numpy.uint16) * 256 + 128
+        mask = HotPixelMask.from_darkframe(darkframe, threshold=6)
+        self.assertEqual(mask.count, 1 + 4 + 49)
+        with self.assertRaises(ValueError):
+            HotPixelMask.from_darkframe(self.darkframe.astype(numpy.float32))
+
+    def test_apply(self):
+        mask = HotPixelMask.from_darkframe(self.darkframe, threshold=6)
+        image = numpy.full((40, 60, 3), 50, dtype=numpy.uint8)
+        image = cv2.add(image, self.darkframe)
+        cleaned = mask.apply(image)
+        self.assertTrue((cleaned[:28] == 50).all())
+        # the big cluster is inpainted, which is not exact
+        self.assertLessEqual(numpy.abs(cleaned.astype(int) - 50).max(), 3)
+        cleaned = mask.apply(image, method='inpaint')
+        self.assertLessEqual(numpy.abs(cleaned.astype(int) - 50).max(), 3)
+        self.assertFalse((image == 50).all())
+
+    def test_load_caches_mask(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            darkframe_path = os.path.join(tmpdir, 'dark.png')
+            cv2.imwrite(darkframe_path, self.darkframe)
+            mask = HotPixelMask.load(darkframe_path, threshold=6)
+            mask_path = HotPixelMask.mask_path(darkframe_path, threshold=6)
+            self.assertTrue(mask_path.exists())
+            mtime = mask_path.stat().st_mtime
+            time.sleep(0.01)
+            cached = HotPixelMask.load(darkframe_path, threshold=6)
+            self.assertEqual(mask_path.stat().st_mtime, mtime)
+            self.assertTrue((cached.mask == mask.mask).all())
+
+
+if __name__ == '__main__':
+    unittest.main()
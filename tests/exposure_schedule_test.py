@@ -0,0 +1,49 @@
+import datetime
+import json
+import os
+import unittest
+
+from pilapse.exposure_schedule import ExposureSchedule
+from pilapse.suntime import Suntime
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+SETTINGS_PATH = os.path.join(THIS_DIR, '..', 'camera_settings.json')
+location = (37.335480, -121.893028)
+testtz = datetime.timezone(datetime.timedelta(minutes=-420))
+
+
+class TestExposureSchedule(unittest.TestCase):
+    def test_matches_part_of_day_interpolation(self):
+        with open(SETTINGS_PATH) as f:
+            settings = json.load(f)
+        suntimes = Suntime(location, date='2023-06-18', tz=testtz)
+        schedule = ExposureSchedule(settings, suntimes, step=1.0)
+        now = datetime.datetime(2023, 6, 18)
+        while now < datetime.datetime(2023, 6, 19):
+            p0, p1, pct = suntimes.get_part_of_day_percent(now)
+            shutter0 = settings[p0]['shutter']
+            shutter1 = settings[p1]['shutter']
+            expected = shutter0 + (shutter1 - shutter0) * pct
+            iso, shutter, framerate = schedule.lookup(now.replace(tzinfo=testtz).timestamp())
+            self.assertEqual(iso, 100)
+            # within one step of the interpolated value
+            t0 = suntimes.value_from_name(p0) if p0 in suntimes.valid_times() else suntimes.y_last_light
+            t1 = suntimes.value_from_name(p1) if p1 in suntimes.valid_times() else suntimes.t_first_light
+            per_step = abs(shutter1 - shutter0) / (t1 - t0).total_seconds()
+            self.assertLessEqual(abs(shutter - expected), per_step + 1, str(now))
+            now += datetime.timedelta(minutes=7)
+
+    def test_valid_for_the_day(self):
+        with open(SETTINGS_PATH) as f:
+            settings = json.load(f)
+        schedule = ExposureSchedule(settings, Suntime(location, date='2023-06-18', tz=testtz))
+        self.assertTrue(schedule.is_current(datetime.datetime(2023, 6, 18, 0, 0, 0, tzinfo=testtz).timestamp()))
+        self.assertTrue(schedule.is_current(datetime.datetime(2023, 6, 18, 23, 59, 59, tzinfo=testtz).timestamp()))
+        self.assertFalse(schedule.is_current(datetime.datetime(2023, 6, 19, tzinfo=testtz).timestamp()))
+        # solar noon keyframe
+        noon = datetime.datetime(2023, 6, 18, 13, 9, 0, tzinfo=testtz).timestamp()
+        self.assertEqual(schedule.lookup(noon), (100, 2000, 30.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
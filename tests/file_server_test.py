@@ -0,0 +1,76 @@
+import http.client
+import os
+import tempfile
+import threading
+import unittest
+from http import server
+
+from setup_app2.file_server import FileServerMixin
+
+
+class TestFileServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        root = cls.tmpdir.name
+        with open(os.path.join(root, 'frame.jpg'), 'wb') as f:
+            f.write(bytes(range(256)) * 4)
+        with open(os.path.join(root, 'app.css'), 'w') as f:
+            f.write('body { color: black; }\n')
+
+        class Handler(FileServerMixin, server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_file(self.safe_path(root, self.path), cache=self.path.endswith('.css'))
+
+            def log_message(self, format, *args):
+                pass
+
+        cls.server = server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.tmpdir.cleanup()
+
+    def get(self, path, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        connection.request('GET', path, headers=headers or {})
+        response = connection.getresponse()
+        body = response.read()
+        connection.close()
+        return response, body
+
+    def test_conditional_get(self):
+        for path in ('/frame.jpg', '/app.css'):
+            response, body = self.get(path)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(len(body), int(response.getheader('Content-Length')))
+            etag = response.getheader('ETag')
+            response, body = self.get(path, {'If-None-Match': etag})
+            self.assertEqual(response.status, 304)
+            self.assertEqual(body, b'')
+            response, body = self.get(path, {'If-Modified-Since': response.getheader('Last-Modified')})
+            self.assertEqual(response.status, 304)
+        response, body = self.get('/app.css')
+        self.assertEqual(body, b'body { color: black; }\n')
+        self.assertEqual(response.getheader('Content-Type'), 'text/css')
+
+    def test_ranges(self):
+        response, body = self.get('/frame.jpg', {'Range': 'bytes=10-19'})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.getheader('Content-Range'), 'bytes 10-19/1024')
+        self.assertEqual(body, bytes(range(10, 20)))
+        response, body = self.get('/frame.jpg', {'Range': 'bytes=-4'})
+        self.assertEqual(body, bytes(range(252, 256)))
+        response, body = self.get('/frame.jpg', {'Range': 'bytes=2000-'})
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.getheader('Content-Range'), 'bytes */1024')
+        response, body = self.get('/../frame.jpg')
+        self.assertEqual(response.status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
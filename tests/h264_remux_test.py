@@ -0,0 +1,154 @@
+import io
+import os
+import struct
+import tempfile
+import unittest
+
+from pilapse.h264_remux import iter_nal_units, iter_access_units, remux_h264, SequenceParameterSet, count_frames
+
+
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def u(self, nbits, value):
+        for i in range(nbits - 1, -1, -1):
+            self.bits.append((value >> i) & 1)
+
+    def ue(self, value):
+        value += 1
+        nbits = value.bit_length()
+        self.u(nbits - 1, 0)
+        self.u(nbits, value)
+
+    def to_bytes(self):
+        bits = self.bits + [1] # rbsp_stop_one_bit
+        while len(bits) % 8:
+            bits.append(0)
+        return bytes(int(''.join(str(b) for b in bits[i:i + 8]), 2) for i in range(0, len(bits), 8))
+
+
+def make_sps(width_mbs=120, height_mbs=68, crop_bottom=4, fps=30):
+    w = BitWriter()
+    w.u(8, 77) # main profile
+    w.u(8, 0)
+    w.u(8, 40)
+    w.ue(0) # sps id
+    w.ue(0) # log2_max_frame_num_minus4
+    w.ue(2) # pic_order_cnt_type
+    w.ue(1) # max_num_ref_frames
+    w.u(1, 0)
+    w.ue(width_mbs - 1)
+    w.ue(height_mbs - 1)
+    w.u(1, 1) # frame_mbs_only_flag
+    w.u(1, 1) # direct_8x8_inference_flag
+    w.u(1, 1) # frame_cropping_flag
+    w.ue(0)
+    w.ue(0)
+    w.ue(0)
+    w.ue(crop_bottom)
+    w.u(1, 1) # vui_parameters_present_flag
+    w.u(4, 0) # aspect ratio, overscan, video signal, chroma loc not present
+    w.u(1, 1) # timing_info_present_flag
+    w.u(32, 1)
+    w.u(32, 2 * fps)
+    w.u(1, 1)
+    return b'\x67' + add_emulation_prevention(w.to_bytes())
+
+
+def add_emulation_prevention(rbsp):
+    out = bytearray()
+    zeros = 0
+    for b in rbsp:
+        if zeros >= 2 and b <= 3:
+            out.append(3)
+            zeros = 0
+        out.append(b)
+        zeros = zeros + 1 if b == 0 else 0
+    return bytes(out)
+
+
+PPS = b'\x68\xce\x38\x80'
+
+def make_slice(idr, first=True):
+    header = 0x65 if idr else 0x41
+    # first_mb_in_slice == 0 is coded as a single "1" bit
+    return bytes([header, 0x88 if first else 0x08, 0x12, 0x34])
+
+
+def make_stream(nframes=10, gop=5):
+    stream = bytearray()
+    for i in range(nframes):
+        idr = i % gop == 0
+        if idr:
+            stream += b'\x00\x00\x00\x01' + make_sps()
+            stream += b'\x00\x00\x00\x01' + PPS
+        stream += b'\x00\x00\x00\x01' + make_slice(idr)
+        stream += b'\x00\x00\x01' + make_slice(idr, first=False)
+    return bytes(stream)
+
+
+def read_boxes(data, offset=0, end=None):
+    boxes = {}
+    end = len(data) if end is None else end
+    while offset < end:
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+            header = 16
+        boxes[box_type] = (offset + header, offset + size)
+        offset += size
+    return boxes
+
+
+class TestH264Remux(unittest.TestCase):
+    def test_nal_units_across_chunks(self):
+        data = make_stream()
+        expected = list(iter_nal_units(io.BytesIO(data)))
+        self.assertEqual(len(expected), 24)
+        for chunk_size in (1, 2, 3, 5, 64):
+            self.assertEqual(list(iter_nal_units(io.BytesIO(data), chunk_size=chunk_size)), expected)
+
+    def test_access_units(self):
+        units = list(iter_access_units(iter_nal_units(io.BytesIO(make_stream(10)))))
+        self.assertEqual(len(units), 10)
+        # SPS, PPS and both slices of the first frame
+        self.assertEqual(len(units[0]), 4)
+        self.assertEqual(len(units[1]), 2)
+
+    def test_sps(self):
+        sps = SequenceParameterSet(make_sps())
+        self.assertEqual(sps.width, 1920)
+        self.assertEqual(sps.height, 1080)
+        self.assertEqual(sps.fps, 30)
+
+    def test_remux(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            inputs = []
+            for n in range(2):
+                path = os.path.join(tmpdir, f'clip{n}.h264')
+                with open(path, 'wb') as f:
+                    f.write(make_stream(10))
+                inputs.append(path)
+            self.assertEqual(count_frames(inputs[0]), 10)
+            output = os.path.join(tmpdir, 'clip.mov')
+            self.assertEqual(remux_h264(inputs, output, fps=15), 20)
+            with open(output, 'rb') as f:
+                data = f.read()
+
+        boxes = read_boxes(data)
+        self.assertEqual(list(boxes.keys()), [b'ftyp', b'mdat', b'moov'])
+        self.assertEqual(data[boxes[b'ftyp'][0]:boxes[b'ftyp'][0] + 4], b'qt  ')
+        # two 4 byte slices, each with a 4 byte length prefix, per frame
+        mdat_start, mdat_end = boxes[b'mdat']
+        self.assertEqual(mdat_end - mdat_start, 20 * 16)
+        self.assertIn(b'avcC', data)
+        stts = data.index(b'stts')
+        self.assertEqual(struct.unpack('>III', data[stts + 8:stts + 20]), (1, 20, 6000))
+        stss = data.index(b'stss')
+        self.assertEqual(struct.unpack('>5I', data[stss + 8:stss + 28]), (4, 1, 6, 11, 16))
+
+
+if __name__ == '__main__':
+    unittest.main()
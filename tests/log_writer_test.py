@@ -0,0 +1,40 @@
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from pilapse.log_writer import BufferedLogWriter
+
+
+class TestBufferedLogWriter(unittest.TestCase):
+    def test_jsonl_batches(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'logs', 'metadata.jsonl')
+            writer = BufferedLogWriter(path, max_records=10, max_delay=60)
+            for i in range(25):
+                writer.write({'frame': i, 'size': (1, 2)})
+            writer.close()
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual([r['frame'] for r in records], list(range(25)))
+            self.assertEqual(records[0]['size'], [1, 2])
+            self.assertEqual(writer.flushes, 3)
+
+    def test_csv_rotation(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'settings.csv')
+            writer = BufferedLogWriter(path, format='csv')
+            # as if the writer had been running since yesterday
+            writer.first_day -= datetime.timedelta(days=1)
+            writer.write(('2023/06/18 10:00:00.0', 0.5, 100, None))
+            writer.write(('2023/06/19 10:00:00.0', 0.25, 100, 12.5))
+            writer.close()
+            self.assertFalse(os.path.exists(path))
+            rotated = os.path.join(tmpdir, f'settings-{datetime.date.today().strftime("%Y%m%d")}.csv')
+            with open(rotated) as f:
+                self.assertEqual(f.read(), '2023/06/18 10:00:00.0,0.5,100,\n2023/06/19 10:00:00.0,0.25,100,12.5\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
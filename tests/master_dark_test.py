@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+import cv2
+import numpy
+
+from pilapse.master_dark import MasterDarkBuilder
+
+
+class TestMasterDarkBuilder(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        rng = numpy.random.default_rng(1234)
+        self.frames = rng.integers(90, 110, size=(10, 12, 16, 3), dtype=numpy.uint16)
+        # cosmic ray / satellite hits in single frames
+        self.frames[3, 2, 5] = 4000
+        self.frames[7, 9, 1:4] = 60000
+        self.paths = []
+        for i, frame in enumerate(self.frames):
+            path = os.path.join(self.tmpdir.name, f'dark{i:02}.png')
+            cv2.imwrite(path, frame)
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_median(self):
+        # max_memory_mb=0 combines one row at a time
+        builder = MasterDarkBuilder('median', max_memory_mb=0, work_dir=self.tmpdir.name)
+        master = builder.build(self.paths)
+        self.assertEqual(master.dtype, numpy.uint16)
+        expected = numpy.rint(numpy.median(self.frames, axis=0)).astype(numpy.uint16)
+        self.assertTrue((master == expected).all())
+        # the memory mapped stack is removed
+        self.assertEqual(sorted(os.listdir(self.tmpdir.name)), sorted(os.path.basename(p) for p in self.paths))
+
+    def test_sigma_clip(self):
+        builder = MasterDarkBuilder('sigma-clip', sigma=2.5, work_dir=self.tmpdir.name)
+        master = builder.build(self.paths)
+        # iterative sigma clipping with numpy's masked arrays
+        data = numpy.ma.masked_array(self.frames.astype(numpy.float64))
+        for _ in range(3):
+            center = numpy.ma.median(data, axis=0)
+            spread = data.std(axis=0)
+            data = numpy.ma.masked_array(data.data, mask=(numpy.abs(data.data - center) > 2.5 * spread) & (spread > 0))
+        expected = numpy.rint(data.mean(axis=0).filled()).astype(numpy.uint16)
+        self.assertTrue((master == expected).all())
+        # the hits are clipped
+        self.assertLess(master.max(), 110)
+
+    def test_skips_bad_frames(self):
+        small = os.path.join(self.tmpdir.name, 'small.png')
+        cv2.imwrite(small, self.frames[0][:4, :4])
+        missing = os.path.join(self.tmpdir.name, 'missing.png')
+        builder = MasterDarkBuilder('median', work_dir=self.tmpdir.name)
+        master = builder.build(self.paths[:5] + [small, missing])
+        self.assertEqual(builder.nframes, 5)
+        expected = numpy.rint(numpy.median(self.frames[:5], axis=0)).astype(numpy.uint16)
+        self.assertTrue((master == expected).all())
+
+    def test_bad_method(self):
+        with self.assertRaises(ValueError):
+            MasterDarkBuilder('mean')
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from pilapse.save_pipeline import SavePipeline
+
+
+class TestSavePipeline(unittest.TestCase):
+    def test_frames_finish_in_order(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            saved = []
+            pipeline = SavePipeline(workers=4, max_pending=8, on_saved=lambda context, error: saved.append(context))
+
+            def save_job(delay):
+                def save(path):
+                    time.sleep(delay)
+                    with open(path, 'w') as f:
+                        f.write('frame')
+                return save
+
+            # later frames are quicker to save
+            for i, delay in enumerate([0.2, 0.1, 0.0, 0.05]):
+                self.assertTrue(pipeline.reserve())
+                pipeline.submit(os.path.join(tmpdir, f'{i}.jpg'), save_job(delay), i)
+            pipeline.close()
+            self.assertEqual(saved, [0, 1, 2, 3])
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['0.jpg', '1.jpg', '2.jpg', '3.jpg'])
+            self.assertEqual(pipeline.stats()['saved'], 4)
+
+    def test_drops_when_full(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            release = threading.Event()
+            errors = []
+            pipeline = SavePipeline(workers=1, max_pending=2, on_saved=lambda context, error: errors.append(error))
+
+            def save(path):
+                release.wait(5)
+                raise IOError('disk full')
+
+            for i in range(2):
+                self.assertTrue(pipeline.reserve())
+                pipeline.submit(os.path.join(tmpdir, f'{i}.jpg'), save)
+            self.assertFalse(pipeline.reserve())
+            release.set()
+            pipeline.close()
+            stats = pipeline.stats()
+            self.assertEqual(stats['dropped'], 1)
+            self.assertEqual(stats['failed'], 2)
+            self.assertEqual(len(errors), 2)
+            self.assertEqual(os.listdir(tmpdir), [])
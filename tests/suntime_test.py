@@ -3,7 +3,7 @@ import json
 import os
 import sys
 import unittest
-from suntime import Suntime, parse_time
+from pilapse.suntime import Suntime, parse_time
 import logging
 
 SHOW_LOGS=False
@@ -13,23 +13,32 @@ if SHOW_LOGS:
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# URL TO GENERATE TEST DATA:
-#
+# Reference data from api.sunrisesunset.io. The local computation should agree to within a couple of minutes.
 location = (37.335480, -121.893028)
 date = '2023-06-18'
 testpath = os.path.join(THIS_DIR, 'data', f'{date}_suntime.json')
 testdata = json.load(open(testpath))
 testdate = datetime.datetime(2023, 6, 18)
+testtz = datetime.timezone(datetime.timedelta(minutes=testdata['results']['utc_offset']))
+tolerance = datetime.timedelta(minutes=2)
 
 class TestSuntime(unittest.TestCase):
     def test_value_from_name(self):
         if SHOW_LOGS:
             stream_handler = logging.StreamHandler(sys.stdout)
             logger.addHandler(stream_handler)
-        suntime = Suntime(location, date=date)
+        suntime = Suntime(location, date=date, tz=testtz)
 
         for name in suntime.valid_times():
             value = suntime.value_from_name(name)
             self.assertIsNotNone(value)
 
-            self.assertEqual(parse_time(testdata['results'][name], testdate) , value)
\ No newline at end of file
+            expected = parse_time(testdata['results'][name], testdate)
+            self.assertLess(abs(expected - value), tolerance, name)
+
+    def test_adjacent_days(self):
+        suntime = Suntime(location, date=date, tz=testtz)
+        yesterday = Suntime(location, date='2023-06-17', tz=testtz)
+        tomorrow = Suntime(location, date='2023-06-19', tz=testtz)
+        self.assertEqual(suntime.y_last_light, yesterday.last_light)
+        self.assertEqual(suntime.t_first_light, tomorrow.first_light)
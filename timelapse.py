@@ -18,7 +18,7 @@ import time
 import pause
 
 from pilapse.scheduling import Schedule
-from pilapse.threads import ImageWriter
+from pilapse.threads import CompositeWriter, ImageWriter
 from pilapse.camera_producer import CameraProducer
 
 
@@ -86,6 +86,7 @@ class TimelapseApp(Configurable):
         Schedule.add_arguments_to_parser(parser)
         CameraProducer.add_arguments_to_parser(parser)
         ImageWriter.add_arguments_to_parser(parser)
+        CompositeWriter.add_arguments_to_parser(parser)
 
         return parser
 
@@ -116,15 +117,26 @@ class TimelapseApp(Configurable):
 
         producer = None
         # create images using camera
-        producer = CameraProducer(self._shutdown_event, self._config, out_queue=self.out_queue)
-        writer = ImageWriter(self._shutdown_event, self._config, in_queue=self.out_queue)
+        compositor = None
+        if self._config.composite:
+            # camera -> compositor -> writer, so the composite is made before frames are annotated
+            composite_queue = Queue()
+            producer = CameraProducer(self._shutdown_event, self._config, out_queue=composite_queue)
+            compositor = CompositeWriter(self._shutdown_event, self._config,
+                                         in_queue=composite_queue, out_queue=self.out_queue)
+        else:
+            producer = CameraProducer(self._shutdown_event, self._config, out_queue=self.out_queue)
+        writer = ImageWriter(self._shutdown_event, self._config, in_queue=self.out_queue, upstream=compositor)
 
         writer.start()
+        if compositor is not None:
+            compositor.start()
         producer.start()
 
         while True:
             logging.debug(f'waiting: producer alive? {producer.is_alive()},  writer alive? {writer.is_alive()}')
-            if not producer.is_alive() or not writer.is_alive():
+            if not producer.is_alive() or not writer.is_alive() or \
+                    (compositor is not None and not compositor.is_alive()):
                 self._shutdown_event.set()
                 pl.set_time_to_die()
 